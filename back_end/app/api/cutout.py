@@ -1,14 +1,17 @@
 """
 Image cutout (background removal) endpoints
 """
-from datetime import datetime
-from pathlib import Path
-from uuid import uuid4
+import io
+import time
 
-from fastapi import APIRouter, File, HTTPException, UploadFile, status
-from rembg import remove
+from fastapi import APIRouter, File, HTTPException, Response, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image, UnidentifiedImageError
 
 from ..config import settings
+from ..services.cutout_service import get_cutout_service
+from ..services.rembg_pool import RembgQueueFull, RembgTimeout, get_rembg_executor
+from ..utils.metrics import CUTOUT_REQUESTS, CUTOUT_SECONDS
 
 router = APIRouter()
 
@@ -20,29 +23,77 @@ def _build_public_url(relative_path: str) -> str:
     return f"/api/files{cleaned}"
 
 
+def _check_image_size(data: bytes) -> None:
+    """Reject undecodable or oversized images from their header, before they take a worker."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported image: {exc}") from exc
+    limit = settings.REMBG_MAX_PIXELS
+    if limit and width * height > limit:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Image is {width}x{height}; the limit is {limit} pixels",
+        )
+
+
 @router.post("/remove-bg")
-async def remove_background(file: UploadFile = File(...)):
+async def remove_background(response: Response, file: UploadFile = File(...)):
+    """
+    Remove the background of an image and store the result as PNG
+
+    Inference runs on a bounded worker pool. When REMBG_MAX_PENDING removals are already
+    queued or running the request is rejected with 429 (and Retry-After); a removal that
+    takes longer than REMBG_TIMEOUT_SECONDS is answered with 504. The X-Queue-Position
+    header tells how many removals were queued ahead of this one.
+
+    Results are cached by content hash and model/options: a repeated image is answered
+    from the cache with "cached": true, without queueing.
+    """
     data = await file.read()
     if not data:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Uploaded file is empty")
+    _check_image_size(data)
 
+    service = get_cutout_service()
+    key = await run_in_threadpool(service.key, data)
+    public_path = await run_in_threadpool(service.cached, key)
+    if public_path is not None:
+        CUTOUT_REQUESTS.inc(status='cached')
+        return {
+            "status": "success",
+            "file_path": public_path,
+            "url": _build_public_url(public_path),
+            "cached": True,
+        }
+
+    executor = get_rembg_executor()
+    start = time.perf_counter()
     try:
-        processed = remove(data)
+        public_path, position = await executor.run(service.process, data, key)
+    except RembgQueueFull as exc:
+        CUTOUT_REQUESTS.inc(status='rejected')
+        queue = executor.stats()
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail={"message": str(exc), "queued": queue["queued"], "running": queue["running"]},
+            headers={"Retry-After": str(max(1, int(settings.REMBG_TIMEOUT_SECONDS or 5) // 4))},
+        ) from exc
+    except RembgTimeout as exc:
+        CUTOUT_REQUESTS.inc(status='timeout')
+        CUTOUT_SECONDS.observe(time.perf_counter() - start, status='timeout')
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(exc)) from exc
     except Exception as exc:  # pragma: no cover - rembg internal errors
+        CUTOUT_REQUESTS.inc(status='error')
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Background removal failed: {exc}") from exc
-
-    target_dir = Path("cutout") / datetime.utcnow().strftime("%Y/%m/%d")
-    filename = f"{uuid4().hex}.png"
-    relative_path = target_dir / filename
-    output_path = Path(settings.UPLOAD_FOLDER) / relative_path
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    output_path.write_bytes(processed)
-
-    public_path = str(relative_path).replace('\\', '/')
+    CUTOUT_REQUESTS.inc(status='success')
+    CUTOUT_SECONDS.observe(time.perf_counter() - start, status='success')
+    response.headers["X-Queue-Position"] = str(position)
 
     return {
         "status": "success",
         "file_path": public_path,
         "url": _build_public_url(public_path),
+        "cached": False,
     }
@@ -6,10 +6,9 @@ import importlib.util
 import requests
 import uuid
 from datetime import datetime
-from rembg import remove
-
 from poster_gen import generate_poster_pic2pic, generate_poster_text2pic, get_poster
 from ..config import settings
+from ..services.cutout_service import get_cutout_service
 
 router = APIRouter(prefix="/api/poster", tags=["Poster"])
 
@@ -45,13 +44,26 @@ def _process_art_images(urls: List[str]) -> List[str]:
     upload_dir = Path(settings.UPLOAD_FOLDER)
     temp_dir = upload_dir / 'art_tmp'
     temp_dir.mkdir(parents=True, exist_ok=True)
-    processed: List[str] = []
     uploader = uploader_cls()
+    # Download everything first so the removals are submitted together and can share
+    # micro-batched inference runs; images seen before come from the cutout cache
+    downloads: List[Optional[bytes]] = []
     for url in urls:
         try:
             resp = requests.get(url, timeout=30)
             resp.raise_for_status()
-            output_bytes = remove(resp.content)
+            downloads.append(resp.content)
+        except Exception:
+            downloads.append(None)
+    fetched = [data for data in downloads if data is not None]
+    results = iter(get_cutout_service().process_many(fetched))
+    processed: List[str] = []
+    for url, data in zip(urls, downloads):
+        output_bytes = next(results) if data is not None else None
+        if not isinstance(output_bytes, bytes):
+            processed.append(url)
+            continue
+        try:
             file_name = f"art_{uuid.uuid4().hex}.png"
             temp_path = temp_dir / file_name
             with temp_path.open('wb') as f:
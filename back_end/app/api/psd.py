@@ -1,17 +1,35 @@
 """
 PSD Processing API endpoints
 """
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status, Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status, Depends, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from pathlib import Path
+from typing import Dict, Any, AsyncIterator, List
+import json
 import os
 
 from ..config import settings
-from ..services.psd_service import PSDService
+from ..services.psd_service import PSDService, UploadTooLarge
+from ..services.psd_jobs import JobQueueFull
 
 router = APIRouter()
 psd_service = PSDService()
 
+def _validate_request(file: UploadFile, canvas_mode: str) -> str:
+    """Check the upload is a PSD/PSB and normalize canvas_mode"""
+    # Check file extension
+    if not file.filename or not file.filename.lower().endswith(('.psd', '.psb')):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only PSD files are supported"
+        )
+    
+    # canvas_mode: 'leaf' 按照 process_psd_layers.py 的导出逻辑（底层图层作为元素）
+    #              'group' 顶层分组作为元素
+    if canvas_mode not in ('leaf', 'group'):
+        canvas_mode = 'leaf'
+    return canvas_mode
+
 @router.post("/process")
 async def process_psd(
     file: UploadFile = File(...),
@@ -19,36 +37,180 @@ async def process_psd(
     output_format: str = Form('png'),
     return_canvas: bool = Form(False),
     canvas_mode: str = Form('leaf'),
+    include_metrics: bool = Form(False),
 ):
     """
     Process a PSD file by removing text layers and optionally checking for text in images
     
     - **file**: The PSD file to process
     - **skip_ocr**: Whether to skip OCR check for text in images (faster but less accurate)
-    - **output_format**: Output format (png, jpg, etc.)
+    - **output_format**: Output format (png, jpg, etc.); `webp` / `webp_lossy` also write the canvas layer images as lossless / lossy WebP
+    - **include_metrics**: Add `stage_metrics` (wall/CPU time, peak memory, layers, bytes written per stage)
     """
-    # Check file extension
-    if not file.filename.lower().endswith(('.psd', '.psb')):
+    canvas_mode = _validate_request(file, canvas_mode)
+
+    # Process the file (runs as a background job; this request waits for it)
+    try:
+        result = await psd_service.process_psd(file, skip_ocr, output_format, return_canvas, canvas_mode, include_metrics)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    
+    if result["status"] == "error":
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Only PSD files are supported"
+            detail=result["message"]
         )
     
-    # Process the file
-    # canvas_mode: 'leaf' 按照 process_psd_layers.py 的导出逻辑（底层图层作为元素）
-    #              'group' 顶层分组作为元素
+    return result
+
+def _encode_event(event: Dict[str, Any], stream_format: str) -> str:
+    data = json.dumps(event, ensure_ascii=False)
+    if stream_format == 'sse':
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+@router.post("/process/stream")
+async def process_psd_stream(
+    file: UploadFile = File(...),
+    skip_ocr: bool = Form(False),
+    output_format: str = Form('png'),
+    canvas_mode: str = Form('leaf'),
+    stream_format: str = Form('ndjson'),
+    include_metrics: bool = Form(False),
+):
+    """
+    Process a PSD file and stream canvas items as they are exported
+    
+    Same parameters as **/process** (the canvas is always returned). Each line (NDJSON) or
+    event (SSE, **stream_format=sse**) is one JSON object with a `type`:
+    `job`, `progress`, `background`, `cloud` (with `order`, its index in the final clouds list),
+    then `result` (the same body as **/process**) or `error`.
+    """
+    canvas_mode = _validate_request(file, canvas_mode)
+    stream_format = 'sse' if stream_format == 'sse' else 'ndjson'
+
+    try:
+        job, events = await psd_service.stream_psd(file, skip_ocr, output_format, canvas_mode, include_metrics)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+    async def body() -> AsyncIterator[str]:
+        async for event in events:
+            yield _encode_event(event, stream_format)
+
+    media_type = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    # Disable proxy buffering so items reach the editor as soon as they are written
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_psd_job(
+    file: UploadFile = File(...),
+    skip_ocr: bool = Form(False),
+    output_format: str = Form('png'),
+    return_canvas: bool = Form(False),
+    canvas_mode: str = Form('leaf'),
+    include_metrics: bool = Form(False),
+):
+    """
+    Queue a PSD file for background processing and return its job id immediately
+    
+    Same parameters as **/process**. Poll **/jobs/{job_id}** for progress and the result.
+    """
+    canvas_mode = _validate_request(file, canvas_mode)
+
+    try:
+        job = await psd_service.submit_job(file, skip_ocr, output_format, return_canvas, canvas_mode, include_metrics=include_metrics)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+    return {
+        "status": "success",
+        "job_id": job.id,
+        "job": {**job.to_dict(), "queue_position": psd_service.jobs.queue_position(job)},
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_psd_job(job_id: str):
+    """
+    Get status, progress and (once finished) the result of a PSD job
+    
+    - **job_id**: Id returned by **POST /jobs**
+    """
+    job = psd_service.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    return {**job.to_dict(), "queue_position": psd_service.jobs.queue_position(job)}
+
+@router.post("/batch", status_code=status.HTTP_202_ACCEPTED)
+async def submit_psd_batch(
+    response: Response,
+    files: List[UploadFile] = File(...),
+    skip_ocr: bool = Form(False),
+    output_format: str = Form('png'),
+    canvas_mode: str = Form('leaf'),
+    include_metrics: bool = Form(False),
+    wait: bool = Form(False),
+):
+    """
+    Queue many PSD files at once and return one manifest for all of them
+    
+    - **files**: PSD/PSB files and/or zip archives of them (other entries are listed as skipped)
+    - **wait**: Block until every document is done and return the finished manifest (200)
+    
+    Other parameters as **/process**; the canvas is always included. Without **wait** the
+    manifest is returned immediately (202); poll **/batch/{batch_id}** until its `status` is `done`.
+    """
     if canvas_mode not in ('leaf', 'group'):
         canvas_mode = 'leaf'
 
-    result = await psd_service.process_psd(file, skip_ocr, output_format, return_canvas, canvas_mode)
+    try:
+        batch = await psd_service.submit_batch(files, skip_ocr, output_format, canvas_mode, include_metrics)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if wait:
+        response.status_code = status.HTTP_200_OK
+        return await psd_service.wait_batch(batch)
+    return batch.manifest()
+
+@router.get("/batch/{batch_id}")
+async def get_psd_batch(batch_id: str):
+    """
+    Get the manifest of a batch: per-document status, progress, output path and canvas JSON
     
-    if result["status"] == "error":
+    - **batch_id**: Id returned by **POST /batch**
+    """
+    batch = psd_service.get_batch(batch_id)
+    if batch is None:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=result["message"]
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Batch not found"
         )
-    
-    return result
+    return batch.manifest()
+
+@router.get("/cache")
+async def get_psd_cache_stats():
+    """
+    Hit/miss counters and disk usage of the processed-PSD result cache, plus reference
+    counts of the deduplicated layer images shared between cached canvases
+    """
+    shared = {"shared_assets": psd_service.asset_store.stats()} if psd_service.asset_store is not None else {}
+    if psd_service.cache is None:
+        return {"enabled": False, **shared}
+    return {"enabled": True, **psd_service.cache.stats(), **shared}
 
 @router.get("/download/{file_path:path}")
 async def download_file(file_path: str):
@@ -20,11 +20,57 @@ class Settings(BaseSettings):
 
     # File upload settings
     UPLOAD_FOLDER: str = str(Path(__file__).parent.parent / "uploads")
-    MAX_CONTENT_LENGTH: int = 16 * 1024 * 1024  # 16MB max upload size
+    MAX_CONTENT_LENGTH: int = 2 * 1024 * 1024 * 1024  # 2GB max upload size (PSB), enforced while streaming; 0 = no limit
     ALLOWED_EXTENSIONS: Set[str] = {"psd"}
 
     # PSD processing settings
     TESSERACT_CMD: str = "/usr/bin/tesseract"  # Update this path based on your system
+    OCR_STAGED: bool = True  # Pre-filter layers (size/alpha/edges/MSER) and OCR only cropped text regions
+    OCR_TARGET_DPI: int = 150  # Candidate crops are downscaled to this resolution before tesseract
+    OCR_ROI_MIN_SIDE: int = 8  # Opaque layer regions with a shorter side (px) are not OCR'd
+    OCR_ROI_MIN_AREA: int = 256  # Opaque layer regions with a smaller bounding box area (px) are not OCR'd
+    OCR_WORKERS: int = 0  # Concurrent tesseract processes; 0 = one per CPU
+    OCR_BATCH_SIZE: int = 8  # Images per tesseract invocation (multi-page TIFF); 1 = one call per image
+    PSD_EXPORT_WORKERS: int = 0  # Parallel layer export workers; 0 = one per CPU (at most 8), 1 = serial
+    PSD_EXPORT_EXECUTOR: str = "thread"  # "thread" (shared document) or "process" (per-request worker processes that each re-parse the PSD; for large offline jobs)
+    PSD_RENDER_CACHE_BYTES: int = 512 * 1024 * 1024  # Per-request budget for layer bitmaps shared by OCR and export
+    PSD_LAZY_LOAD_MIN_BYTES: int = 256 * 1024 * 1024  # Memory-map files at least this large; 0 = always, -1 = never
+    PSD_TILED_COMPOSE_MIN_PIXELS: int = 100_000_000  # Stream the flattened PNG/TIFF band by band from this canvas size; 0 = always, -1 = never
+    PSD_COMPOSE_BAND_ROWS: int = 512  # Rows per band when composing tiled
+    PSD_ASSET_TRIM: bool = True  # Crop canvas layer images to their alpha bounding box (cloud position is adjusted)
+    PSD_ASSET_QUANTIZE: bool = False  # Write palette PNGs for flat layers with few colours (lossless)
+    PSD_ASSET_QUANTIZE_COLORS: int = 256  # Most distinct RGBA colours a layer may have to be palettized
+    PSD_ASSET_PNG_COMPRESS_LEVEL: int = 6  # zlib level for PNG assets (0-9)
+    PSD_ASSET_WEBP_QUALITY: int = 85  # Quality for output_format=webp_lossy
+    PSD_PREVIEW_SIZES: List[int] = [128, 512]  # Longest-side preview sizes written for every layer asset and the output; [] = off
+    PSD_ASSET_DEDUP: bool = True  # Store identical layer images once under uploads/canvas/shared, shared between documents (needs PSD_CACHE_ENABLED)
+    PSD_ASSET_DEDUP_GRACE_SECONDS: int = 600  # Unreferenced shared images are kept this long before deletion
+    PSD_ASSET_MEASURE_SAVINGS: bool = False  # Also encode the untrimmed PNG per layer to report bytes saved
+    PSD_JOB_WORKERS: int = 2  # PSD documents processed concurrently off the event loop
+    PSD_JOB_MAX_PENDING: int = 16  # Queued + running jobs before new submissions get 429
+    PSD_JOB_TTL_SECONDS: int = 3600  # How long finished job results stay pollable
+    PSD_BATCH_MAX_FILES: int = 100  # Documents per batch request (files plus zip members)
+    PSD_BATCH_WORKERS: int = 0  # Batch documents processed concurrently, on threads separate from PSD_JOB_WORKERS; 0 = one per CPU
+    PSD_BATCH_MAX_PENDING: int = 200  # Queued + running batch jobs; counted separately from PSD_JOB_MAX_PENDING
+    PSD_CACHE_ENABLED: bool = True  # Reuse results for re-uploaded PSDs with the same options
+    PSD_CACHE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # LRU budget for cached outputs + layer assets (shared images counted per canvas)
+
+    # Background removal (rembg) settings
+    REMBG_MODEL: str = "u2net"  # rembg model name (u2net, u2netp, isnet-general-use, bria-rmbg, ...)
+    REMBG_MODEL_PATH: str = ""  # ONNX file for the *_custom models (must be inside rembg's model directory, ~/.rembg)
+    REMBG_SESSIONS: int = 1  # Sessions (= concurrent inferences) per process; 0 = CPU cores / REMBG_INTRA_OP_THREADS
+    REMBG_INTRA_OP_THREADS: int = 0  # onnxruntime threads per inference; 0 = onnxruntime default
+    REMBG_INTER_OP_THREADS: int = 0  # onnxruntime threads across graph nodes; 0 = onnxruntime default
+    REMBG_PRELOAD: bool = True  # Load and warm the sessions at startup instead of on the first request
+    REMBG_BATCH_SIZE: int = 1  # Max images per ONNX run; > 1 batches concurrent removals (u2net-family models only)
+    REMBG_BATCH_MAX_WAIT_MS: float = 10  # How long the first image of a batch waits for more to arrive
+    REMBG_MAX_PENDING: int = 8  # Queued + running removals before new requests get 429; 0 = no limit
+    REMBG_TIMEOUT_SECONDS: float = 60  # Per-request wait for a removal before answering 504; 0 = no limit
+    REMBG_REDUCED_SIDE: int = 1024  # Longer inputs are segmented at this size and the mask upsampled; 0 = always full resolution
+    REMBG_REFINE_MASK: bool = True  # Guided-filter (edge-aware) mask upsampling on the reduced path instead of bilinear
+    REMBG_MAX_PIXELS: int = 50_000_000  # Larger images are rejected with 413 before queueing; 0 = no limit
+    CUTOUT_CACHE_ENABLED: bool = True  # Reuse background removal results for identical images with the same model/options
+    CUTOUT_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024  # LRU budget for cached cutout PNGs (cutout/cache)
 
     # Pydantic v2 / pydantic-settings v2 config
     model_config = SettingsConfigDict(
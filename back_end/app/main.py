@@ -1,12 +1,30 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from .config import settings
 from .api import psd, files, templates, materials, poster, cutout
+from .services.rembg_pool import get_rembg_pool
+from .utils.metrics import REGISTRY
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the background-removal model once, before the first request needs it
+    if settings.REMBG_PRELOAD:
+        try:
+            stats = await run_in_threadpool(get_rembg_pool().warmup)
+            print(f"rembg sessions ready: {stats}")
+        except Exception as e:
+            # Requests will retry creating the sessions on first use
+            print(f"rembg warmup error: {e}")
+    yield
 
 app = FastAPI(
     title="Poster Design API",
     description="API for processing PSD files in the Poster Design application",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS middleware configuration
@@ -30,6 +48,11 @@ app.include_router(cutout.router, prefix="/api/cutout", tags=["Cutout"])
 async def root():
     return {"message": "Welcome to Poster Design API"}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of request and per-stage PSD metrics"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,121 @@
+"""
+Background removal for large images: segment a reduced copy, upsample the mask guided by the original
+"""
+import io
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+from rembg.bg import naive_cutout
+
+from .rembg_pool import RembgSessionPool
+
+# Guided filter radius (in pixels of the reduced image) and regularization; a larger eps
+# smooths more, a smaller one follows the guide's edges more closely
+REFINE_RADIUS = 4
+REFINE_EPS = 1e-3
+
+# Full-resolution tile size for refinement; tiles over flat mask regions are skipped
+_TILE = 256
+
+# Mask range (0..255) within the filter window below which a region counts as flat
+_FLAT_TOLERANCE = 2
+
+
+def decode_reduced(data: bytes, max_side: int) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    The upright image reduced to at most max_side on its long side, plus its full upright
+    size. JPEGs are decoded in draft mode (DCT scaling by 1/2, 1/4 or 1/8), so the full
+    resolution is never decoded here.
+    """
+    img = Image.open(io.BytesIO(data))
+    full_size = img.size
+    if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+        full_size = (full_size[1], full_size[0])
+    scale = max_side / max(full_size)
+    if scale < 1:
+        img.draft('RGB', (max(1, int(img.size[0] * scale)), max(1, int(img.size[1] * scale))))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    return img.convert('RGB'), full_size
+
+
+def _box(arr: np.ndarray, radius: int) -> np.ndarray:
+    return cv2.boxFilter(arr, -1, (2 * radius + 1, 2 * radius + 1), borderType=cv2.BORDER_REFLECT)
+
+
+def guided_upsample(mask: Image.Image, guide: Image.Image, full: Image.Image,
+                    radius: int = REFINE_RADIUS, eps: float = REFINE_EPS) -> Image.Image:
+    """
+    Upsample a low-resolution mask to full's size with the fast guided filter (He & Sun):
+    the local linear model mask ~ a * luma + b is fitted on the reduced guide, a and b are
+    upsampled bilinearly, and applied to the full-resolution luma. Mask edges snap to edges
+    in the original instead of being blurred by interpolation.
+
+    Where the mask is flat across the filter window a = 0 and the result is the mask value
+    itself, so only tiles touching soft or edge pixels are refined; the rest of the image
+    is a plain bilinear upsample.
+    """
+    m8 = np.asarray(mask.convert('L'))
+    p = m8.astype(np.float32) / 255
+    g = np.asarray(guide.convert('L'), np.float32) / 255
+    mean_g, mean_p = _box(g, radius), _box(p, radius)
+    var_g = _box(g * g, radius) - mean_g * mean_g
+    a = (_box(g * p, radius) - mean_g * mean_p) / (var_g + eps)
+    b = mean_p - a * mean_g
+    # a and b as one two-channel array (b pre-scaled to 0..255), so each tile needs a single remap
+    coeffs = cv2.merge([_box(a, radius), _box(b, radius) * 255 + 0.5])
+
+    # Low-res pixels whose filter footprint (two box passes) is not flat
+    window = np.ones((4 * radius + 3, 4 * radius + 3), np.uint8)
+    uneven = (cv2.dilate(m8, window).astype(np.int16) - cv2.erode(m8, window)) > _FLAT_TOLERANCE
+
+    width, height = full.size
+    src_h, src_w = m8.shape
+    out = cv2.resize(m8, (width, height), interpolation=cv2.INTER_LINEAR)
+    if not uneven.any():
+        return Image.fromarray(out, mode='L')
+    luma = np.asarray(full.convert('L'))
+    # Pixel-center aligned sample positions in the reduced image, as cv2.resize uses
+    xs = (np.arange(width, dtype=np.float32) + 0.5) * (src_w / width) - 0.5
+    ys = (np.arange(height, dtype=np.float32) + 0.5) * (src_h / height) - 0.5
+    for top in range(0, height, _TILE):
+        bottom = min(top + _TILE, height)
+        y0, y1 = max(0, int(ys[top])), min(src_h, int(ys[bottom - 1]) + 2)
+        for left in range(0, width, _TILE):
+            right = min(left + _TILE, width)
+            x0, x1 = max(0, int(xs[left])), min(src_w, int(xs[right - 1]) + 2)
+            if not uneven[y0:y1, x0:x1].any():
+                continue
+            map_x = np.broadcast_to(xs[None, left:right], (bottom - top, right - left))
+            map_y = np.broadcast_to(ys[top:bottom, None], (bottom - top, right - left))
+            tile = cv2.remap(coeffs, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            q = tile[..., 0] * luma[top:bottom, left:right] + tile[..., 1]
+            out[top:bottom, left:right] = np.clip(q, 0, 255).astype(np.uint8)
+    return Image.fromarray(out, mode='L')
+
+
+def remove_reduced(data: bytes, pool: RembgSessionPool, max_side: int, refine: bool = True) -> Optional[bytes]:
+    """
+    rembg.remove(data) for large images: the model sees a max_side copy (it works at 320x320
+    anyway), the mask is upsampled with guided_upsample (or plain bilinear when refine is
+    off) and applied to the original pixels with rembg's naive cutout. Returns None when
+    the image is no larger than max_side, so the caller can use the normal path.
+    """
+    with Image.open(io.BytesIO(data)) as probe:
+        if max(probe.size) <= max_side:
+            return None
+    small, _ = decode_reduced(data, max_side)
+    mask = pool.remove(small, only_mask=True)
+    full = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if full.mode not in ('RGB', 'RGBA'):
+        full = full.convert('RGB')
+    if refine:
+        full_mask = guided_upsample(mask, small, full)
+    else:
+        full_mask = mask.resize(full.size, Image.Resampling.BILINEAR)
+    cutout = naive_cutout(full, full_mask)
+    buf = io.BytesIO()
+    cutout.save(buf, 'PNG')
+    return buf.getvalue()
@@ -0,0 +1,142 @@
+"""
+Background removal service with a content-hash result cache
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, List, Union
+
+from ..config import settings
+from ..utils.asset_cache import AssetLRUCache, cache_key
+from ..utils.metrics import REGISTRY, CUTOUT_CACHE
+from .cutout_mask import remove_reduced
+from .rembg_pool import get_rembg_pool, get_rembg_executor
+
+
+class CutoutService:
+    """
+    Background removal for the cutout and poster endpoints. Results are cached by the
+    sha256 of the input bytes plus the model and options that change the output; a cached
+    PNG lives at cutout/cache/<key[:2]>/<key>.png, so identical inputs share one file and
+    concurrent misses for the same input write the same path. The cache's LRU budget
+    bounds those files; with the cache disabled results go to cutout/<date>/ as before.
+    """
+
+    def __init__(self):
+        self.upload_dir = Path(settings.UPLOAD_FOLDER)
+        self.cache: Optional[AssetLRUCache] = None
+        if settings.CUTOUT_CACHE_ENABLED:
+            self.cache = AssetLRUCache(
+                root=str(self.upload_dir),
+                index_path=str(self.upload_dir / '.cache' / 'cutout_index.json'),
+                max_bytes=settings.CUTOUT_CACHE_MAX_BYTES,
+            )
+        REGISTRY.add_collector(self._collect_metrics)
+
+    def _collect_metrics(self):
+        if self.cache is not None:
+            for field, value in self.cache.stats().items():
+                CUTOUT_CACHE.set(value, field=field)
+
+    def key(self, data: bytes) -> str:
+        """Cache key for data under the current model and cutout options."""
+        return cache_key(
+            hashlib.sha256(data).hexdigest(),
+            model=settings.REMBG_MODEL,
+            model_path=settings.REMBG_MODEL_PATH,
+            reduced_side=settings.REMBG_REDUCED_SIDE,
+            refine=settings.REMBG_REFINE_MASK,
+        )
+
+    def cached(self, key: str) -> Optional[str]:
+        """Relative path of the cached cutout for key, or None (counted as a miss)."""
+        if self.cache is None:
+            return None
+        value = self.cache.get(key)
+        return value["file_path"] if value else None
+
+    def remove_background(self, data: bytes) -> bytes:
+        """PNG cutout of data; images longer than REMBG_REDUCED_SIDE are segmented reduced."""
+        pool = get_rembg_pool()
+        processed = None
+        if settings.REMBG_REDUCED_SIDE:
+            processed = remove_reduced(data, pool, settings.REMBG_REDUCED_SIDE, settings.REMBG_REFINE_MASK)
+        if processed is None:
+            processed = pool.remove(data)
+        return processed
+
+    def save(self, key: str, png: bytes) -> str:
+        """Write a cutout under UPLOAD_FOLDER and return its relative path; cached if enabled."""
+        if self.cache is None:
+            relative_path = Path("cutout") / datetime.utcnow().strftime("%Y/%m/%d") / f"{uuid.uuid4().hex}.png"
+        else:
+            relative_path = Path("cutout") / "cache" / key[:2] / f"{key}.png"
+        output_path = self.upload_dir / relative_path
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        # Readers of a cached path never see a partially written file
+        tmp = output_path.with_name(f"{output_path.stem}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(png)
+        os.replace(tmp, output_path)
+        relative = str(relative_path).replace('\\', '/')
+        if self.cache is not None:
+            relative = self.cache.put(key, {"file_path": relative}, [relative])["file_path"]
+        return relative
+
+    def process(self, data: bytes, key: Optional[str] = None) -> str:
+        """Remove the background of data and save it; returns the relative path. Runs on an inference worker."""
+        key = key or self.key(data)
+        return self.save(key, self.remove_background(data))
+
+    def process_many(self, items: List[bytes]) -> List[Union[bytes, Exception]]:
+        """
+        PNG cutouts for several images: cache hits are read back from disk, misses are
+        submitted together to the shared inference executor (so they can share
+        micro-batched runs, and count against REMBG_MAX_PENDING like /remove-bg calls)
+        and cached. All misses share one REMBG_TIMEOUT_SECONDS deadline. Failed, rejected
+        or timed-out items come back as the exception instead of bytes.
+        """
+        executor = get_rembg_executor()
+        results: List[Union[bytes, Exception, None]] = [None] * len(items)
+        misses = []
+        for i, data in enumerate(items):
+            try:
+                key = self.key(data)
+                relative = self.cached(key)
+                if relative is not None:
+                    try:
+                        results[i] = (self.upload_dir / relative).read_bytes()
+                        continue
+                    except OSError:
+                        pass
+                future, _ = executor.submit(self.remove_background, data)
+                misses.append((i, key, future))
+            except Exception as e:
+                results[i] = e
+
+        deadline = time.monotonic() + executor.timeout if executor.timeout else None
+        for i, key, future in misses:
+            try:
+                png = executor.wait(future, None if deadline is None else max(0.0, deadline - time.monotonic()))
+                if self.cache is not None:
+                    self.save(key, png)
+                results[i] = png
+            except Exception as e:
+                results[i] = e
+        return results  # type: ignore[return-value]
+
+
+_service: Optional[CutoutService] = None
+_service_lock = threading.Lock()
+
+
+def get_cutout_service() -> CutoutService:
+    """The process-wide cutout service."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = CutoutService()
+        return _service
@@ -0,0 +1,214 @@
+"""
+Background job queue for PSD processing
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, Callable, List, Tuple
+
+ProgressCallback = Callable[[str, float], None]
+
+
+class JobQueueFull(Exception):
+    """Raised when the number of queued + running jobs reaches the configured limit."""
+
+
+@dataclass
+class PSDJob:
+    id: str
+    status: str = 'queued'  # queued | running | success | error
+    stage: str = 'queued'
+    progress: float = 0.0
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    batch_id: Optional[str] = None
+    future: Optional[Future] = field(default=None, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('success', 'error')
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == 'success':
+            data["result"] = self.result
+        if self.error:
+            data["message"] = self.error
+        return data
+
+
+@dataclass
+class PSDBatch:
+    """Several jobs submitted together; items are (file name, job) in upload order."""
+    id: str
+    items: List[Tuple[str, PSDJob]]
+    skipped: List[str] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    manifest_path: Optional[str] = None  # Written once every job has finished
+
+    @property
+    def done(self) -> bool:
+        return all(job.done for _, job in self.items)
+
+    def manifest(self) -> Dict[str, Any]:
+        jobs = [job for _, job in self.items]
+        finished = [job.finished_at for job in jobs if job.finished_at]
+        return {
+            "batch_id": self.id,
+            "status": 'done' if self.done else 'running',
+            "total": len(jobs),
+            "succeeded": sum(1 for job in jobs if job.status == 'success'),
+            "failed": sum(1 for job in jobs if job.status == 'error'),
+            "pending": sum(1 for job in jobs if not job.done),
+            "created_at": self.created_at,
+            "finished_at": max(finished) if self.done and finished else None,
+            "manifest_path": self.manifest_path,
+            "skipped": self.skipped,
+            "files": [{"name": name, **job.to_dict()} for name, job in self.items],
+        }
+
+
+class PSDJobManager:
+    """
+    Runs blocking PSD work on a bounded thread pool and keeps an in-memory job table.
+    Batch jobs run on a pool of their own (batch_workers threads, 0 = one per CPU), so a
+    large batch never queues interactive requests behind it and its documents are
+    processed concurrently.
+
+    Finished jobs are kept for `ttl` seconds so clients can poll for the result.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 16, ttl: int = 3600, batch_workers: int = 0):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='psd-job')
+        self.batch_workers = batch_workers if batch_workers > 0 else (os.cpu_count() or 1)
+        self._batch_executor = ThreadPoolExecutor(max_workers=self.batch_workers, thread_name_prefix='psd-batch')
+        self._jobs: Dict[str, PSDJob] = {}
+        self._lock = threading.Lock()
+        self.max_pending = max_pending
+        self.ttl = ttl
+
+    def submit(self, fn: Callable[[ProgressCallback], Dict[str, Any]],
+               on_cancel: Optional[Callable[[], None]] = None) -> PSDJob:
+        """
+        Queue fn(progress) and return its job immediately. fn returns the usual status dict.
+        on_cancel runs if the job is cancelled before fn starts (e.g. to delete its upload).
+        """
+        with self._lock:
+            self._prune()
+            # Batch jobs have their own limit (submit_many)
+            pending = sum(1 for j in self._jobs.values() if not j.done and j.batch_id is None)
+            if self.max_pending and pending >= self.max_pending:
+                raise JobQueueFull(f"Too many PSD jobs in progress ({pending}), try again later")
+            job = PSDJob(id=uuid.uuid4().hex)
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job, fn)
+        job.future.add_done_callback(lambda future: self._settle(job, future, on_cancel))
+        return job
+
+    def submit_many(self, fns: List[Callable[[ProgressCallback], Dict[str, Any]]], batch_id: str,
+                    max_pending: int = 0,
+                    on_cancel: Optional[List[Optional[Callable[[], None]]]] = None) -> List[PSDJob]:
+        """
+        Queue a batch of jobs on the batch pool, all or none: raises JobQueueFull if the
+        batch jobs already pending plus these would exceed max_pending (0 = no limit).
+        on_cancel, if given, holds one submit()-style cancel hook per function.
+        """
+        with self._lock:
+            self._prune()
+            pending = sum(1 for j in self._jobs.values() if not j.done and j.batch_id is not None)
+            if max_pending and pending + len(fns) > max_pending:
+                raise JobQueueFull(f"Too many batch PSD jobs in progress ({pending}), try again later")
+            jobs = [PSDJob(id=uuid.uuid4().hex, batch_id=batch_id) for _ in fns]
+            for job in jobs:
+                self._jobs[job.id] = job
+        for job, fn, cancel in zip(jobs, fns, on_cancel or [None] * len(fns)):
+            job.future = self._batch_executor.submit(self._run, job, fn)
+            job.future.add_done_callback(lambda future, job=job, cancel=cancel: self._settle(job, future, cancel))
+        return jobs
+
+    def get(self, job_id: str) -> Optional[PSDJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_position(self, job: PSDJob) -> int:
+        """Number of queued jobs ahead of this one on its pool (0 once it is running)."""
+        if job.status != 'queued':
+            return 0
+        batch = job.batch_id is not None
+        with self._lock:
+            return sum(1 for j in self._jobs.values()
+                       if j.status == 'queued' and (j.batch_id is not None) == batch and j.created_at < job.created_at)
+
+    def counts(self) -> Dict[str, int]:
+        """Jobs in the table by status."""
+        with self._lock:
+            counts = {'queued': 0, 'running': 0, 'success': 0, 'error': 0}
+            for j in self._jobs.values():
+                counts[j.status] = counts.get(j.status, 0) + 1
+            return counts
+
+    async def wait(self, job: PSDJob) -> Dict[str, Any]:
+        """
+        Await a job's result from the event loop without blocking it. Cancelling the
+        waiter (client disconnect) leaves the job itself running or queued.
+        """
+        return await asyncio.shield(asyncio.wrap_future(job.future))
+
+    def _run(self, job: PSDJob, fn: Callable[[ProgressCallback], Dict[str, Any]]) -> Dict[str, Any]:
+        job.status = 'running'
+        job.stage = 'running'
+        job.started_at = time.time()
+
+        def progress(stage: str, fraction: float):
+            job.stage = stage
+            job.progress = round(fraction, 4)
+
+        try:
+            result = fn(progress)
+        except Exception as e:
+            result = {"status": "error", "message": f"Failed to process PSD: {str(e)}"}
+        job.result = result
+        if result.get("status") == "error":
+            job.error = result.get("message")
+            job.status = 'error'
+        else:
+            job.progress = 1.0
+            job.status = 'success'
+        job.finished_at = time.time()
+        return result
+
+    @staticmethod
+    def _settle(job: PSDJob, future: Future, on_cancel: Optional[Callable[[], None]]) -> None:
+        """A job whose future was cancelled never ran: record it as failed and clean up."""
+        if not future.cancelled():
+            return
+        job.status = 'error'
+        job.stage = 'cancelled'
+        job.error = "Job was cancelled before it started"
+        job.result = {"status": "error", "message": job.error}
+        job.finished_at = time.time()
+        if on_cancel is not None:
+            try:
+                on_cancel()
+            except Exception as e:
+                print(f"job cancel cleanup error: {e}")
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [k for k, j in self._jobs.items() if j.done and (j.finished_at or 0) < cutoff]:
+            del self._jobs[job_id]
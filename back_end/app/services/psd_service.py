@@ -1,22 +1,113 @@
 """
 PSD processing service
 """
+import asyncio
+import hashlib
+import json
 import os
+import threading
+import time
 import uuid
+import zipfile
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable, Tuple, BinaryIO, AsyncIterator, List
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 
 from ..config import settings
 from ..utils.psd_utils import PSDProcessor
+from ..utils.ocr_executor import OCRExecutor
+from ..utils.asset_optimize import AssetOptions, output_extension
+from ..utils.asset_store import SharedAssetStore
+from ..utils.metrics import REGISTRY, PSD_REQUESTS, PSD_JOBS, PSD_RESULT_CACHE
+from ..utils.asset_cache import AssetLRUCache, cache_key, file_digest
+from .psd_jobs import PSDJobManager, PSDJob, PSDBatch, JobQueueFull
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+PSD_EXTENSIONS = {'.psd', '.psb'}
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds settings.MAX_CONTENT_LENGTH."""
+
 
 class PSDService:
     def __init__(self):
-        self.psd_processor = PSDProcessor(tesseract_cmd=settings.TESSERACT_CMD)
         self.upload_dir = Path(settings.UPLOAD_FOLDER)
+        self.asset_store: Optional[SharedAssetStore] = None
+        # References are released when the result cache evicts a canvas, so without the
+        # cache nothing would ever free the shared images
+        if settings.PSD_ASSET_DEDUP and settings.PSD_CACHE_ENABLED:
+            self.asset_store = SharedAssetStore(
+                root=str(self.upload_dir),
+                dir='canvas/shared',
+                index_path=str(self.upload_dir / '.cache' / 'shared_assets.json'),
+                grace=settings.PSD_ASSET_DEDUP_GRACE_SECONDS,
+            )
+        self.psd_processor = PSDProcessor(
+            tesseract_cmd=settings.TESSERACT_CMD,
+            export_workers=settings.PSD_EXPORT_WORKERS,
+            export_executor=settings.PSD_EXPORT_EXECUTOR,
+            ocr_staged=settings.OCR_STAGED,
+            ocr_target_dpi=settings.OCR_TARGET_DPI,
+            ocr_roi_min_side=settings.OCR_ROI_MIN_SIDE,
+            ocr_roi_min_area=settings.OCR_ROI_MIN_AREA,
+            ocr_workers=settings.OCR_WORKERS,
+            ocr_batch_size=settings.OCR_BATCH_SIZE,
+            render_cache_bytes=settings.PSD_RENDER_CACHE_BYTES,
+            lazy_load_min_bytes=settings.PSD_LAZY_LOAD_MIN_BYTES,
+            asset_options=AssetOptions(
+                trim=settings.PSD_ASSET_TRIM,
+                quantize=settings.PSD_ASSET_QUANTIZE,
+                max_colors=settings.PSD_ASSET_QUANTIZE_COLORS,
+                png_compress_level=settings.PSD_ASSET_PNG_COMPRESS_LEVEL,
+                quality=settings.PSD_ASSET_WEBP_QUALITY,
+                measure_savings=settings.PSD_ASSET_MEASURE_SAVINGS,
+                preview_sizes=tuple(settings.PSD_PREVIEW_SIZES),
+            ),
+            asset_store=self.asset_store,
+            tiled_compose_min_pixels=settings.PSD_TILED_COMPOSE_MIN_PIXELS,
+            compose_band_rows=settings.PSD_COMPOSE_BAND_ROWS,
+        )
+        self.jobs = PSDJobManager(
+            workers=settings.PSD_JOB_WORKERS,
+            max_pending=settings.PSD_JOB_MAX_PENDING,
+            ttl=settings.PSD_JOB_TTL_SECONDS,
+            batch_workers=settings.PSD_BATCH_WORKERS,
+        )
+        # Each batch worker thread gets its own tesseract pool (see _batch_ocr_executor)
+        self._batch_local = threading.local()
+        self.batches: Dict[str, PSDBatch] = {}
+        self._batch_lock = threading.Lock()
+        self.cache: Optional[AssetLRUCache] = None
+        if settings.PSD_CACHE_ENABLED:
+            self.cache = AssetLRUCache(
+                root=str(self.upload_dir),
+                index_path=str(self.upload_dir / '.cache' / 'psd_index.json'),
+                max_bytes=settings.PSD_CACHE_MAX_BYTES,
+                # Evicted canvases give up their references to shared layer images
+                on_delete=self.asset_store.release if self.asset_store is not None else None,
+            )
+        REGISTRY.add_collector(self._collect_metrics)
+
+    def _collect_metrics(self):
+        """Refresh job and cache gauges when /metrics is scraped."""
+        for state, count in self.jobs.counts().items():
+            PSD_JOBS.set(count, state=state)
+        if self.cache is not None:
+            for field, value in self.cache.stats().items():
+                PSD_RESULT_CACHE.set(value, field=field)
         
-    async def save_upload_file(self, file: UploadFile) -> Path:
-        """Save uploaded file to the uploads directory"""
+    async def save_upload_file(self, file: UploadFile) -> Tuple[Path, str]:
+        """
+        Stream the uploaded file to the uploads directory in chunks.
+        Returns the saved path and the sha256 of its content, computed while copying.
+        """
+        limit = settings.MAX_CONTENT_LENGTH
+        # Reject early when the size is already known from the multipart part
+        if limit and file.size is not None and file.size > limit:
+            raise UploadTooLarge(f"File exceeds the maximum upload size of {limit} bytes")
+
         # Create a unique filename to prevent collisions
         file_ext = Path(file.filename).suffix if file.filename else '.psd'
         file_name = f"{uuid.uuid4()}{file_ext}"
@@ -25,13 +116,57 @@ class PSDService:
         # Ensure upload directory exists
         self.upload_dir.mkdir(parents=True, exist_ok=True)
         
-        # Save the file
-        with file_path.open('wb') as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Save the file off the event loop; never holds more than one chunk in memory
+        try:
+            digest = await run_in_threadpool(self._copy_upload, file.file, file_path, limit)
+        except BaseException:
+            file_path.unlink(missing_ok=True)
+            raise
             
-        return file_path
+        return file_path, digest
+
+    @staticmethod
+    def _copy_upload(src: BinaryIO, dest: Path, limit: int) -> str:
+        src.seek(0)
+        h = hashlib.sha256()
+        written = 0
+        with dest.open('wb') as buffer:
+            for chunk in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b''):
+                written += len(chunk)
+                if limit and written > limit:
+                    raise UploadTooLarge(f"File exceeds the maximum upload size of {limit} bytes")
+                h.update(chunk)
+                buffer.write(chunk)
+        return h.hexdigest()
     
+    async def submit_job(
+        self,
+        file: UploadFile,
+        skip_ocr: bool = False,
+        output_format: str = 'png',
+        return_canvas: bool = False,
+        canvas_mode: str = 'leaf',
+        on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+        include_metrics: bool = False,
+    ) -> PSDJob:
+        """
+        Save the upload and queue it for background processing; returns the job immediately.
+        on_event is called from the worker thread with progress and canvas events.
+        include_metrics adds the per-stage timing/memory report to the result.
+        """
+        input_path, content_hash = await self.save_upload_file(file)
+        try:
+            return self.jobs.submit(
+                lambda progress: self._process_saved_file(
+                    input_path, skip_ocr, output_format, return_canvas, canvas_mode,
+                    self._progress_events(progress, on_event), content_hash, on_event, include_metrics,
+                ),
+                on_cancel=lambda: input_path.unlink(missing_ok=True),
+            )
+        except JobQueueFull:
+            input_path.unlink(missing_ok=True)
+            raise
+
     async def process_psd(
         self, 
         file: UploadFile, 
@@ -39,16 +174,293 @@ class PSDService:
         output_format: str = 'png',
         return_canvas: bool = False,
         canvas_mode: str = 'leaf',
+        include_metrics: bool = False,
     ) -> Dict[str, Any]:
         """
-        Process a PSD file by removing text layers and optionally checking for text in images
+        Process a PSD file by removing text layers and optionally checking for text in images.
+        Runs as a background job and waits for it, so the event loop stays free meanwhile.
         """
         try:
-            # Save the uploaded file
-            input_path = await self.save_upload_file(file)
-            
+            job = await self.submit_job(file, skip_ocr, output_format, return_canvas, canvas_mode, include_metrics=include_metrics)
+        except (JobQueueFull, UploadTooLarge):
+            raise
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"Failed to process PSD: {str(e)}"
+            }
+        return await self.jobs.wait(job)
+
+    async def submit_batch(
+        self,
+        files: List[UploadFile],
+        skip_ocr: bool = False,
+        output_format: str = 'png',
+        canvas_mode: str = 'leaf',
+        include_metrics: bool = False,
+    ) -> PSDBatch:
+        """
+        Save a set of uploads (PSD/PSB files or zip archives of them) and queue one job per
+        document. The jobs run concurrently on the batch threads (PSD_BATCH_WORKERS), apart
+        from single uploads, each thread with its own tesseract pool; they share this
+        service's processor, result cache and shared asset store. Non-PSD entries are
+        listed in the manifest as skipped.
+        """
+        saved: List[Tuple[str, Path, str]] = []
+        skipped: List[str] = []
+        try:
+            for file in files:
+                name = file.filename or 'upload.psd'
+                suffix = Path(name).suffix.lower()
+                if suffix == '.zip':
+                    archive, _ = await self.save_upload_file(file)
+                    try:
+                        entries, ignored = await run_in_threadpool(self._extract_zip, archive)
+                    finally:
+                        archive.unlink(missing_ok=True)
+                    saved.extend(entries)
+                    skipped.extend(f"{name}/{member}" for member in ignored)
+                elif suffix in PSD_EXTENSIONS:
+                    path, digest = await self.save_upload_file(file)
+                    saved.append((name, path, digest))
+                else:
+                    skipped.append(name)
+            if not saved:
+                raise ValueError("No PSD or PSB files in the upload")
+            limit = settings.PSD_BATCH_MAX_FILES
+            if limit and len(saved) > limit:
+                raise UploadTooLarge(f"Batch has {len(saved)} documents; the limit is {limit}")
+
+            batch_id = uuid.uuid4().hex
+            jobs = self.jobs.submit_many(
+                [
+                    (lambda progress, path=path, digest=digest: self._process_saved_file(
+                        path, skip_ocr, output_format, True, canvas_mode, progress, digest, None, include_metrics,
+                        self._batch_ocr_executor(),
+                    ))
+                    for _, path, digest in saved
+                ],
+                batch_id,
+                settings.PSD_BATCH_MAX_PENDING,
+                on_cancel=[(lambda path=path: path.unlink(missing_ok=True)) for _, path, _ in saved],
+            )
+        except BaseException:
+            for _, path, _ in saved:
+                path.unlink(missing_ok=True)
+            raise
+
+        batch = PSDBatch(id=batch_id, items=[(name, job) for (name, _, _), job in zip(saved, jobs)], skipped=skipped)
+        with self._batch_lock:
+            self._prune_batches()
+            self.batches[batch_id] = batch
+        for job in jobs:
+            job.future.add_done_callback(lambda _: self._finish_batch(batch))
+        return batch
+
+    def _batch_ocr_executor(self) -> OCRExecutor:
+        """
+        The calling batch worker's tesseract pool, created on first use. OCR_WORKERS is split
+        between the batch workers, as the CLI's directory mode does between its processes.
+        """
+        executor = getattr(self._batch_local, 'ocr_executor', None)
+        if executor is None:
+            total = settings.OCR_WORKERS or os.cpu_count() or 1
+            executor = OCRExecutor(workers=max(1, total // self.jobs.batch_workers), batch_size=settings.OCR_BATCH_SIZE)
+            self._batch_local.ocr_executor = executor
+        return executor
+
+    def get_batch(self, batch_id: str) -> Optional[PSDBatch]:
+        with self._batch_lock:
+            self._prune_batches()
+            return self.batches.get(batch_id)
+
+    async def wait_batch(self, batch: PSDBatch) -> Dict[str, Any]:
+        """Wait for every job of the batch and return its manifest."""
+        await asyncio.gather(*(self.jobs.wait(job) for _, job in batch.items))
+        return batch.manifest()
+
+    def _extract_zip(self, archive: Path) -> Tuple[List[Tuple[str, Path, str]], List[str]]:
+        """
+        Extract the PSD/PSB members of a zip into the upload directory under unique names.
+        Returns ([(member name, path, sha256)], [skipped member names]). Every member is
+        held to MAX_CONTENT_LENGTH while it is decompressed, whatever its header claims.
+        """
+        limit = settings.MAX_CONTENT_LENGTH
+        entries: List[Tuple[str, Path, str]] = []
+        skipped: List[str] = []
+        try:
+            with zipfile.ZipFile(archive) as zf:
+                for info in zf.infolist():
+                    if info.is_dir():
+                        continue
+                    parts = Path(info.filename).parts
+                    if '__MACOSX' in parts or parts[-1].startswith('.'):
+                        continue
+                    suffix = Path(info.filename).suffix.lower()
+                    if suffix not in PSD_EXTENSIONS:
+                        skipped.append(info.filename)
+                        continue
+                    if limit and info.file_size > limit:
+                        raise UploadTooLarge(f"{info.filename} exceeds the maximum upload size of {limit} bytes")
+                    dest = self.upload_dir / f"{uuid.uuid4()}{suffix}"
+                    try:
+                        with zf.open(info) as src:
+                            digest = self._copy_upload(src, dest, limit)
+                    except BaseException:
+                        dest.unlink(missing_ok=True)
+                        raise
+                    entries.append((info.filename, dest, digest))
+        except zipfile.BadZipFile as e:
+            for _, path, _ in entries:
+                path.unlink(missing_ok=True)
+            raise ValueError(f"Invalid zip archive: {e}")
+        except BaseException:
+            for _, path, _ in entries:
+                path.unlink(missing_ok=True)
+            raise
+        return entries, skipped
+
+    def _finish_batch(self, batch: PSDBatch):
+        """Job done callback: once the whole batch has finished, write its manifest to uploads/batches/."""
+        with self._batch_lock:
+            if batch.manifest_path is not None or not batch.done:
+                return
+            batch.manifest_path = f"batches/{batch.id}.json"
+        try:
+            path = self.upload_dir / batch.manifest_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix('.tmp')
+            with tmp.open('w', encoding='utf-8') as f:
+                json.dump(batch.manifest(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"batch manifest write error: {e}")
+
+    def _prune_batches(self):
+        """Forget finished batches once they are older than the job TTL (caller holds _batch_lock)."""
+        ttl = settings.PSD_JOB_TTL_SECONDS
+        if not ttl:
+            return
+        now = time.time()
+        for batch_id in [b.id for b in self.batches.values() if b.done and now - b.created_at > ttl]:
+            del self.batches[batch_id]
+
+    async def stream_psd(
+        self,
+        file: UploadFile,
+        skip_ocr: bool = False,
+        output_format: str = 'png',
+        canvas_mode: str = 'leaf',
+        include_metrics: bool = False,
+    ) -> Tuple[PSDJob, AsyncIterator[Dict[str, Any]]]:
+        """
+        Queue a canvas extraction and return the job plus an async iterator of its events:
+        job, progress, background, cloud (each as soon as its image is written) and finally
+        result or error. Submission errors (queue full, upload too large) raise here, before
+        anything is streamed.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def on_event(event: Dict[str, Any]):
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+        job = await self.submit_job(file, skip_ocr, output_format, True, canvas_mode, on_event, include_metrics)
+        return job, self._job_events(job, queue)
+
+    async def _job_events(self, job: PSDJob, queue: asyncio.Queue) -> AsyncIterator[Dict[str, Any]]:
+        yield {"type": "job", "job_id": job.id, "queue_position": self.jobs.queue_position(job)}
+        finished = asyncio.ensure_future(self.jobs.wait(job))
+        streamed_canvas = False
+        try:
+            while True:
+                if finished.done() and queue.empty():
+                    break
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, finished}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    continue
+                event = getter.result()
+                streamed_canvas = streamed_canvas or event["type"] in ("cloud", "background")
+                yield event
+            result = finished.result()
+        finally:
+            if not finished.done():
+                # Client went away: stop waiting (jobs.wait shields the job itself, which
+                # keeps running and still caches its result)
+                finished.cancel()
+
+        if result.get("status") == "error":
+            yield {"type": "error", "message": result.get("message")}
+            return
+        canvas = result.get("canvas") or {}
+        if not streamed_canvas and canvas:
+            # Served from the result cache: replay the stored canvas
+            if canvas.get("background", {}).get("image_url"):
+                yield {"type": "background", "background": canvas["background"]}
+            for order, cloud in enumerate(canvas.get("clouds", [])):
+                yield {"type": "cloud", "order": order, "cloud": cloud}
+        yield {"type": "result", **result}
+
+    @staticmethod
+    def _progress_events(progress: Optional[Callable[[str, float], None]],
+                         on_event: Optional[Callable[[Dict[str, Any]], None]]) -> Optional[Callable[[str, float], None]]:
+        """Forward job progress to on_event as well, once per stage and per whole percent."""
+        if on_event is None:
+            return progress
+        last = {"stage": None, "percent": -1}
+
+        def report(stage: str, fraction: float):
+            if progress:
+                progress(stage, fraction)
+            percent = int(fraction * 100)
+            if stage != last["stage"] or percent != last["percent"]:
+                last["stage"], last["percent"] = stage, percent
+                on_event({"type": "progress", "stage": stage, "progress": round(fraction, 4)})
+        return report
+
+    def _process_saved_file(
+        self,
+        input_path: Path,
+        skip_ocr: bool,
+        output_format: str,
+        return_canvas: bool,
+        canvas_mode: str,
+        progress: Optional[Callable[[str, float], None]] = None,
+        content_hash: Optional[str] = None,
+        on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+        include_metrics: bool = False,
+        ocr_executor: Optional[OCRExecutor] = None,
+    ) -> Dict[str, Any]:
+        """
+        Blocking part of PSD processing; runs on a job worker thread
+        """
+        try:
+            # Same file with the same options: serve the stored result without touching psd-tools
+            key = None
+            if self.cache is not None:
+                key = cache_key(content_hash or file_digest(input_path), skip_ocr=skip_ocr, canvas_mode=canvas_mode, output_format=output_format,
+                                assets=self.psd_processor.asset_options)
+                cached = self.cache.get(key)
+                if cached and (not return_canvas or cached.get("canvas")):
+                    PSD_REQUESTS.inc(status='cached')
+                    if progress:
+                        progress('done', 1.0)
+                    ret = {
+                        "status": "success",
+                        "file_path": cached["file_path"],
+                        "message": "PSD processed successfully",
+                        "cached": True,
+                    }
+                    if cached.get("previews"):
+                        ret["previews"] = cached["previews"]
+                    if return_canvas:
+                        ret["canvas"] = cached["canvas"]
+                    return ret
+
             # Create output path
-            output_filename = f"{input_path.stem}_processed.{output_format}"
+            output_filename = f"{input_path.stem}_processed.{output_extension(output_format)}"
             output_path = self.upload_dir / output_filename
             
             # Process the PSD
@@ -59,13 +471,15 @@ class PSDService:
                 return_canvas=return_canvas,
                 assets_root=str(self.upload_dir),
                 canvas_mode=canvas_mode,
+                progress=progress,
+                on_event=on_event,
+                output_format=output_format,
+                ocr_executor=ocr_executor,
             )
-            
-            # Clean up the input file
-            if input_path.exists():
-                input_path.unlink()
                 
             # If processing failed, return the error
+            if not include_metrics:
+                result.pop("stage_metrics", None)
             if result["status"] == "error":
                 return result
                 
@@ -77,8 +491,47 @@ class PSDService:
                 "file_path": relative_path,
                 "message": "PSD processed successfully",
             }
+            # Downscaled versions of the flattened output, keyed by longest side
+            previews = {str(size): str(Path(path).relative_to(self.upload_dir))
+                        for size, path in sorted((result.get("output_previews") or {}).items())}
+            if previews:
+                ret["previews"] = previews
             if return_canvas and result.get("canvas"):
                 ret["canvas"] = result["canvas"]
+            if result.get("export_stats"):
+                ret["export_stats"] = result["export_stats"]
+            if result.get("asset_stats"):
+                ret["asset_stats"] = result["asset_stats"]
+            if result.get("ocr_stats"):
+                ret["ocr_stats"] = result["ocr_stats"]
+            if result.get("render_stats"):
+                ret["render_stats"] = result["render_stats"]
+            if result.get("compose_stats"):
+                ret["compose_stats"] = result["compose_stats"]
+            if result.get("memory_stats"):
+                ret["memory_stats"] = result["memory_stats"]
+            if include_metrics and result.get("stage_metrics"):
+                ret["stage_metrics"] = result["stage_metrics"]
+
+            if key is not None:
+                assets = [relative_path] + sorted(set(previews.values()) - {relative_path})
+                shared_bytes = 0
+                if result.get("assets_dir"):
+                    assets.append(result["assets_dir"])
+                    if self.asset_store is not None:
+                        # Shared layer images this canvas keeps alive count against the budget
+                        shared_bytes = self.asset_store.owner_bytes(result["assets_dir"])
+                stored = self.cache.put(key, {"file_path": relative_path, "canvas": result.get("canvas"), "previews": previews}, assets,
+                                        satisfies=lambda value: not return_canvas or bool(value.get("canvas")),
+                                        extra_bytes=shared_bytes)
+                if stored["file_path"] != relative_path:
+                    # A concurrent request for the same input finished first; ours was discarded
+                    ret["file_path"] = stored["file_path"]
+                    ret.pop("previews", None)
+                    if stored.get("previews"):
+                        ret["previews"] = stored["previews"]
+                    if return_canvas and stored.get("canvas"):
+                        ret["canvas"] = stored["canvas"]
             return ret
             
         except Exception as e:
@@ -86,3 +539,7 @@ class PSDService:
                 "status": "error",
                 "message": f"Failed to process PSD: {str(e)}"
             }
+        finally:
+            # Clean up the input file
+            if input_path.exists():
+                input_path.unlink()
@@ -0,0 +1,418 @@
+"""
+Shared pool of warm rembg sessions, micro-batched inference and the bounded executor requests run on
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterator, List, Callable, Tuple
+
+import numpy as np
+import onnxruntime as ort
+from PIL import Image
+from rembg import remove
+from rembg.sessions import sessions_class
+from rembg.sessions.base import BaseSession
+from rembg.sessions.silueta import SiluetaSession
+from rembg.sessions.u2net import U2netSession
+from rembg.sessions.u2net_custom import U2netCustomSession
+from rembg.sessions.u2net_human_seg import U2netHumanSegSession
+from rembg.sessions.u2netp import U2netpSession
+
+from ..config import settings
+from ..utils.metrics import REGISTRY, CUTOUT_QUEUE, CUTOUT_BATCH_SIZE
+
+# Sessions whose predict() is: resize to 320x320, ImageNet mean/std, run, min-max scale the
+# first output. Only these can be batched, since the batcher reimplements that predict().
+BATCHABLE_SESSIONS = (U2netSession, U2netpSession, U2netCustomSession, U2netHumanSegSession, SiluetaSession)
+_U2NET_SIZE = (320, 320)
+_U2NET_MEAN = np.array((0.485, 0.456, 0.406), np.float32).reshape(3, 1, 1)
+_U2NET_STD = np.array((0.229, 0.224, 0.225), np.float32).reshape(3, 1, 1)
+
+
+class RembgQueueFull(Exception):
+    """Raised when queued + running background removals reach the configured limit."""
+
+
+class RembgTimeout(Exception):
+    """Raised when a background removal did not finish within the request timeout."""
+
+
+def u2net_tensor(img: Image.Image) -> np.ndarray:
+    """An image as a 3x320x320 float32 u2net input, normalized the way rembg's predict() does it."""
+    arr = np.asarray(img.convert('RGB').resize(_U2NET_SIZE, Image.Resampling.LANCZOS), np.float32)
+    arr = arr.transpose(2, 0, 1) / max(float(arr.max()), 1e-6)
+    return (arr - _U2NET_MEAN) / _U2NET_STD
+
+
+def u2net_mask(pred: np.ndarray, size: Tuple[int, int]) -> Image.Image:
+    """One 320x320 u2net prediction as an L mask of the given size, scaled like rembg's predict()."""
+    lo, hi = float(pred.min()), float(pred.max())
+    pred = (pred - lo) / max(hi - lo, 1e-6)
+    mask = Image.fromarray((pred.clip(0, 1) * 255).astype(np.uint8), mode='L')
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+
+def session_class(model: str) -> type:
+    """The rembg session class registered under model."""
+    for cls in sessions_class:
+        if cls.name() == model:
+            return cls
+    raise ValueError(f"Unknown rembg model: {model}")
+
+
+class RembgMicroBatcher:
+    """
+    Coalesces concurrent predictions into batched ONNX runs. Callers (rembg.remove, which
+    takes the batcher as its session) resize and normalize their own image, queue the
+    tensor and wait. One batch thread per pooled session takes the first queued tensor,
+    gathers more for at most max_wait_ms (only while other callers are about to queue one)
+    or until max_batch are queued, stacks them into
+    one Nx3x320x320 input and runs it on a session from the pool. Callers split their own
+    mask out and scale it back up, so only the inference itself is serialized.
+
+    A single image therefore waits at most max_wait_ms longer than it would unbatched.
+    Models exported with a fixed batch size of 1 still go through the batcher, but run
+    each image of a batch separately.
+    """
+
+    def __init__(self, pool: 'RembgSessionPool', max_batch: int, max_wait_ms: float):
+        self.pool = pool
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.batches = 0
+        self.images = 0
+        self.wait_ms = 0.0
+        self._arriving = 0  # Callers between entering predict() and queueing their tensor
+        self._queue: "queue.Queue[Tuple[np.ndarray, Future, float]]" = queue.Queue()
+        self._lock = threading.Lock()
+        for i in range(pool.size):
+            threading.Thread(target=self._loop, name=f'rembg-batch-{i}', daemon=True).start()
+
+    def predict(self, img: Image.Image, *args, **kwargs) -> List[Image.Image]:
+        """BaseSession.predict() for rembg.remove(session=batcher)."""
+        future: Future = Future()
+        with self._lock:
+            self._arriving += 1
+        try:
+            tensor = u2net_tensor(img)
+            self._queue.put((tensor, future, time.perf_counter()))
+        finally:
+            with self._lock:
+                self._arriving -= 1
+        return [u2net_mask(future.result(), img.size)]
+
+    def _collect(self) -> List[Tuple[np.ndarray, Future, float]]:
+        items = [self._queue.get()]
+        deadline = items[0][2] + self.max_wait
+        while len(items) < self.max_batch:
+            try:
+                items.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            # Only wait while another caller is still preparing its tensor; a lone
+            # request runs immediately instead of sitting out max_wait_ms
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not self._arriving:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _loop(self) -> None:
+        while True:
+            items = self._collect()
+            start = time.perf_counter()
+            try:
+                with self.pool.session() as session:
+                    preds = self._infer(session, np.stack([item[0] for item in items]))
+            except BaseException as e:
+                for _, future, _ in items:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), pred in zip(items, preds):
+                future.set_result(pred)
+            CUTOUT_BATCH_SIZE.observe(len(items))
+            with self._lock:
+                self.batches += 1
+                self.images += len(items)
+                self.wait_ms += sum(start - item[2] for item in items) * 1000
+
+    @staticmethod
+    def _infer(session: BaseSession, batch: np.ndarray) -> np.ndarray:
+        inner = session.inner_session
+        model_input = inner.get_inputs()[0]
+        if model_input.shape[0] == 1:
+            outputs = [inner.run(None, {model_input.name: batch[i:i + 1]})[0] for i in range(len(batch))]
+            return np.concatenate(outputs)[:, 0]
+        return inner.run(None, {model_input.name: batch})[0][:, 0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self.batches,
+                "images": self.images,
+                "mean_batch_size": round(self.images / self.batches, 2) if self.batches else None,
+                "mean_wait_ms": round(self.wait_ms / self.images, 2) if self.images else None,
+            }
+
+
+class RembgSessionPool:
+    """
+    A fixed number of rembg sessions for one model, created once per process and checked
+    out per call, so model loading and ONNX session setup are never paid by a request.
+    Each session runs with intra_op_threads / inter_op_threads (0 = onnxruntime default);
+    size x intra_op_threads is the CPU budget for background removal.
+
+    Sessions are created by warmup() at startup, or on first use if it was not called.
+    A caller that finds every session busy waits for one to be returned. With batch_size
+    > 1 and a u2net-family model, remove() goes through a RembgMicroBatcher instead of
+    holding a session for the whole call.
+    """
+
+    def __init__(self, model: str = 'u2net', size: int = 1, intra_op_threads: int = 0,
+                 inter_op_threads: int = 0, model_path: Optional[str] = None,
+                 batch_size: int = 1, batch_max_wait_ms: float = 10):
+        self.model = model
+        self.size = max(1, size)
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        # Required by rembg's *_custom models (u2net_custom, dis_custom, ...)
+        self.model_path = model_path
+        self.calls = 0
+        self.load_ms: List[float] = []
+        self.warmup_ms: Optional[float] = None
+        self._idle: "queue.LifoQueue[BaseSession]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.batcher: Optional[RembgMicroBatcher] = None
+        if batch_size > 1 and issubclass(session_class(model), BATCHABLE_SESSIONS):
+            self.batcher = RembgMicroBatcher(self, batch_size, batch_max_wait_ms)
+
+    def _session_options(self) -> ort.SessionOptions:
+        opts = ort.SessionOptions()
+        if self.intra_op_threads:
+            opts.intra_op_num_threads = self.intra_op_threads
+        if self.inter_op_threads:
+            opts.inter_op_num_threads = self.inter_op_threads
+        return opts
+
+    def _create(self) -> BaseSession:
+        start = time.perf_counter()
+        kwargs = {"model_path": self.model_path} if self.model_path else {}
+        # Constructed directly rather than through rembg.new_session, whose signature for
+        # passing session options differs between rembg releases
+        session = session_class(self.model)(self.model, self._session_options(), **kwargs)
+        with self._lock:
+            self.load_ms.append(round((time.perf_counter() - start) * 1000, 2))
+        return session
+
+    def _checkout(self) -> BaseSession:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._create()
+            except BaseException:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    @contextmanager
+    def session(self) -> Iterator[BaseSession]:
+        """Check out a session for the duration of the block."""
+        session = self._checkout()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    def warmup(self) -> Dict[str, Any]:
+        """
+        Create every session and run one small inference on each, so the first request
+        pays neither the model load nor onnxruntime's first-run allocations.
+        """
+        start = time.perf_counter()
+        sessions = [self._checkout() for _ in range(self.size)]
+        try:
+            # Not a flat image: rembg's min-max scaling of a constant mask divides by zero
+            probe = Image.linear_gradient('L').resize((64, 64)).convert('RGB')
+            for session in sessions:
+                remove(probe, session=session)
+        finally:
+            for session in sessions:
+                self._idle.put(session)
+        self.warmup_ms = round((time.perf_counter() - start) * 1000, 2)
+        return self.stats()
+
+    def remove(self, data, **kwargs):
+        """rembg.remove on a pooled session (or the batcher); same arguments and return value."""
+        if self.batcher is not None:
+            result = remove(data, session=self.batcher, **kwargs)
+        else:
+            with self.session() as session:
+                result = remove(data, session=session, **kwargs)
+        with self._lock:
+            self.calls += 1
+        return result
+
+    @property
+    def concurrency(self) -> int:
+        """Removals that can usefully be in flight at once: one per session, or a full batch per session."""
+        return self.size * self.batcher.max_batch if self.batcher else self.size
+
+    def stats(self) -> Dict[str, Any]:
+        batcher = self.batcher.stats() if self.batcher else None
+        with self._lock:
+            return {
+                "model": self.model,
+                "sessions": self._created,
+                "size": self.size,
+                "idle": self._idle.qsize(),
+                "intra_op_threads": self.intra_op_threads,
+                "inter_op_threads": self.inter_op_threads,
+                "calls": self.calls,
+                "load_ms": list(self.load_ms),
+                "warmup_ms": self.warmup_ms,
+                "batching": batcher,
+            }
+
+
+class RembgExecutor:
+    """
+    Runs background removals on worker threads, one per pooled session (or enough to fill
+    a batch per session when micro-batching), so inference never blocks the event loop. onnxruntime releases the GIL while it runs, and threads share
+    the pool's sessions instead of loading the model once per process.
+
+    At most max_pending calls may be queued or running (0 = no limit); beyond that submit()
+    raises RembgQueueFull. run() waits up to timeout seconds: a call still queued is
+    cancelled, a running one finishes in the background and keeps its slot until it does.
+    """
+
+    def __init__(self, workers: int, max_pending: int = 0, timeout: float = 0):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rembg')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Future, int]:
+        """Queue fn(*args, **kwargs); returns the future and how many calls are queued ahead of it."""
+        with self._lock:
+            if self.max_pending and self._pending >= self.max_pending:
+                self.rejected += 1
+                raise RembgQueueFull(f"Background removal queue is full ({self._pending} pending), try again later")
+            position = max(0, self._pending - self.workers)
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._finished(None)
+            raise
+        future.add_done_callback(self._finished)
+        return future, position
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, int]:
+        """submit() and wait for the result without blocking the event loop; returns (result, queue position)."""
+        future, position = self.submit(fn, *args, **kwargs)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout or None)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise RembgTimeout(f"Background removal did not finish within {self.timeout:g} seconds")
+        return result, position
+
+    def wait(self, future: Future, timeout: Optional[float] = None) -> Any:
+        """
+        Blocking counterpart of run() for a submit()ted future, for callers already on a
+        worker thread. Waits up to timeout seconds (None = the executor's timeout); a call
+        still queued by then is cancelled.
+        """
+        if timeout is None:
+            timeout = self.timeout or None
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise RembgTimeout(f"Background removal did not finish within {self.timeout:g} seconds")
+
+    def _finished(self, _future: Optional[Future]) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": self._pending,
+                "running": min(self._pending, self.workers),
+                "queued": max(0, self._pending - self.workers),
+                "max_pending": self.max_pending,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+
+_pool: Optional[RembgSessionPool] = None
+_pool_lock = threading.Lock()
+_executor: Optional[RembgExecutor] = None
+
+
+def get_rembg_pool() -> RembgSessionPool:
+    """The process-wide pool, configured from settings on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            size = settings.REMBG_SESSIONS
+            if size <= 0:
+                # One session per intra-op thread group; onnxruntime already uses every core
+                # for a single inference when the thread count is left to it
+                threads = settings.REMBG_INTRA_OP_THREADS
+                size = max(1, (os.cpu_count() or 1) // threads) if threads else 1
+            _pool = RembgSessionPool(
+                model=settings.REMBG_MODEL,
+                size=size,
+                intra_op_threads=settings.REMBG_INTRA_OP_THREADS,
+                inter_op_threads=settings.REMBG_INTER_OP_THREADS,
+                model_path=settings.REMBG_MODEL_PATH or None,
+                batch_size=settings.REMBG_BATCH_SIZE,
+                batch_max_wait_ms=settings.REMBG_BATCH_MAX_WAIT_MS,
+            )
+        return _pool
+
+
+def get_rembg_executor() -> RembgExecutor:
+    """The process-wide executor, one worker per session of get_rembg_pool() (one per batch slot when batching)."""
+    global _executor
+    pool = get_rembg_pool()
+    with _pool_lock:
+        if _executor is None:
+            _executor = RembgExecutor(pool.concurrency, settings.REMBG_MAX_PENDING, settings.REMBG_TIMEOUT_SECONDS)
+            REGISTRY.add_collector(_collect_metrics)
+        return _executor
+
+
+def _collect_metrics():
+    for state in ('running', 'queued'):
+        CUTOUT_QUEUE.set(_executor.stats()[state], state=state)
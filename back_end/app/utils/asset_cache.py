@@ -0,0 +1,174 @@
+"""
+Content-addressed result cache backed by files under the uploads folder
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Iterable, Callable
+
+
+def file_digest(path, chunk_size: int = 1024 * 1024) -> str:
+    """sha256 of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(content_hash: str, **options: Any) -> str:
+    """Combine a content hash with the options that change the output into one key."""
+    parts = [content_hash] + [f"{k}={options[k]}" for k in sorted(options)]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _path_size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+    return 0
+
+
+class AssetLRUCache:
+    """
+    Maps a key to a JSON-serializable value plus the files/directories (relative to root)
+    that value refers to. The total size of those assets is kept under max_bytes by
+    deleting least-recently-used entries together with their assets.
+
+    The index is a JSON file rewritten atomically, so it survives restarts. Hits only
+    update last_access in memory; it reaches the file with the next put/eviction, or
+    with a hit at least save_interval seconds after the last write.
+    on_delete(rel) is called for every asset the cache deletes (e.g. to release shared
+    files the asset referenced).
+    """
+
+    def __init__(self, root: str, index_path: str, max_bytes: int,
+                 on_delete: Optional[Callable[[str], None]] = None, save_interval: float = 30.0):
+        self.root = Path(root)
+        self.on_delete = on_delete
+        self.index_path = Path(index_path)
+        self.max_bytes = max_bytes
+        self.save_interval = save_interval
+        self._saved_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = self._load()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached value, or None if missing or any of its assets is gone."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not all((self.root / a).exists() for a in entry["assets"]):
+                # Assets were removed behind our back; forget the entry
+                del self._entries[key]
+                self._save()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_access"] = time.time()
+            if entry["last_access"] - self._saved_at >= self.save_interval:
+                self._save()
+            return entry["value"]
+
+    def put(self, key: str, value: Dict[str, Any], assets: Iterable[str],
+            satisfies: Optional[Callable[[Dict[str, Any]], bool]] = None, extra_bytes: int = 0) -> Dict[str, Any]:
+        """
+        Store value and take ownership of its assets; evicts older entries if over budget.
+        extra_bytes is charged to the entry on top of its assets (files it keeps alive
+        elsewhere, e.g. shared layer images released through on_delete).
+        Returns the value now cached for key: when a concurrent miss already stored a live
+        entry (that satisfies(value) accepts, if given), that entry is kept, since its assets
+        may have been handed out, and the assets of this duplicate are deleted instead, so
+        callers must answer with the returned value.
+        """
+        assets = [str(a).replace('\\', '/') for a in assets]
+        size = sum(_path_size(self.root / a) for a in assets) + extra_bytes
+        with self._lock:
+            old = self._entries.get(key)
+            if (old and (satisfies is None or satisfies(old["value"]))
+                    and all((self.root / a).exists() for a in old["assets"])):
+                self._delete_assets([a for a in assets if a not in old["assets"]])
+                old["last_access"] = time.time()
+                self._save()
+                return old["value"]
+            if old:
+                del self._entries[key]
+                self._delete_assets([a for a in old["assets"] if a not in assets])
+            now = time.time()
+            self._entries[key] = {
+                "value": value,
+                "assets": assets,
+                "size": size,
+                "created": now,
+                "last_access": now,
+            }
+            self._evict(keep=key)
+            self._save()
+            return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(e["size"] for e in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        if self.max_bytes <= 0:
+            return
+        total = sum(e["size"] for e in self._entries.values())
+        for key in sorted(self._entries, key=lambda k: self._entries[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self._entries.pop(key)
+            self._delete_assets(entry["assets"])
+            total -= entry["size"]
+            self.evictions += 1
+
+    def _delete_assets(self, assets: List[str]) -> None:
+        for rel in assets:
+            path = self.root / rel
+            try:
+                if path.is_dir():
+                    shutil.rmtree(path)
+                elif path.exists():
+                    path.unlink()
+            except OSError as e:
+                print(f"cache eviction failed for {rel}: {e}")
+            if self.on_delete:
+                try:
+                    self.on_delete(rel)
+                except Exception as e:
+                    print(f"cache eviction callback failed for {rel}: {e}")
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self.index_path.exists():
+            try:
+                with self.index_path.open('r', encoding='utf-8') as f:
+                    return json.load(f).get("entries", {})
+            except (OSError, ValueError) as e:
+                print(f"cache index unreadable, starting empty: {e}")
+        return {}
+
+    def _save(self) -> None:
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_suffix('.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump({"entries": self._entries}, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+        self._saved_at = time.time()
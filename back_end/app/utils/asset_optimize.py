@@ -0,0 +1,218 @@
+"""
+Layer asset optimization: alpha trim, palette quantization, preview pyramid and PNG/WebP encoding
+"""
+import hashlib
+import io
+import os
+import uuid
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple, Dict, Any, Callable
+
+import numpy as np
+from PIL import Image
+
+# output_format values that select WebP layer assets; anything else keeps PNG
+WEBP_FORMATS = {'webp': True, 'webp_lossless': True, 'webp_lossy': False}
+
+
+@dataclass
+class AssetOptions:
+    """How layer images are written. The defaults reproduce a plain RGBA PNG."""
+    format: str = 'png'  # 'png' or 'webp'
+    lossless: bool = True  # WebP only
+    quality: int = 85  # Lossy WebP quality (0-100)
+    trim: bool = False  # Crop to the alpha bounding box
+    quantize: bool = False  # Palette PNG for layers with at most max_colors distinct RGBA colours
+    max_colors: int = 256
+    png_compress_level: int = 6
+    measure_savings: bool = False  # Also encode the untrimmed RGBA PNG to report bytes saved
+    preview_sizes: Tuple[int, ...] = ()  # Longest-side sizes of downscaled previews written next to each asset
+    dedup_dir: Optional[str] = None  # Content-addressed store (see asset_store.py); None = write to dest_path
+
+    def signature(self) -> str:
+        """The options that change encoded bytes; part of the content hash."""
+        return (f"{self.format}|{self.lossless}|{self.quality}|{self.quantize}|{self.max_colors}|"
+                f"{self.png_compress_level}|{sorted(self.preview_sizes)}")
+
+    @property
+    def extension(self) -> str:
+        return 'webp' if self.format == 'webp' else 'png'
+
+
+def asset_options_for(output_format: str, base: Optional[AssetOptions] = None) -> AssetOptions:
+    """Options for a request: 'webp'/'webp_lossless' and 'webp_lossy' switch assets to WebP."""
+    base = base or AssetOptions()
+    fmt = (output_format or '').lower()
+    if fmt in WEBP_FORMATS:
+        return replace(base, format='webp', lossless=WEBP_FORMATS[fmt])
+    return replace(base, format='png')
+
+
+def output_extension(output_format: str) -> str:
+    """File extension of the flattened output for an output_format value."""
+    fmt = (output_format or 'png').lower()
+    return 'webp' if fmt in WEBP_FORMATS else fmt
+
+
+def trim_box(img: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """(left, top, right, bottom) of the non-transparent pixels, or None if there are none."""
+    if 'A' not in img.getbands():
+        return None
+    return img.getchannel('A').getbbox()
+
+
+def _palette_image(img: Image.Image, max_colors: int) -> Optional[Image.Image]:
+    """Exact 'P' image with an RGBA palette, or None if img has more than max_colors colours."""
+    if img.getcolors(max_colors) is None:
+        return None
+    arr = np.ascontiguousarray(np.asarray(img))
+    packed = arr.view(np.uint32).reshape(arr.shape[:2])
+    colors, indices = np.unique(packed, return_inverse=True)
+    pal = Image.fromarray(indices.reshape(packed.shape).astype(np.uint8), 'P')
+    pal.putpalette(colors.view(np.uint8).tobytes(), rawmode='RGBA')
+    return pal
+
+
+def trim_image(img: Image.Image) -> Tuple[Image.Image, Optional[Tuple[int, int, int, int]]]:
+    """
+    Crop an RGBA image to its alpha bounding box. Returns (image, crop) where crop is the
+    (left, top, width, height) of the kept area, or None if nothing was cropped.
+    """
+    box = trim_box(img)
+    # Fully transparent layers are written as they are
+    if box is None or box == (0, 0) + img.size:
+        return img, None
+    return img.crop(box), (box[0], box[1], box[2] - box[0], box[3] - box[1])
+
+
+def _encodable(img: Image.Image, options: AssetOptions) -> Tuple[Image.Image, bool]:
+    """The image to encode (palette version if quantization applies) and whether it was quantized."""
+    if options.quantize and options.format == 'png':
+        pal = _palette_image(img, options.max_colors)
+        if pal is not None:
+            return pal, True
+    return img, False
+
+
+def preview_path(dest_path: str, size: int) -> str:
+    """Where the size px preview of dest_path is written: leaf_3.png -> leaf_3@128.png."""
+    root, ext = os.path.splitext(dest_path)
+    return f"{root}@{size}{ext}"
+
+
+def write_previews(img: Image.Image, dest_path: str, options: AssetOptions,
+                   save: Optional[Callable[[Image.Image, str], None]] = None) -> Dict[int, str]:
+    """
+    Write the preview pyramid for an image already saved at dest_path, with save(image, path)
+    or the asset encoding. Each level is downscaled from the next larger one, so the full
+    bitmap is only resampled once. Sizes the image already fits in map to dest_path itself.
+    """
+    previews: Dict[int, str] = {}
+    level = img
+    for size in sorted(set(options.preview_sizes), reverse=True):
+        if max(img.size) <= size:
+            previews[size] = dest_path
+            continue
+        level = level.copy()
+        level.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        path = preview_path(dest_path, size)
+        if save is not None:
+            save(level, path)
+        else:
+            encode_image(_encodable(level, options)[0], path, options)
+        previews[size] = path
+    return previews
+
+
+def encode_image(img: Image.Image, dest, options: AssetOptions) -> None:
+    """Write img to dest (path or file object) in the asset format."""
+    if options.format == 'webp':
+        if options.lossless:
+            img.save(dest, format='WEBP', lossless=True, method=4)
+        else:
+            img.save(dest, format='WEBP', quality=options.quality, method=4)
+    else:
+        img.save(dest, format='PNG', compress_level=options.png_compress_level)
+
+
+def content_hash(img: Image.Image, options: AssetOptions) -> str:
+    """Hash of the pixels to be written plus the encoding options."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{options.signature()}|{img.mode}|{img.size}".encode('utf-8'))
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def _write_stored(out: Image.Image, img: Image.Image, path: str, options: AssetOptions) -> Tuple[Dict[int, str], bool]:
+    """
+    Write an asset and its previews into the content store unless they are already there.
+    Returns (previews, reused). Files are renamed into place, so concurrent writers of the
+    same content are harmless.
+    """
+    root, ext = os.path.splitext(path)
+    expected = [path] + [preview_path(path, size) for size in options.preview_sizes if max(img.size) > size]
+    if all(os.path.exists(p) for p in expected):
+        for p in expected:
+            # Marks the files as in use for the store's cleanup grace period
+            os.utime(p)
+        previews = {size: (preview_path(path, size) if max(img.size) > size else path) for size in options.preview_sizes}
+        return previews, True
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def save(image: Image.Image, target: str):
+        tmp = f"{root}.{uuid.uuid4().hex}.tmp{ext}"
+        encode_image(image, tmp, options)
+        os.replace(tmp, target)
+
+    save(out, path)
+    previews = write_previews(img, path, options, lambda level, target: save(_encodable(level, options)[0], target))
+    return previews, False
+
+
+def write_asset(img: Image.Image, dest_path: str, options: AssetOptions) -> Dict[str, Any]:
+    """
+    Optimize and write one layer image and its previews. Returns the crop, preview paths,
+    bytes written and, with measure_savings, the size the default full-bbox RGBA PNG would
+    have had. With options.dedup_dir the image is stored by content hash instead of at
+    dest_path; info["path"] is where it ended up.
+    """
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    info: Dict[str, Any] = {"raw_bytes": img.width * img.height * 4}
+    if options.measure_savings:
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        info["baseline_bytes"] = buf.tell()
+    crop = None
+    if options.trim:
+        img, crop = trim_image(img)
+    out, quantized = _encodable(img, options)
+    digest, reused = None, False
+    if options.dedup_dir:
+        digest = content_hash(img, options)
+        dest_path = os.path.join(options.dedup_dir, digest[:2], f"{digest}.{options.extension}")
+        previews, reused = _write_stored(out, img, dest_path, options)
+    else:
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        encode_image(out, dest_path, options)
+        previews = write_previews(img, dest_path, options) if options.preview_sizes else {}
+    info.update(
+        path=dest_path,
+        content_hash=digest,
+        reused=reused,
+        crop=crop,
+        quantized=quantized,
+        previews=previews,
+        trimmed_raw_bytes=img.width * img.height * 4,
+        bytes_written=os.path.getsize(dest_path),
+        preview_bytes=sum(os.path.getsize(p) for p in set(previews.values()) if p != dest_path),
+    )
+    return info
+
+
+def place_cloud(cloud: Dict[str, Any], crop: Optional[Tuple[int, int, int, int]]) -> Dict[str, Any]:
+    """Copy of cloud with top/left/width/height moved to the cropped area."""
+    if not crop:
+        return dict(cloud)
+    x, y, w, h = crop
+    return {**cloud, "left": cloud["left"] + x, "top": cloud["top"] + y, "width": w, "height": h}
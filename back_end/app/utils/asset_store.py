@@ -0,0 +1,116 @@
+"""
+Content-addressed store for layer images shared between clouds and documents
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Iterable
+
+
+class SharedAssetStore:
+    """
+    Reference counts for the files under dir, keyed by content hash. The files
+    (<dir>/ab/<hash>.<ext> plus previews) are written by asset_optimize.write_asset with
+    AssetOptions.dedup_dir. Each document (owner) acquires the hashes its canvas uses;
+    release(owner) drops them again and files no owner references are deleted.
+
+    Workers reuse an existing file without telling the store first, so unreferenced
+    files are only deleted once they have been released and untouched (mtime) for
+    grace seconds; export refreshes the mtime of every file it reuses.
+    """
+
+    def __init__(self, root: str, dir: str, index_path: str, grace: float = 600.0):
+        self.root = Path(root)
+        self.dir = self.root / dir
+        self.index_path = Path(index_path)
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = self._load()
+
+    def acquire(self, owner: str, hashes: Iterable[str]) -> None:
+        """Record that owner uses these assets (once per occurrence)."""
+        hashes = list(hashes)
+        if not hashes:
+            return
+        owner = str(owner).replace('\\', '/')
+        with self._lock:
+            for h in hashes:
+                entry = self._entries.setdefault(h, {"refs": {}, "released": None})
+                entry["refs"][owner] = entry["refs"].get(owner, 0) + 1
+                entry["released"] = None
+            self._save()
+
+    def release(self, owner: str) -> int:
+        """Drop every reference held by owner and delete expired unreferenced files; returns bytes freed."""
+        owner = str(owner).replace('\\', '/')
+        with self._lock:
+            now = time.time()
+            for entry in self._entries.values():
+                if entry["refs"].pop(owner, None) is not None and not entry["refs"]:
+                    entry["released"] = now
+            freed = self._sweep(now)
+            self._save()
+            return freed
+
+    def owner_bytes(self, owner: str) -> int:
+        """Size of the shared files owner references (each counted once)."""
+        owner = str(owner).replace('\\', '/')
+        with self._lock:
+            return sum(self._size(h) for h, e in self._entries.items() if owner in e["refs"])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            refs = [sum(e["refs"].values()) for e in self._entries.values()]
+            return {
+                "assets": len(self._entries),
+                "references": sum(refs),
+                "unreferenced": sum(1 for r in refs if r == 0),
+                "bytes": sum(self._size(h) for h in self._entries),
+            }
+
+    def _files(self, content_hash: str) -> List[Path]:
+        """The asset and its previews (<hash>.<ext>, <hash>@128.<ext>, ...)."""
+        folder = self.dir / content_hash[:2]
+        if not folder.is_dir():
+            return []
+        return [p for p in folder.iterdir() if p.name.split('.')[0].split('@')[0] == content_hash]
+
+    def _size(self, content_hash: str) -> int:
+        return sum(p.stat().st_size for p in self._files(content_hash) if p.is_file())
+
+    def _sweep(self, now: float) -> int:
+        freed = 0
+        for h in [h for h, e in self._entries.items() if not e["refs"]]:
+            entry = self._entries[h]
+            if entry["released"] is not None and now - entry["released"] < self.grace:
+                continue
+            files = self._files(h)
+            if any(now - p.stat().st_mtime < self.grace for p in files):
+                # Reused by an export that has not acquired it yet
+                continue
+            for p in files:
+                try:
+                    freed += p.stat().st_size
+                    p.unlink()
+                except OSError as e:
+                    print(f"shared asset cleanup failed for {p}: {e}")
+            del self._entries[h]
+        return freed
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self.index_path.exists():
+            try:
+                with self.index_path.open('r', encoding='utf-8') as f:
+                    return json.load(f).get("assets", {})
+            except (OSError, ValueError) as e:
+                print(f"asset store index unreadable, starting empty: {e}")
+        return {}
+
+    def _save(self) -> None:
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_suffix('.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump({"assets": self._entries}, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
@@ -0,0 +1,181 @@
+"""
+Flattened composite from already-rendered layer bitmaps
+"""
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Tuple, Callable, Iterator
+
+import numpy as np
+from PIL import Image
+from psd_tools.constants import BlendMode
+
+from .layer_export import iter_layers
+
+DEFAULT_TILE = 512
+
+# Layer kinds whose topil() pixels are what psd-tools composites
+_BITMAP_KINDS = ('pixel', 'smartobject')
+
+
+@dataclass
+class CompositeItem:
+    """One layer bitmap placed on the canvas; items are blended bottom to top."""
+    image: Any  # PIL image or HxWx4 uint8 array
+    left: int
+    top: int
+    opacity: float = 1.0
+
+
+@dataclass
+class BandItem:
+    """A layer for composite_bands: its box on the canvas and how to render it when needed."""
+    left: int
+    top: int
+    width: int
+    height: int
+    opacity: float
+    load: Callable[[], Any]  # -> PIL image / HxWx4 uint8 array, or None
+
+
+def _needs_psd_tools(layer) -> Optional[str]:
+    """Why a visible layer cannot be reproduced by plain source-over blending, or None."""
+    if layer.has_mask() and not getattr(layer.mask, 'disabled', False):
+        return "mask"
+    if hasattr(layer, 'has_vector_mask') and layer.has_vector_mask():
+        return "vector mask"
+    if layer.has_effects():
+        return "effects"
+    clipping = getattr(layer, 'clipping', None)
+    if clipping or layer.has_clip_layers():
+        return "clipping"
+    if layer.is_group():
+        if layer.blend_mode not in (BlendMode.PASS_THROUGH, BlendMode.NORMAL):
+            return f"group blend mode {layer.blend_mode}"
+        # A NORMAL group is isolated; that only equals pass-through at full opacity
+        if layer.opacity != 255:
+            return "group opacity"
+        return None
+    if layer.kind not in _BITMAP_KINDS:
+        return f"{layer.kind} layer"
+    if layer.blend_mode != BlendMode.NORMAL:
+        return f"blend mode {layer.blend_mode}"
+    if getattr(layer, 'fill_opacity', 255) != 255:
+        return "fill opacity"
+    return None
+
+
+def compositable_leaves(psd) -> Tuple[Optional[List], Optional[str]]:
+    """
+    Visible leaf layers in bottom-to-top order if the document can be flattened from their
+    bitmaps alone, else (None, reason) so the caller falls back to psd.composite().
+    """
+    leaves = []
+    for layer in iter_layers(psd):
+        if not layer.is_visible():
+            continue
+        reason = _needs_psd_tools(layer)
+        if reason:
+            return None, f"{layer.name}: {reason}"
+        if not layer.is_group():
+            leaves.append(layer)
+    return leaves, None
+
+
+def _as_rgba_array(image) -> np.ndarray:
+    if isinstance(image, np.ndarray):
+        return image
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    return np.asarray(image)
+
+
+def composite_items(size: Tuple[int, int], items: List[CompositeItem], tile: int = DEFAULT_TILE) -> Image.Image:
+    """
+    Source-over blend items onto a transparent canvas of size (width, height).
+
+    The canvas is processed tile by tile with a float32 premultiplied accumulator, so
+    temporaries stay at tile size; each item is only touched in the tiles it overlaps.
+    """
+    width, height = size
+    out = np.zeros((height, width, 4), np.uint8)
+    _composite_into(out, items, tile)
+    return Image.fromarray(out, 'RGBA')
+
+
+def composite_bands(size: Tuple[int, int], items: List[BandItem], band_height: int = DEFAULT_TILE,
+                    tile: int = DEFAULT_TILE) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Source-over blend items band by band, top to bottom; yields (top row, band_height x
+    width x 4 uint8 rows). A layer is loaded when the first band it overlaps is reached and
+    dropped once the sweep has passed it, so only the bitmaps crossing the current band are
+    held, never the whole canvas.
+    """
+    width, height = size
+    pending = sorted(range(len(items)), key=lambda i: items[i].top)
+    active: Dict[int, np.ndarray] = {}
+    nxt = 0
+    for y0 in range(0, height, band_height):
+        y1 = min(y0 + band_height, height)
+        while nxt < len(pending) and items[pending[nxt]].top < y1:
+            i = pending[nxt]
+            nxt += 1
+            item = items[i]
+            if (item.top + item.height <= y0 or item.left >= width or item.left + item.width <= 0
+                    or item.opacity <= 0):
+                continue
+            image = item.load()
+            if image is not None:
+                active[i] = _as_rgba_array(image)
+        band = np.zeros((y1 - y0, width, 4), np.uint8)
+        # z-order is the order of items
+        _composite_into(band, [CompositeItem(active[i], items[i].left, items[i].top - y0, items[i].opacity)
+                               for i in sorted(active)], tile)
+        yield y0, band
+        for i in [i for i, arr in active.items() if items[i].top + arr.shape[0] <= y1]:
+            del active[i]
+
+
+def _composite_into(out: np.ndarray, items: List[CompositeItem], tile: int) -> None:
+    """Blend items (positioned relative to out's top-left corner) into the HxWx4 uint8 array out."""
+    height, width = out.shape[:2]
+    tiles_x = -(-width // tile)
+    tiles_y = -(-height // tile)
+
+    # Bucket items by the tiles they overlap, keeping z-order within each bucket
+    placed: List[Tuple[CompositeItem, np.ndarray]] = []
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    for item in items:
+        arr = _as_rgba_array(item.image)
+        h, w = arr.shape[:2]
+        x0, y0 = max(item.left, 0), max(item.top, 0)
+        x1, y1 = min(item.left + w, width), min(item.top + h, height)
+        if x0 >= x1 or y0 >= y1 or item.opacity <= 0:
+            continue
+        placed.append((item, arr))
+        for ty in range(y0 // tile, (y1 - 1) // tile + 1):
+            for tx in range(x0 // tile, (x1 - 1) // tile + 1):
+                buckets.setdefault((ty, tx), []).append(len(placed) - 1)
+
+    for ty in range(tiles_y):
+        for tx in range(tiles_x):
+            indices = buckets.get((ty, tx))
+            if not indices:
+                continue
+            y0, x0 = ty * tile, tx * tile
+            y1, x1 = min(y0 + tile, height), min(x0 + tile, width)
+            acc = np.zeros((y1 - y0, x1 - x0, 4), np.float32)
+            for k in indices:
+                item, arr = placed[k]
+                h, w = arr.shape[:2]
+                # Intersection of the item with this tile, in canvas coordinates
+                cy0, cx0 = max(y0, item.top), max(x0, item.left)
+                cy1, cx1 = min(y1, item.top + h), min(x1, item.left + w)
+                src = arr[cy0 - item.top:cy1 - item.top, cx0 - item.left:cx1 - item.left].astype(np.float32) * (1.0 / 255.0)
+                a = src[:, :, 3:4] * item.opacity
+                dst = acc[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+                inv = 1.0 - a
+                dst[:, :, :3] = src[:, :, :3] * a + dst[:, :, :3] * inv
+                dst[:, :, 3:4] = a + dst[:, :, 3:4] * inv
+            alpha = acc[:, :, 3:4]
+            rgb = np.divide(acc[:, :, :3], alpha, out=np.zeros_like(acc[:, :, :3]), where=alpha > 0)
+            out[y0:y1, x0:x1, :3] = np.clip(rgb * 255.0 + 0.5, 0, 255).astype(np.uint8)
+            out[y0:y1, x0:x1, 3:4] = np.clip(alpha * 255.0 + 0.5, 0, 255).astype(np.uint8)
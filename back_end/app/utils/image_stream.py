@@ -0,0 +1,220 @@
+"""
+Streaming PNG/TIFF writers for images produced a band of rows at a time
+"""
+import os
+import struct
+import uuid
+import zlib
+from typing import Optional, List
+
+import numpy as np
+
+# Output suffixes a streaming writer exists for
+STREAM_SUFFIXES = ('.png', '.tif', '.tiff')
+
+# Rows filtered/encoded per step, so temporaries stay small even for very wide images
+_FILTER_ROWS = 16
+
+
+class _StreamWriter:
+    """
+    Writes an RGBA image of known size from successive HxWx4 uint8 bands. The file is
+    written under a temporary name and renamed into place by close(), so a failed render
+    never leaves a truncated output behind.
+    """
+
+    def __init__(self, path: str, width: int, height: int, compress_level: int = 6):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.compress_level = compress_level
+        self.rows = 0
+        root, ext = os.path.splitext(path)
+        self._tmp = f"{root}.{uuid.uuid4().hex}.tmp{ext}"
+        self._f = open(self._tmp, 'wb')
+
+    def write(self, band: np.ndarray) -> None:
+        if band.ndim != 3 or band.shape[1] != self.width or band.shape[2] != 4 or band.dtype != np.uint8:
+            raise ValueError(f"expected Hx{self.width}x4 uint8 rows, got {band.shape} {band.dtype}")
+        if self.rows + band.shape[0] > self.height:
+            raise ValueError(f"too many rows: {self.rows + band.shape[0]} > {self.height}")
+        self._write(np.ascontiguousarray(band))
+        self.rows += band.shape[0]
+
+    def close(self) -> None:
+        try:
+            if self.rows != self.height:
+                raise ValueError(f"image incomplete: {self.rows} of {self.height} rows written")
+            self._finish()
+            self._f.close()
+            os.replace(self._tmp, self.path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self) -> None:
+        self._f.close()
+        if os.path.exists(self._tmp):
+            os.unlink(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write(self, band: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def _finish(self) -> None:
+        raise NotImplementedError
+
+
+def _png_filter(rows: np.ndarray, prev: np.ndarray) -> bytes:
+    """
+    PNG scanlines for rows (H x W*4 uint8) following the raw row prev: each row gets the
+    filter (none/sub/up/average/paeth) with the smallest sum of absolute residuals, the
+    heuristic libpng uses. All predictors work on raw bytes, so this is fully vectorized.
+    """
+    x = rows.astype(np.int16)
+    b = np.vstack([prev[None, :], rows[:-1]]).astype(np.int16)
+    a = np.zeros_like(x)
+    a[:, 4:] = x[:, :-4]
+    c = np.zeros_like(x)
+    c[:, 4:] = b[:, :-4]
+    p = a + b - c
+    pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+    paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    candidates = np.stack([x, x - a, x - b, x - ((a + b) >> 1), x - paeth]).astype(np.uint8)
+    scores = np.abs(candidates.view(np.int8).astype(np.int16)).sum(axis=2)
+    best = scores.argmin(axis=0)
+    out = np.empty((rows.shape[0], rows.shape[1] + 1), np.uint8)
+    out[:, 0] = best
+    out[:, 1:] = candidates[best, np.arange(rows.shape[0])]
+    return out.tobytes()
+
+
+class PNGStreamWriter(_StreamWriter):
+    """8-bit RGBA PNG, one zlib stream fed band by band and flushed as IDAT chunks."""
+
+    def __init__(self, path: str, width: int, height: int, compress_level: int = 6):
+        super().__init__(path, width, height, compress_level)
+        self._z = zlib.compressobj(compress_level)
+        self._prev = np.zeros(width * 4, np.uint8)
+        self._f.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        self._f.write(struct.pack('>I', len(data)) + kind + data)
+        self._f.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    def _write(self, band: np.ndarray) -> None:
+        flat = band.reshape(band.shape[0], -1)
+        for start in range(0, flat.shape[0], _FILTER_ROWS):
+            rows = flat[start:start + _FILTER_ROWS]
+            data = self._z.compress(_png_filter(rows, self._prev))
+            self._prev = rows[-1].copy()
+            if data:
+                self._chunk(b'IDAT', data)
+
+    def _finish(self) -> None:
+        self._chunk(b'IDAT', self._z.flush())
+        self._chunk(b'IEND', b'')
+
+
+class TIFFStreamWriter(_StreamWriter):
+    """
+    Little-endian RGBA TIFF (unassociated alpha) with Deflate-compressed strips and the
+    horizontal predictor. Strips are written as rows arrive; the directory goes at the end.
+    Classic TIFF, so the file must stay under 4 GiB.
+    """
+
+    def __init__(self, path: str, width: int, height: int, compress_level: int = 6, rows_per_strip: int = 64):
+        super().__init__(path, width, height, compress_level)
+        self.rows_per_strip = rows_per_strip
+        self._pending: List[np.ndarray] = []
+        self._pending_rows = 0
+        self._offsets: List[int] = []
+        self._counts: List[int] = []
+        # Header; the directory offset is patched in by _finish
+        self._f.write(b'II*\x00' + struct.pack('<I', 0))
+
+    def _write(self, band: np.ndarray) -> None:
+        self._pending.append(band)
+        self._pending_rows += band.shape[0]
+        while self._pending_rows >= self.rows_per_strip:
+            self._flush_strip(self.rows_per_strip)
+
+    def _flush_strip(self, rows: int) -> None:
+        data = np.concatenate(self._pending) if len(self._pending) > 1 else self._pending[0]
+        strip, rest = data[:rows], data[rows:]
+        self._pending = [rest] if len(rest) else []
+        self._pending_rows = len(rest)
+        # Horizontal differencing per channel (Predictor 2)
+        diff = strip.copy()
+        diff[:, 1:] -= strip[:, :-1]
+        payload = zlib.compress(diff.tobytes(), self.compress_level)
+        self._offsets.append(self._f.tell())
+        self._counts.append(len(payload))
+        self._f.write(payload)
+
+    def _finish(self) -> None:
+        if self._pending_rows:
+            self._flush_strip(self._pending_rows)
+
+        def out_of_line(data: bytes) -> int:
+            if self._f.tell() % 2:
+                self._f.write(b'\x00')
+            offset = self._f.tell()
+            self._f.write(data)
+            return offset
+
+        def array(kind: str, values: List[int]) -> Optional[int]:
+            return out_of_line(struct.pack(f'<{len(values)}{kind}', *values)) if len(values) * struct.calcsize(kind) > 4 else None
+
+        bits = array('H', [8, 8, 8, 8])
+        offsets = array('I', self._offsets)
+        counts = array('I', self._counts)
+        if self._f.tell() >= 2 ** 32:
+            raise ValueError("TIFF output exceeds 4 GiB; use PNG for this canvas")
+
+        SHORT, LONG = 3, 4
+        entries = [
+            (256, LONG, 1, self.width),
+            (257, LONG, 1, self.height),
+            (258, SHORT, 4, bits),
+            (259, SHORT, 1, 8),  # Adobe Deflate
+            (262, SHORT, 1, 2),  # RGB
+            (273, LONG, len(self._offsets), offsets if offsets is not None else self._offsets[0]),
+            (277, SHORT, 1, 4),
+            (278, LONG, 1, self.rows_per_strip),
+            (279, LONG, len(self._counts), counts if counts is not None else self._counts[0]),
+            (284, SHORT, 1, 1),  # Chunky
+            (317, SHORT, 1, 2),  # Horizontal predictor
+            (338, SHORT, 1, 2),  # Unassociated alpha
+        ]
+        if self._f.tell() % 2:
+            self._f.write(b'\x00')
+        ifd = self._f.tell()
+        self._f.write(struct.pack('<H', len(entries)))
+        for tag, kind, count, value in entries:
+            if kind == SHORT and count == 1:
+                self._f.write(struct.pack('<HHIHH', tag, kind, count, value, 0))
+            else:
+                self._f.write(struct.pack('<HHII', tag, kind, count, value))
+        self._f.write(struct.pack('<I', 0))
+        self._f.seek(4)
+        self._f.write(struct.pack('<I', ifd))
+
+
+def open_stream_writer(path: str, width: int, height: int, compress_level: int = 6) -> Optional[_StreamWriter]:
+    """Streaming writer for path's format, or None if the format has none."""
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == '.png':
+        return PNGStreamWriter(path, width, height, compress_level)
+    if suffix in ('.tif', '.tiff'):
+        return TIFFStreamWriter(path, width, height, compress_level)
+    return None
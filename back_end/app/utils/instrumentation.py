@@ -0,0 +1,85 @@
+"""
+Per-stage timing and memory instrumentation for PSD requests
+"""
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Optional, List, Dict, Any, Iterator
+
+from .metrics import PSD_REQUESTS, PSD_STAGE_SECONDS, PSD_STAGE_CPU_SECONDS, PSD_STAGE_LAYERS, PSD_STAGE_BYTES, PSD_STAGE_PEAK_RSS
+from .psd_loader import PeakRSSMonitor
+
+logger = logging.getLogger("app.psd.stages")
+
+
+def cpu_seconds() -> float:
+    """Process CPU time, plus child processes (tesseract, export workers) that have exited."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+@dataclass
+class StageMetrics:
+    """
+    One stage of a request. layers counts what the stage worked on: parse = layers in the
+    document, remove_text = type layers removed, ocr = layers rendered for OCR, export =
+    layer images written, compose = layers blended. cpu_ms is process-wide, so concurrent
+    requests inflate it.
+    """
+    stage: str
+    wall_ms: float = 0.0
+    cpu_ms: float = 0.0
+    peak_rss_bytes: int = 0
+    rss_delta_bytes: int = 0  # Peak RSS during the stage minus RSS when it started
+    layers: int = 0
+    bytes_written: int = 0
+
+
+class StageRecorder:
+    """Collects StageMetrics for one request, then logs them and feeds /metrics."""
+
+    def __init__(self, request: Optional[str] = None):
+        self.request = request
+        self.stages: List[StageMetrics] = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageMetrics]:
+        """Time the block; the caller fills in layers and bytes_written on the yielded record."""
+        metrics = StageMetrics(name)
+        wall, cpu = time.perf_counter(), cpu_seconds()
+        memory = PeakRSSMonitor()
+        memory.__enter__()
+        try:
+            yield metrics
+        finally:
+            memory.__exit__(None, None, None)
+            metrics.wall_ms = round((time.perf_counter() - wall) * 1000, 2)
+            metrics.cpu_ms = round((cpu_seconds() - cpu) * 1000, 2)
+            metrics.peak_rss_bytes = memory.peak_rss
+            metrics.rss_delta_bytes = memory.peak_rss - memory.start_rss
+            self.stages.append(metrics)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_wall_ms": round((time.perf_counter() - self._start) * 1000, 2),
+            "stages": [asdict(s) for s in self.stages],
+        }
+
+    def finish(self, status: str) -> Dict[str, Any]:
+        """Record the request outcome: one structured log line per stage plus a summary, and metric updates."""
+        report = self.to_dict()
+        PSD_REQUESTS.inc(status=status)
+        for s in self.stages:
+            PSD_STAGE_SECONDS.observe(s.wall_ms / 1000, stage=s.stage)
+            PSD_STAGE_CPU_SECONDS.inc(s.cpu_ms / 1000, stage=s.stage)
+            PSD_STAGE_LAYERS.inc(s.layers, stage=s.stage)
+            PSD_STAGE_BYTES.inc(s.bytes_written, stage=s.stage)
+            PSD_STAGE_PEAK_RSS.set(s.peak_rss_bytes, stage=s.stage)
+            logger.info(json.dumps({"event": "psd_stage", "request": self.request, **asdict(s)}, ensure_ascii=False))
+        logger.info(json.dumps({"event": "psd_request", "request": self.request, "status": status,
+                                "total_wall_ms": report["total_wall_ms"]}, ensure_ascii=False))
+        return report
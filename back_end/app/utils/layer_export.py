@@ -0,0 +1,326 @@
+"""
+Parallel layer export for the PSD canvas builders
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Iterator, Set, Callable, Tuple
+
+from .asset_optimize import AssetOptions, write_asset
+from .psd_loader import open_psd, release_pages
+
+# Below this many layers the cost of starting workers (each re-opens the PSD)
+# outweighs the gain, so the export runs inline.
+_MIN_PARALLEL_JOBS = 8
+
+# Upper bound for workers=0 (one per CPU): every process worker holds its own parsed copy
+# of the document, and each export request runs alongside other requests
+_MAX_AUTO_WORKERS = 8
+
+
+def _process_context():
+    """
+    Start export workers with forkserver (spawn where unavailable) instead of fork, so
+    they do not inherit the server's threads, locks and heap.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def iter_layers(container) -> Iterator:
+    """Yield every layer under container (groups included) in pre-order."""
+    for layer in container:
+        yield layer
+        if hasattr(layer, 'is_group') and layer.is_group():
+            yield from iter_layers(layer)
+
+
+def layer_ordinals(psd) -> Dict[int, int]:
+    """
+    Map id(layer) -> position in iter_layers(psd).
+    Must be taken right after PSDImage.open, before any layer is removed, so that
+    a worker re-opening the same file can find the layer at the same position.
+    """
+    return {id(layer): i for i, layer in enumerate(iter_layers(psd))}
+
+
+def prune_layers(container, keep: Set[int], ordinals: Dict[int, int]) -> None:
+    """Drop every layer whose ordinal is not in keep (psd-tools keeps children in _layers)."""
+    container._layers[:] = [l for l in container._layers if ordinals.get(id(l)) in keep]
+    for layer in container._layers:
+        if hasattr(layer, 'is_group') and layer.is_group():
+            prune_layers(layer, keep, ordinals)
+
+
+def render_layer(layer):
+    """Render a layer to a PIL image: groups are composited, other layers use topil."""
+    if hasattr(layer, 'is_group') and layer.is_group():
+        if hasattr(layer, 'composite'):
+            return layer.composite()
+        return None
+    if hasattr(layer, 'topil'):
+        return layer.topil()
+    return None
+
+
+@dataclass
+class ExportSource:
+    """The on-disk PSD a document was opened from, plus its original layer ordinals."""
+    path: str
+    ordinals: Dict[int, int]
+    # Workers open the file memory-mapped too
+    lazy: bool = False
+
+
+@dataclass
+class ExportResult:
+    index: int
+    dest_path: str
+    ok: bool
+    render_ms: float = 0.0
+    encode_ms: float = 0.0
+    bytes_written: int = 0
+    error: Optional[str] = None
+    # (left, top, width, height) of the written area inside the rendered layer, if trimmed
+    crop: Optional[Tuple[int, int, int, int]] = None
+    quantized: bool = False
+    raw_bytes: int = 0  # RGBA size of the rendered layer
+    trimmed_raw_bytes: int = 0  # RGBA size after trimming
+    baseline_bytes: Optional[int] = None  # Full-bbox RGBA PNG size (AssetOptions.measure_savings)
+    previews: Optional[Dict[int, str]] = None  # Preview size -> path (dest_path if the image already fits)
+    preview_bytes: int = 0
+    content_hash: Optional[str] = None  # Set when written to the shared asset store (dest_path points there)
+    reused: bool = False  # The store already had this content
+
+
+def export_layer(layer, dest_path: str, index: int = 0, render: Callable[[Any], Any] = render_layer,
+                 options: Optional[AssetOptions] = None) -> ExportResult:
+    """
+    Render one layer (render(layer), e.g. a RenderCache.get) and write it with the asset
+    options (default: full-bbox RGBA PNG), timing both steps.
+    """
+    t0 = time.perf_counter()
+    try:
+        img = render(layer)
+        t1 = time.perf_counter()
+        if img is None:
+            return ExportResult(index, dest_path, False, render_ms=(t1 - t0) * 1000, error="layer has no pixels")
+        info = write_asset(img, dest_path, options or AssetOptions())
+        t2 = time.perf_counter()
+        return ExportResult(
+            index,
+            info["path"],
+            True,
+            render_ms=(t1 - t0) * 1000,
+            encode_ms=(t2 - t1) * 1000,
+            bytes_written=info["bytes_written"],
+            crop=info["crop"],
+            quantized=info["quantized"],
+            raw_bytes=info["raw_bytes"],
+            trimmed_raw_bytes=info["trimmed_raw_bytes"],
+            baseline_bytes=info.get("baseline_bytes"),
+            previews=info["previews"],
+            preview_bytes=info["preview_bytes"],
+            content_hash=info["content_hash"],
+            reused=info["reused"],
+        )
+    except Exception as e:
+        return ExportResult(index, dest_path, False, render_ms=(time.perf_counter() - t0) * 1000, error=str(e))
+
+
+# Per-process state for pool workers: the worker's own copy of the PSD and ordinal -> layer.
+_worker_psd = None
+_worker_layers: Dict[int, Any] = {}
+
+
+def _init_worker(source_path: str, keep: Set[int], lazy: bool = False) -> None:
+    global _worker_psd, _worker_layers
+    psd = open_psd(source_path, lazy)
+    layers = list(iter_layers(psd))
+    ordinals = {id(layer): i for i, layer in enumerate(layers)}
+    # Replay removals from the parent so group composites match what it would render
+    prune_layers(psd, keep, ordinals)
+    _worker_psd = psd
+    _worker_layers = {i: layer for i, layer in enumerate(layers) if i in keep}
+
+
+def _export_in_worker(ordinal: int, dest_path: str, index: int, options: Optional[AssetOptions] = None) -> ExportResult:
+    layer = _worker_layers.get(ordinal)
+    if layer is None:
+        return ExportResult(index, dest_path, False, error=f"layer #{ordinal} not found in worker")
+    result = export_layer(layer, dest_path, index, options=options)
+    release_pages(_worker_psd)
+    return result
+
+
+def _job_options(job: tuple, options: Optional[AssetOptions]) -> Optional[AssetOptions]:
+    """A job is (layer, dest_path) or (layer, dest_path, options) overriding the batch options."""
+    return job[2] if len(job) > 2 and job[2] is not None else options
+
+
+class LayerExportEngine:
+    """
+    Exports many layers to PNG/WebP, optionally in parallel.
+
+    executor='thread' (the default) shares the parent's layer objects and relies on
+    Pillow releasing the GIL while encoding. executor='process' is an opt-in for large
+    offline jobs: it starts a pool per export (forkserver/spawn, not forked from the
+    server) whose workers re-open the PSD and render + encode there, so decode and PNG
+    compression both scale across cores at the cost of one parse per worker.
+    Results are always returned in job order.
+    """
+
+    def __init__(self, workers: int = 1, executor: str = 'thread'):
+        self.workers = workers if workers and workers > 0 else min(os.cpu_count() or 1, _MAX_AUTO_WORKERS)
+        self.executor = executor if executor in ('process', 'thread') else 'thread'
+
+    def export(self, jobs: List[tuple], psd=None, source: Optional[ExportSource] = None,
+               progress: Optional[Callable[[int, int], None]] = None, renders=None,
+               on_result: Optional[Callable[[ExportResult], None]] = None,
+               options: Optional[AssetOptions] = None) -> List[ExportResult]:
+        """
+        Export (layer, dest_path) jobs, written according to options; a job may carry its own
+        options as a third element. psd and source are needed for the process executor;
+        without them the export falls back to threads. progress(done, total) and
+        on_result(result) are called from the calling thread as each layer finishes, in
+        completion order.
+
+        renders is an optional RenderCache with one planned use per job: bitmaps already
+        rendered by an earlier stage are encoded in this process instead of being decoded
+        again by a worker.
+        """
+        render = renders.get if renders is not None else render_layer
+        workers = min(self.workers, len(jobs))
+        if workers <= 1 or len(jobs) < _MIN_PARALLEL_JOBS:
+            return self._export_inline(jobs, progress, render, on_result, options)
+
+        if self.executor == 'process' and psd is not None and source is not None:
+            try:
+                return self._export_processes(jobs, workers, psd, source, progress, renders, on_result, options)
+            except BrokenProcessPool as e:
+                print(f"layer export pool failed, exporting inline: {e}")
+                return self._export_inline(jobs, progress, render, on_result, options)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(export_layer, job[0], job[1], i, render, _job_options(job, options)): i
+                       for i, job in enumerate(jobs)}
+            return self._collect(futures, [None] * len(jobs), progress, on_result)
+
+    def _export_inline(self, jobs: List[tuple], progress: Optional[Callable[[int, int], None]],
+                       render: Callable[[Any], Any] = render_layer,
+                       on_result: Optional[Callable[[ExportResult], None]] = None,
+                       options: Optional[AssetOptions] = None) -> List[ExportResult]:
+        results = []
+        for i, job in enumerate(jobs):
+            results.append(export_layer(job[0], job[1], i, render, _job_options(job, options)))
+            if on_result:
+                on_result(results[-1])
+            if progress:
+                progress(i + 1, len(jobs))
+        return results
+
+    def _export_processes(self, jobs: List[tuple], workers: int, psd, source: ExportSource,
+                          progress: Optional[Callable[[int, int], None]], renders=None,
+                          on_result: Optional[Callable[[ExportResult], None]] = None,
+                          options: Optional[AssetOptions] = None) -> List[ExportResult]:
+        keep = {source.ordinals[id(l)] for l in iter_layers(psd) if id(l) in source.ordinals}
+        results: List[Optional[ExportResult]] = [None] * len(jobs)
+        futures = {}
+        local: List[int] = []
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_process_context(), initializer=_init_worker,
+                                 initargs=(source.path, keep, source.lazy)) as pool:
+            for i, job in enumerate(jobs):
+                layer, dest = job[:2]
+                ordinal = source.ordinals.get(id(layer))
+                if ordinal is None or (renders is not None and renders.peek(layer) is not None):
+                    # Not part of the original document, or already rendered: encode here
+                    local.append(i)
+                    continue
+                if renders is not None:
+                    renders.release(layer)
+                futures[pool.submit(_export_in_worker, ordinal, dest, i, _job_options(job, options))] = i
+            # Overlaps with the workers
+            render = renders.get if renders is not None else render_layer
+            for i in local:
+                layer, dest = jobs[i][:2]
+                results[i] = export_layer(layer, dest, i, render, _job_options(jobs[i], options))
+                if on_result:
+                    on_result(results[i])
+            return self._collect(futures, results, progress, on_result)
+
+    @staticmethod
+    def _collect(futures: Dict[Any, int], results: List[Optional[ExportResult]],
+                 progress: Optional[Callable[[int, int], None]],
+                 on_result: Optional[Callable[[ExportResult], None]] = None) -> List[ExportResult]:
+        done = len(results) - len(futures)
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            done += 1
+            if on_result:
+                on_result(result)
+            if progress:
+                progress(done, len(results))
+        return results  # type: ignore[return-value]
+
+
+def summarize_exports(results: List[ExportResult], wall_ms: float, workers: int, executor: str) -> Dict[str, Any]:
+    """Per-layer timing report returned alongside the canvas."""
+    return {
+        "workers": workers,
+        "executor": executor,
+        "wall_ms": round(wall_ms, 2),
+        "layers_exported": sum(1 for r in results if r.ok),
+        "layers_failed": sum(1 for r in results if not r.ok),
+        "bytes_written": sum(r.bytes_written for r in results),
+        "layers": [
+            {
+                "file": os.path.basename(r.dest_path),
+                "ok": r.ok,
+                "render_ms": round(r.render_ms, 2),
+                "encode_ms": round(r.encode_ms, 2),
+                "bytes": r.bytes_written,
+                **({"crop": list(r.crop)} if r.crop else {}),
+                **({"quantized": True} if r.quantized else {}),
+                **({"error": r.error} if r.error else {}),
+            }
+            for r in results
+        ],
+    }
+
+
+def summarize_assets(results: List[ExportResult], options: AssetOptions) -> Dict[str, Any]:
+    """
+    Per-document size report for the optimization stage. raw_bytes_saved compares RGBA
+    pixel data before and after trimming; bytes_saved compares the written files with
+    full-bbox RGBA PNGs and is only present when options.measure_savings is set.
+    """
+    ok = [r for r in results if r.ok]
+    report: Dict[str, Any] = {
+        "format": options.format,
+        **({"lossless": options.lossless} if options.format == 'webp' else {}),
+        "trim": options.trim,
+        "quantize": options.quantize,
+        "layers": len(ok),
+        "layers_trimmed": sum(1 for r in ok if r.crop),
+        "layers_quantized": sum(1 for r in ok if r.quantized),
+        "raw_bytes": sum(r.raw_bytes for r in ok),
+        "raw_bytes_saved": sum(r.raw_bytes - r.trimmed_raw_bytes for r in ok),
+        "bytes_written": sum(r.bytes_written for r in ok),
+    }
+    if options.dedup_dir:
+        report["layers_deduplicated"] = sum(1 for r in ok if r.reused)
+        report["bytes_deduplicated"] = sum(r.bytes_written + r.preview_bytes for r in ok if r.reused)
+        report["bytes_written"] -= sum(r.bytes_written for r in ok if r.reused)
+    if options.preview_sizes:
+        report["preview_sizes"] = sorted(options.preview_sizes)
+        report["preview_bytes"] = sum(r.preview_bytes for r in ok)
+    if ok and all(r.baseline_bytes is not None for r in ok):
+        baseline = sum(r.baseline_bytes for r in ok)
+        report["baseline_bytes"] = baseline
+        report["bytes_saved"] = baseline - report["bytes_written"]
+        report["saved_ratio"] = round(report["bytes_saved"] / baseline, 4) if baseline else 0.0
+    return report
@@ -0,0 +1,158 @@
+"""
+Minimal Prometheus text-format metrics registry
+"""
+import math
+import threading
+from typing import Optional, List, Dict, Tuple, Callable, Iterable
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, '')) for n in self.label_names)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, n = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, n + 1)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, key, ('le', _number(bound)))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, ('le', '+Inf'))} {n}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, key)} {n}")
+        return lines
+
+
+class Registry:
+    """Metrics in registration order; collectors run at scrape time to refresh gauges."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect: Callable[[], None]) -> None:
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"metrics collector error: {e}")
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+PSD_REQUESTS = REGISTRY.register(Counter(
+    'psd_requests_total', 'PSD documents processed, by outcome', ('status',)))
+PSD_STAGE_SECONDS = REGISTRY.register(Histogram(
+    'psd_stage_seconds', 'Wall time of each PSD processing stage', ('stage',)))
+PSD_STAGE_CPU_SECONDS = REGISTRY.register(Counter(
+    'psd_stage_cpu_seconds_total', 'Process CPU time (including exited child processes) spent in each stage', ('stage',)))
+PSD_STAGE_LAYERS = REGISTRY.register(Counter(
+    'psd_stage_layers_total', 'Layers touched by each stage', ('stage',)))
+PSD_STAGE_BYTES = REGISTRY.register(Counter(
+    'psd_stage_bytes_written_total', 'Bytes written to disk by each stage', ('stage',)))
+PSD_STAGE_PEAK_RSS = REGISTRY.register(Gauge(
+    'psd_stage_peak_rss_bytes', 'Process peak RSS during the most recent run of each stage', ('stage',)))
+PSD_JOBS = REGISTRY.register(Gauge(
+    'psd_jobs', 'PSD jobs currently in the job table, by state', ('state',)))
+PSD_RESULT_CACHE = REGISTRY.register(Gauge(
+    'psd_result_cache', 'Processed-PSD result cache counters and size', ('field',)))
+CUTOUT_REQUESTS = REGISTRY.register(Counter(
+    'cutout_requests_total', 'Background removal requests, by outcome', ('status',)))
+CUTOUT_SECONDS = REGISTRY.register(Histogram(
+    'cutout_seconds', 'Background removal time from queueing to result, by outcome', ('status',)))
+CUTOUT_QUEUE = REGISTRY.register(Gauge(
+    'cutout_queue', 'Background removals in the executor, by state', ('state',)))
+CUTOUT_BATCH_SIZE = REGISTRY.register(Histogram(
+    'cutout_batch_size', 'Images per micro-batched background removal inference', (), (1, 2, 4, 8, 16, 32)))
+CUTOUT_CACHE = REGISTRY.register(Gauge(
+    'cutout_result_cache', 'Background removal result cache counters and size', ('field',)))
@@ -0,0 +1,107 @@
+"""
+Pooled, batched tesseract execution
+
+Images that share the same language and config are packed into multi-page TIFFs
+and each TIFF is OCR'd by one tesseract process. Tesseract treats every page as an
+independent image, so per-image text is the same as calling it once per image,
+while the model is loaded once per batch instead of once per image. Batches run
+concurrently on a thread pool (the work happens in the tesseract subprocesses).
+"""
+import os
+import shlex
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Tuple, Union
+
+import numpy as np
+import pytesseract
+from PIL import Image
+
+OCRImage = Union[np.ndarray, Image.Image]
+
+PAGE_SEPARATOR = '\f'
+
+
+def _to_pil(image: OCRImage) -> Image.Image:
+    if isinstance(image, Image.Image):
+        return image
+    return Image.fromarray(np.ascontiguousarray(image))
+
+
+class OCRExecutor:
+    """
+    Thread pool of tesseract invocations.
+
+    map() OCRs many images and returns their texts in input order; batch_size pages go
+    into each tesseract call. A batch of one goes through pytesseract exactly as before.
+    """
+
+    def __init__(self, workers: int = 0, batch_size: int = 8, timeout: float = 0):
+        self.workers = workers if workers and workers > 0 else (os.cpu_count() or 1)
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout or None
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ocr')
+
+    def image_to_string(self, image: OCRImage, lang: Optional[str] = None, config: str = '') -> str:
+        """Single image, same signature as pytesseract.image_to_string."""
+        return self.map([image], lang=lang, config=config)[0]
+
+    def map(self, images: List[OCRImage], lang: Optional[str] = None, config: str = '') -> List[str]:
+        """OCR images with one lang/config; returns texts in the same order."""
+        return self.map_requests([(image, lang, config) for image in images])
+
+    def map_requests(self, requests: List[Tuple[OCRImage, Optional[str], str]]) -> List[str]:
+        """OCR (image, lang, config) requests; images with equal lang/config share batches."""
+        groups: Dict[Tuple[Optional[str], str], List[int]] = {}
+        for i, (_, lang, config) in enumerate(requests):
+            groups.setdefault((lang, config), []).append(i)
+
+        batches: List[Tuple[List[int], Optional[str], str]] = []
+        for (lang, config), indices in groups.items():
+            for start in range(0, len(indices), self.batch_size):
+                batches.append((indices[start:start + self.batch_size], lang, config))
+
+        texts: List[str] = [''] * len(requests)
+        futures = [
+            (indices, self._pool.submit(self._run_batch, [requests[i][0] for i in indices], lang, config))
+            for indices, lang, config in batches
+        ]
+        for indices, future in futures:
+            for i, text in zip(indices, future.result()):
+                texts[i] = text
+        return texts
+
+    def _run_batch(self, images: List[OCRImage], lang: Optional[str], config: str) -> List[str]:
+        with self._calls_lock:
+            self.calls += 1
+        if len(images) == 1:
+            return [pytesseract.image_to_string(images[0], lang=lang, config=config, timeout=self.timeout or 0)]
+
+        pages = [_to_pil(image) for image in images]
+        with tempfile.TemporaryDirectory(prefix='ocr_') as tmp:
+            tiff_path = os.path.join(tmp, 'batch.tif')
+            pages[0].save(tiff_path, format='TIFF', save_all=True, append_images=pages[1:], compression='tiff_deflate')
+            cmd = [pytesseract.pytesseract.tesseract_cmd, tiff_path, 'stdout']
+            if lang:
+                cmd += ['-l', lang]
+            cmd += shlex.split(config) + ['-c', 'page_separator=' + PAGE_SEPARATOR]
+            env = dict(os.environ)
+            # Parallelism comes from the pool; keep each tesseract single-threaded
+            if self.workers > 1:
+                env.setdefault('OMP_THREAD_LIMIT', '1')
+            proc = subprocess.run(cmd, capture_output=True, env=env, timeout=self.timeout)
+            if proc.returncode != 0:
+                raise pytesseract.TesseractError(proc.returncode, proc.stderr.decode('utf-8', 'ignore'))
+
+        texts = proc.stdout.decode('utf-8', 'ignore').split(PAGE_SEPARATOR)
+        if len(texts) < len(images):
+            # Page count mismatch: fall back to one call per image rather than guess the mapping
+            return [pytesseract.image_to_string(image, lang=lang, config=config) for image in images]
+        return texts[:len(images)]
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,230 @@
+"""
+Memory-mapped, lazy PSD/PSB loading
+"""
+import mmap
+import os
+import threading
+import resource
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterator
+
+from psd_tools import PSDImage
+from psd_tools.constants import Compression
+from psd_tools.psd.bin_utils import read_fmt
+from psd_tools.psd.image_data import ImageData
+from psd_tools.psd.layer_and_mask import ChannelData
+try:
+    # psd-tools >= 1.18 budgets bytes read per document; older releases have no limits
+    from psd_tools.psd.parse_limits import consume_bytes
+except ImportError:  # pragma: no cover - depends on the installed psd-tools
+    def consume_bytes(length: int) -> None:
+        pass
+
+
+class MappedReader:
+    """
+    Read-only file object over an mmap of the whole document.
+
+    read() returns bytes like a normal file; view() returns a zero-copy memoryview that
+    the patched ChannelData/ImageData readers keep instead of copying pixel data into
+    the heap. Pages are faulted in when a layer is decoded and can be dropped again
+    with release_pages().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # mmap keeps its own duplicate of the descriptor
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._pos = 0
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._mm) if size is None or size < 0 else min(self._pos + size, len(self._mm))
+        data = self._mm[self._pos:end]
+        self._pos = end
+        return data
+
+    def view(self, size: int) -> memoryview:
+        end = min(self._pos + size, len(self._mm))
+        data = memoryview(self._mm)[self._pos:end]
+        self._pos = end
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self._mm)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def release_pages(self) -> None:
+        """Drop this process's mapping of file pages (they stay in the page cache)."""
+        if hasattr(self._mm, 'madvise') and hasattr(mmap, 'MADV_DONTNEED'):
+            try:
+                self._mm.madvise(mmap.MADV_DONTNEED)
+            except (OSError, ValueError):
+                pass
+
+    def close(self) -> None:
+        try:
+            self._mm.close()
+        except BufferError:
+            # Layers still reference views; the map is closed when they are collected
+            pass
+
+
+def _mapped(fp) -> Optional[MappedReader]:
+    """The MappedReader behind fp, looking through psd-tools' bounded section readers."""
+    while fp is not None:
+        if isinstance(fp, MappedReader):
+            return fp
+        fp = getattr(fp, '_fp', None)
+    return None
+
+
+def _remaining(fp) -> int:
+    position = fp.tell()
+    end = fp.seek(0, 2)
+    fp.seek(position)
+    return end - position
+
+
+_channel_read = ChannelData.read.__func__
+_image_data_read = ImageData.read.__func__
+
+
+def _read_channel_data(cls, fp, length: int = 0, **kwargs):
+    mapped = _mapped(fp)
+    if mapped is None:
+        return _channel_read(cls, fp, length, **kwargs)
+    compression = Compression(read_fmt("H", fp)[0])
+    length = max(length, 0)
+    if length > _remaining(fp):
+        raise IOError("Invalid data section size: %d" % length)
+    consume_bytes(length)
+    return cls(compression=compression, data=mapped.view(length))
+
+
+def _read_image_data(cls, fp, **kwargs):
+    mapped = _mapped(fp)
+    if mapped is None:
+        return _image_data_read(cls, fp, **kwargs)
+    compression = Compression(read_fmt("H", fp)[0])
+    length = _remaining(fp)
+    consume_bytes(length)
+    return cls(compression, mapped.view(length))
+
+
+_patch_lock = threading.Lock()
+_patch_users = 0
+
+
+@contextmanager
+def _zero_copy_readers() -> Iterator[None]:
+    """
+    Swap in the zero-copy ChannelData/ImageData readers while a lazy open parses. They are
+    class attributes, so they are installed for the first concurrent lazy open and
+    restored when the last one finishes; a normal open running in that window still
+    takes the stock path, since its file object is not a MappedReader.
+    """
+    global _patch_users
+    with _patch_lock:
+        if _patch_users == 0:
+            ChannelData.read = classmethod(_read_channel_data)
+            ImageData.read = classmethod(_read_image_data)
+        _patch_users += 1
+    try:
+        yield
+    finally:
+        with _patch_lock:
+            _patch_users -= 1
+            if _patch_users == 0:
+                ChannelData.read = classmethod(_channel_read)
+                ImageData.read = classmethod(_image_data_read)
+
+
+def open_psd(path: str, lazy: bool = False) -> PSDImage:
+    """
+    PSDImage.open, optionally over a memory map: layer records are parsed as usual but
+    channel data stays in the file until a layer is rendered. The reader is kept on
+    psd._mapped_reader so callers can release pages after rendering.
+    """
+    if not lazy:
+        return PSDImage.open(path)
+    reader = MappedReader(path)
+    try:
+        with _zero_copy_readers():
+            psd = PSDImage.open(reader)
+    except Exception:
+        reader.close()
+        raise
+    psd._mapped_reader = reader
+    return psd
+
+
+def release_pages(psd) -> None:
+    """Unmap file pages touched while rendering from a lazily opened document."""
+    reader = getattr(psd, '_mapped_reader', None)
+    if reader is not None:
+        reader.release_pages()
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (0 if unavailable)."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the lifetime peak (kilobytes on Linux); best available fallback
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakRSSMonitor:
+    """
+    Samples the process RSS on a background thread while a file is processed.
+
+    The process may be working on other requests at the same time, so the peak is an
+    upper bound for a single file.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.start_rss = 0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "PeakRSSMonitor":
+        self.start_rss = self.peak_rss = current_rss()
+        self._thread = threading.Thread(target=self._sample, name='rss-monitor', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def report(self, file_size: int) -> Dict[str, Any]:
+        return {
+            "file_bytes": file_size,
+            "start_rss_bytes": self.start_rss,
+            "peak_rss_bytes": self.peak_rss,
+            "peak_rss_delta_bytes": self.peak_rss - self.start_rss,
+            "peak_to_file_ratio": round((self.peak_rss - self.start_rss) / file_size, 3) if file_size else None,
+        }
@@ -2,18 +2,58 @@
 PSD processing utilities
 """
 import os
-import cv2
+import time
+from dataclasses import replace
 import numpy as np
 from PIL import Image
 import pytesseract
-from psd_tools import PSDImage
-from typing import Optional, Tuple, List, Dict, Any
+from typing import Optional, Tuple, List, Dict, Any, Callable
 from pathlib import Path
 
+from .layer_export import LayerExportEngine, ExportResult, ExportSource, export_layer, iter_layers, layer_ordinals, render_layer, summarize_exports, summarize_assets
+from .asset_optimize import AssetOptions, asset_options_for, encode_image, place_cloud, write_previews
+from .asset_store import SharedAssetStore
+from .text_detection import StagedTextDetector, TextDetectorConfig, document_dpi, roi_crops
+from .ocr_executor import OCRExecutor
+from .render_cache import RenderCache
+from .compositor import BandItem, compositable_leaves, composite_bands
+from .image_stream import STREAM_SUFFIXES, open_stream_writer
+from .psd_loader import PeakRSSMonitor, open_psd, release_pages
+from .instrumentation import StageRecorder
+
+# on_event receives {"type": "background" | "cloud", ...} as soon as the layer's PNG is written
+CanvasEventCallback = Callable[[Dict[str, Any]], None]
+
+
 class PSDProcessor:
-    def __init__(self, tesseract_cmd: str = None):
+    def __init__(self, tesseract_cmd: str = None, export_workers: int = 1, export_executor: str = 'thread',
+                 ocr_staged: bool = True, ocr_target_dpi: int = 150, ocr_workers: int = 0, ocr_batch_size: int = 8,
+                 ocr_roi_min_side: int = 8, ocr_roi_min_area: int = 256,
+                 render_cache_bytes: int = 512 * 1024 * 1024, lazy_load_min_bytes: int = 256 * 1024 * 1024,
+                 asset_options: Optional[AssetOptions] = None, asset_store: Optional[SharedAssetStore] = None,
+                 tiled_compose_min_pixels: int = 100_000_000, compose_band_rows: int = 512):
         if tesseract_cmd:
             pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+        self.export_engine = LayerExportEngine(workers=export_workers, executor=export_executor)
+        # Staged OCR: cheap pre-filters + cropped regions; False = OCR every full layer image
+        self.ocr_staged = ocr_staged
+        # OCR only looks at opaque regions of a layer at least this large
+        self.ocr_config = TextDetectorConfig(target_dpi=ocr_target_dpi, roi_min_side=ocr_roi_min_side, roi_min_area=ocr_roi_min_area)
+        self.ocr_executor = OCRExecutor(workers=ocr_workers, batch_size=ocr_batch_size)
+        # Budget for layer bitmaps kept between the OCR, export and compose passes of one request
+        self.render_cache_bytes = render_cache_bytes
+        # Files at least this large are opened memory-mapped (0 = always, negative = never)
+        self.lazy_load_min_bytes = lazy_load_min_bytes
+        # Trim/quantize/encoding of canvas layer assets; the format is chosen per request
+        self.asset_options = asset_options or AssetOptions()
+        # Identical layer images are stored once and reference counted per canvas
+        self.asset_store = asset_store
+        if asset_store is not None:
+            self.asset_options = replace(self.asset_options, dedup_dir=str(asset_store.dir))
+        # Canvases with at least this many pixels are flattened band by band straight to a
+        # PNG/TIFF file (0 = always, negative = never); compose_band_rows is the band height
+        self.tiled_compose_min_pixels = tiled_compose_min_pixels
+        self.compose_band_rows = compose_band_rows
 
     def remove_text_layers_recursive(self, layer, parent=None, parent_layers=None, index=None):
         """
@@ -32,17 +72,20 @@ class PSDProcessor:
 
     def detect_text_in_image(self, image_data, layer_name: str) -> bool:
         """
-        Detect if an image contains text using OCR
+        Detect if an image contains text using OCR.
+        Only the opaque connected regions of the layer above the size threshold are OCR'd,
+        each cropped with a small margin; transparent areas never reach tesseract.
         """
         try:
-            # Convert to grayscale
-            gray = cv2.cvtColor(np.array(image_data), cv2.COLOR_RGBA2GRAY)
+            crops = roi_crops(image_data, self.ocr_config)
+            if not crops:
+                return False
             
             # Use Tesseract to detect text
-            text = pytesseract.image_to_string(gray)
+            texts = self.ocr_executor.map(crops)
             
             # If we found any text, return True
-            return len(text.strip()) > 0
+            return any(len(text.strip()) > 0 for text in texts)
             
         except Exception as e:
             print(f"Error in text detection for layer {layer_name}: {str(e)}")
@@ -81,65 +124,310 @@ class PSDProcessor:
             return None
 
     def _export_layer_image(self, layer, dest_path: str) -> bool:
-        try:
-            img = None
-            # group layer use composite, normal layer use topil
-            if hasattr(layer, 'is_group') and layer.is_group():
-                if hasattr(layer, 'composite'):
-                    img = layer.composite()
-            elif hasattr(layer, 'topil'):
-                img = layer.topil()
-            if img is None:
-                return False
-            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-            # Always export RGBA PNG
-            img = img.convert('RGBA')
-            img.save(dest_path, format='PNG')
-            return True
-        except Exception as e:
-            print(f"export_layer_image error: {e}")
+        result = export_layer(layer, dest_path)
+        if not result.ok and result.error:
+            print(f"export_layer_image error: {result.error}")
+        return result.ok
+
+    def _export_batch(self, jobs: List[tuple], psd, source: Optional[ExportSource], timings: Optional[List],
+                      progress: Optional[Callable[[int, int], None]] = None, renders: Optional[RenderCache] = None,
+                      on_result: Optional[Callable[[ExportResult], None]] = None,
+                      options: Optional[AssetOptions] = None, owner: Optional[str] = None) -> List[ExportResult]:
+        """
+        Export (layer, dest_path) jobs through the export engine; returns results in job order.
+        Images that went to the shared asset store are acquired for owner (the canvas assets dir).
+        """
+        start = time.perf_counter()
+        options = options or self.asset_options
+        results = self.export_engine.export(jobs, psd=psd, source=source, progress=progress, renders=renders,
+                                            on_result=on_result, options=options)
+        for r in results:
+            if not r.ok and r.error:
+                print(f"export_layer_image error: {r.error}")
+        if self.asset_store is not None and owner is not None:
+            self.asset_store.acquire(owner, [r.content_hash for r in results if r.ok and r.content_hash])
+        if timings is not None:
+            stats = summarize_exports(results, (time.perf_counter() - start) * 1000,
+                                      min(self.export_engine.workers, max(len(jobs), 1)),
+                                      self.export_engine.executor)
+            stats["assets"] = summarize_assets(results, options)
+            timings.append(stats)
+        return results
+
+    def _remove_from_parent(self, layer) -> bool:
+        """Detach a layer from its parent group (or the document)."""
+        parent = getattr(layer, 'parent', None)
+        if parent is None:
             return False
+        # parent._layers is used internally in psd-tools
+        for j, l in enumerate(parent._layers):
+            if l is layer:
+                del parent._layers[j]
+                return True
+        return False
 
-    def _remove_text_images_recursive(self, layer, skip_ocr: bool = False):
-        """Recursively remove image layers that contain text by OCR."""
-        try:
-            if hasattr(layer, 'is_group') and layer.is_group():
-                # Traverse children from end to start so deletion is safe
-                for i in range(len(layer) - 1, -1, -1):
-                    sub = layer[i]
-                    self._remove_text_images_recursive(sub, skip_ocr)
-                return
-            # Non-group: optionally OCR check
-            if skip_ocr:
+    def _ocr_candidates(self, psd) -> List:
+        """Non-group layers that the OCR pass renders."""
+        return [layer for layer in iter_layers(psd)
+                if not (hasattr(layer, 'is_group') and layer.is_group()) and hasattr(layer, 'topil')]
+
+    def _planned_exports(self, psd, canvas_mode: str) -> List:
+        """Non-group layers the canvas builders are expected to export (before OCR removals)."""
+        layers = list(psd)
+        planned: List = []
+        if layers:
+            bottom = layers[-1]
+            if getattr(bottom, 'name', '').lower() in ['background', '背景'] and getattr(bottom, 'visible', True):
+                planned.append(bottom)
+        if canvas_mode == 'group':
+            tops = [l for l in layers if str(getattr(l, 'name', '')).lower() not in ['background', '背景']]
+        else:
+            tops = []
+            for top in psd:
+                self._collect_bottom_layers(top, tops)
+        for layer in tops:
+            if hasattr(layer, 'visible') and not layer.visible:
+                continue
+            if not (hasattr(layer, 'is_group') and layer.is_group()):
+                planned.append(layer)
+        return planned
+
+    def _remove_text_images(self, psd, detector: Optional[StagedTextDetector] = None,
+                            progress: Optional[Callable[[float], None]] = None,
+                            renders: Optional[RenderCache] = None,
+                            executor: Optional[OCRExecutor] = None) -> int:
+        """
+        Remove image layers that contain text by OCR.
+        Pixel layers are turned into OCR inputs (cropped text-line candidates with a detector,
+        grayscale crops of the opaque regions without one) and handed to the executor in windows that keep
+        every tesseract worker busy while bounding memory. Layer bitmaps come from renders
+        when given, so the export pass can reuse them. executor defaults to the processor's
+        own tesseract pool. Returns the number of removed layers.
+        """
+        candidates = self._ocr_candidates(psd)
+        executor = executor or self.ocr_executor
+
+        window = executor.workers * executor.batch_size
+        requests: List = []
+        owners: List[int] = []
+        hits: set = set()
+
+        def flush():
+            try:
+                texts = executor.map(requests)
+                hits.update(owners[k] for k, text in enumerate(texts) if len(text.strip()) > 0)
+            except Exception as e:
+                print(f"Error in text detection: {str(e)}")
+                if detector is not None:
+                    detector.stats["errors"] += 1
+            requests.clear()
+            owners.clear()
+
+        ocr_owners: set = set()
+        for i, layer in enumerate(candidates):
+            if progress:
+                progress(i / max(len(candidates), 1))
+            try:
+                img = renders.get(layer) if renders is not None else layer.topil()
+                if not img:
+                    continue
+                if detector is not None:
+                    crops = detector.propose(img, getattr(layer, 'name', '')) or []
+                else:
+                    # Same input detect_text_in_image gives tesseract
+                    crops = roi_crops(img, self.ocr_config)
+                requests.extend(crops)
+                owners.extend([i] * len(crops))
+                if crops:
+                    ocr_owners.add(i)
+            except Exception as e:
+                print(f"OCR check error: {e}")
+            if len(requests) >= window:
+                flush()
+        if requests:
+            flush()
+
+        if detector is not None:
+            for i in ocr_owners:
+                detector.record(i in hits)
+        removed = 0
+        for i in sorted(hits):
+            try:
+                if renders is not None:
+                    renders.discard(candidates[i])
+                if self._remove_from_parent(candidates[i]):
+                    removed += 1
+            except Exception as e:
+                print(f"remove layer failed: {e}")
+        return removed
+
+    def _render_layer(self, layer, psd):
+        """render_layer, then let go of the file pages a memory-mapped document decoded from."""
+        image = render_layer(layer)
+        release_pages(psd)
+        return image
+
+    def _compose_flattened(self, psd, renders: Optional[RenderCache] = None) -> Tuple[Image.Image, Dict[str, Any]]:
+        """
+        Flatten the remaining layers. When every visible layer is a plain normal-blend bitmap,
+        the image is blended from the layer bitmaps (shared with export through renders)
+        band by band, so besides the canvas only the bitmaps crossing the current band are
+        held; otherwise psd-tools composites the whole document.
+        """
+        start = time.perf_counter()
+        leaves, reason = compositable_leaves(psd)
+        if leaves is None:
+            image = psd.composite(force=True)
+            stats = {"method": "psd-tools", "reason": reason}
+        else:
+            width, height = psd.size
+            items = self._band_items(psd, leaves, renders)
+            out = np.zeros((height, width, 4), np.uint8)
+            for y0, band in composite_bands(psd.size, items, self.compose_band_rows):
+                out[y0:y0 + band.shape[0]] = band
+            image = Image.fromarray(out, 'RGBA')
+            stats = {"method": "layers", "layers": len(items)}
+        release_pages(psd)
+        stats["ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return image, stats
+
+    def _band_items(self, psd, leaves: List, renders: Optional[RenderCache] = None) -> List[BandItem]:
+        """
+        BandItems for the compositable leaves; bitmaps are fetched (through renders when
+        given) only when the sweep reaches them. Layers that would never be drawn give
+        their planned render use back right away.
+        """
+        width, height = psd.size
+        items: List[BandItem] = []
+        for layer in leaves:
+            cloud = self._layer_to_cloud(layer)
+            if (not cloud or layer.opacity <= 0 or cloud['left'] >= width or cloud['top'] >= height
+                    or cloud['left'] + cloud['width'] <= 0 or cloud['top'] + cloud['height'] <= 0):
+                if renders is not None:
+                    renders.release(layer)
+                continue
+            load = (lambda layer=layer: renders.get(layer)) if renders is not None else layer.topil
+            items.append(BandItem(cloud['left'], cloud['top'], cloud['width'], cloud['height'], layer.opacity / 255.0, load))
+        return items
+
+    def _use_tiled_compose(self, psd, output_path: str) -> bool:
+        if Path(output_path).suffix.lower() not in STREAM_SUFFIXES:
+            return False
+        return 0 <= self.tiled_compose_min_pixels <= psd.width * psd.height
+
+    def _compose_tiled(self, psd, output_path: str, options: Optional[AssetOptions] = None,
+                       renders: Optional[RenderCache] = None) -> Tuple[Dict[int, str], Dict[str, Any]]:
+        """
+        Flatten the remaining layers straight into a streaming PNG/TIFF writer, one band of
+        rows at a time, so memory follows the band size and the layers crossing the current
+        band instead of the canvas size. Documents that need psd-tools are composited per
+        band through its viewport. Previews are downscaled from a reduced copy assembled
+        band by band. Returns (preview size -> path, compose stats).
+        """
+        start = time.perf_counter()
+        width, height = psd.size
+        sizes = options.preview_sizes if options is not None else ()
+        # Integer reduction that keeps the reduced copy at least twice the largest preview
+        factor = max(1, max(width, height) // (2 * max(sizes))) if sizes else 0
+        rows = self.compose_band_rows
+        if factor:
+            rows = max(factor, rows // factor * factor)
+
+        leaves, reason = compositable_leaves(psd)
+        if leaves is None:
+            def psd_tools_bands():
+                for y0 in range(0, height, rows):
+                    band = psd.composite(viewport=(0, y0, width, min(y0 + rows, height)), force=True)
+                    release_pages(psd)
+                    yield y0, np.asarray(band.convert('RGBA'))
+            bands = psd_tools_bands()
+            stats: Dict[str, Any] = {"method": "psd-tools", "reason": reason}
+        else:
+            items = self._band_items(psd, leaves, renders)
+            bands = composite_bands(psd.size, items, rows)
+            stats = {"method": "layers", "layers": len(items)}
+
+        reduced = Image.new('RGBA', (-(-width // factor), -(-height // factor))) if factor else None
+        compress_level = (options or self.asset_options).png_compress_level
+        with open_stream_writer(output_path, width, height, compress_level) as writer:
+            for y0, band in bands:
+                writer.write(band)
+                if reduced is not None:
+                    reduced.paste(Image.fromarray(band, 'RGBA').reduce(factor), (0, y0 // factor))
+        release_pages(psd)
+        previews = write_previews(reduced, output_path, options, lambda img, path: img.save(path)) if reduced is not None else {}
+        stats.update(tiled=True, band_rows=rows, ms=round((time.perf_counter() - start) * 1000, 2))
+        return previews, stats
+
+    def _save_flattened(self, image: Image.Image, output_path: str, options: Optional[AssetOptions] = None) -> Dict[int, str]:
+        """Save the flattened image and its previews; returns preview size -> path."""
+        suffix = Path(output_path).suffix.lower()
+        if image.mode == 'RGBA' and suffix in ('.jpg', '.jpeg'):
+            # No alpha in JPEG: flatten onto white
+            flat = Image.new('RGB', image.size, (255, 255, 255))
+            flat.paste(image, mask=image.getchannel('A'))
+            image = flat
+
+        def save(img: Image.Image, path: str):
+            if suffix == '.webp' and options is not None and options.format == 'webp':
+                # Same lossless/lossy choice as the layer assets
+                encode_image(img, path, options)
+            else:
+                img.save(path)
+
+        save(image, output_path)
+        if options is None or not options.preview_sizes:
+            return {}
+        return write_previews(image, output_path, options, save)
+
+    @staticmethod
+    def _asset_urls(result: ExportResult, assets_root: str) -> Dict[str, Any]:
+        """
+        image_url plus, when previews were written, {"previews": {"128": url, ...}}. URLs are
+        relative to assets_root and point into the shared store for deduplicated images.
+        """
+        urls: Dict[str, Any] = {"image_url": os.path.relpath(result.dest_path, assets_root)}
+        if result.previews:
+            urls["previews"] = {str(size): os.path.relpath(path, assets_root)
+                                for size, path in sorted(result.previews.items())}
+        return urls
+
+    def _canvas_events(self, targets: List[tuple], background: Dict[str, Any], on_event: Optional[CanvasEventCallback],
+                       top_first: bool, assets_root: str) -> Optional[Callable[[ExportResult], None]]:
+        """
+        Export callback that turns each written image into a canvas event. `order` is the
+        cloud's final position in canvas['clouds'] if every export succeeds; clients sort
+        by it to place layers that arrive out of order.
+        """
+        if on_event is None:
+            return None
+        count = sum(1 for cloud, _ in targets if cloud is not None)
+        offset = len(targets) - count  # background job comes first when present
+
+        def emit(result: ExportResult):
+            if not result.ok:
                 return
-            if hasattr(layer, 'topil'):
-                try:
-                    img = layer.topil()
-                    if img and self.detect_text_in_image(img, getattr(layer, 'name', '')):
-                        # Remove itself from parent
-                        if hasattr(layer, 'parent') and layer.parent is not None:
-                            try:
-                                parent = layer.parent
-                                # parent._layers is used internally in psd-tools
-                                idx = None
-                                for j, l in enumerate(parent._layers):
-                                    if l is layer:
-                                        idx = j
-                                        break
-                                if idx is not None:
-                                    del parent._layers[idx]
-                            except Exception as e:
-                                print(f"remove layer failed: {e}")
-                except Exception as e:
-                    print(f"OCR check error: {e}")
-        except Exception as e:
-            print(f"_remove_text_images_recursive error: {e}")
+            cloud, _ = targets[result.index]
+            try:
+                urls = self._asset_urls(result, assets_root)
+                if cloud is None:
+                    on_event({"type": "background", "background": {**background, **urls}})
+                else:
+                    position = result.index - offset
+                    order = count - 1 - position if top_first else position
+                    on_event({"type": "cloud", "order": order, "cloud": {**place_cloud(cloud, result.crop), **urls}})
+            except Exception as e:
+                print(f"canvas event callback error: {e}")
+        return emit
 
-    def _build_canvas_data_grouped(self, psd, assets_root: str, group_dir: str) -> Dict[str, Any]:
+    def _build_canvas_data_grouped(self, psd, assets_root: str, group_dir: str, source: Optional[ExportSource] = None, timings: Optional[List] = None,
+                                   progress: Optional[Callable[[int, int], None]] = None, renders: Optional[RenderCache] = None,
+                                   on_event: Optional[CanvasEventCallback] = None, options: Optional[AssetOptions] = None) -> Dict[str, Any]:
         """
         Build canvas data where each TOP-LEVEL group is a basic element; non-group top-level layers are standalone elements.
-        Exports each element as a PNG under uploads/canvas/<group_dir> maintaining z-order.
+        Exports each element as a PNG (or WebP, see options) under uploads/canvas/<group_dir> maintaining z-order.
         """
+        options = options or self.asset_options
         width, height = psd.size
         background = {"color": "#ffffff00", "image_url": ""}
         clouds: List[Dict[str, Any]] = []
@@ -147,16 +435,20 @@ class PSDProcessor:
         assets_rel_dir = os.path.join('canvas', group_dir)
         os.makedirs(os.path.join(assets_root, assets_rel_dir), exist_ok=True)
 
+        # (layer, abs_path) to export, and for each job the cloud it belongs to (None = background)
+        jobs: List[tuple] = []
+        targets: List[tuple] = []
+
         layers = list(psd)
         # Background detection (bottom-most)
         try:
             if layers:
                 bottom = layers[-1]
                 if getattr(bottom, 'name', '').lower() in ['background', '背景'] and getattr(bottom, 'visible', True):
-                    bg_rel = os.path.join(assets_rel_dir, 'background.png')
-                    bg_abs = os.path.join(assets_root, bg_rel)
-                    if self._export_layer_image(bottom, bg_abs):
-                        background["image_url"] = bg_rel
+                    bg_rel = os.path.join(assets_rel_dir, f'background.{options.extension}')
+                    # Untrimmed: the background dict has no offset, clients draw it over the whole canvas
+                    jobs.append((bottom, os.path.join(assets_root, bg_rel), replace(options, trim=False)))
+                    targets.append((None, bg_rel))
         except Exception as e:
             print(f"background detection error: {e}")
 
@@ -172,11 +464,20 @@ class PSDProcessor:
             cloud = self._layer_to_cloud(layer)
             if not cloud:
                 continue
-            filename = f"elem_{idx}.png"
+            filename = f"elem_{idx}.{options.extension}"
             rel_path = os.path.join(assets_rel_dir, filename)
-            abs_path = os.path.join(assets_root, rel_path)
-            if self._export_layer_image(layer, abs_path):
-                cloud['image_url'] = rel_path
+            jobs.append((layer, os.path.join(assets_root, rel_path)))
+            targets.append((cloud, rel_path))
+
+        emit = self._canvas_events(targets, background, on_event, top_first=True, assets_root=assets_root)
+        results = self._export_batch(jobs, psd, source, timings, progress, renders, emit, options, owner=assets_rel_dir)
+        for result, (cloud, _) in zip(results, targets):
+            if not result.ok:
+                continue
+            if cloud is None:
+                background.update(self._asset_urls(result, assets_root))
+            else:
+                cloud.update(place_cloud(cloud, result.crop), **self._asset_urls(result, assets_root))
                 clouds.insert(0, cloud)
 
         return {
@@ -199,11 +500,14 @@ class PSDProcessor:
             pass
         return out
 
-    def _build_canvas_data_leaf(self, psd, assets_root: str, group_dir: str) -> Dict[str, Any]:
+    def _build_canvas_data_leaf(self, psd, assets_root: str, group_dir: str, source: Optional[ExportSource] = None, timings: Optional[List] = None,
+                                progress: Optional[Callable[[int, int], None]] = None, renders: Optional[RenderCache] = None,
+                                on_event: Optional[CanvasEventCallback] = None, options: Optional[AssetOptions] = None) -> Dict[str, Any]:
         """
         Emulate back_end/process_psd_layers.py step 3: export all remaining bottom (leaf) layers as individual images,
-        and return canvas data based on their bbox and order.
+        and return canvas data based on their (trimmed) bbox and order.
         """
+        options = options or self.asset_options
         width, height = psd.size
         background = {"color": "#ffffff00", "image_url": ""}
         clouds: List[Dict[str, Any]] = []
@@ -211,16 +515,20 @@ class PSDProcessor:
         assets_rel_dir = os.path.join('canvas', group_dir)
         os.makedirs(os.path.join(assets_root, assets_rel_dir), exist_ok=True)
 
+        # (layer, abs_path) to export, and for each job the cloud it belongs to (None = background)
+        jobs: List[tuple] = []
+        targets: List[tuple] = []
+
         # Background detection (bottom-most)
         try:
             layers = list(psd)
             if layers:
                 bottom = layers[-1]
                 if getattr(bottom, 'name', '').lower() in ['background', '背景'] and getattr(bottom, 'visible', True):
-                    bg_rel = os.path.join(assets_rel_dir, 'background.png')
-                    bg_abs = os.path.join(assets_root, bg_rel)
-                    if self._export_layer_image(bottom, bg_abs):
-                        background["image_url"] = bg_rel
+                    bg_rel = os.path.join(assets_rel_dir, f'background.{options.extension}')
+                    # Untrimmed: the background dict has no offset, clients draw it over the whole canvas
+                    jobs.append((bottom, os.path.join(assets_root, bg_rel), replace(options, trim=False)))
+                    targets.append((None, bg_rel))
         except Exception as e:
             print(f"background detection error: {e}")
 
@@ -229,7 +537,6 @@ class PSDProcessor:
         for top in psd:
             self._collect_bottom_layers(top, bottom_layers)
 
-        # Export and build clouds
         for idx, layer in enumerate(bottom_layers, start=1):
             if hasattr(layer, 'visible') and not layer.visible:
                 continue
@@ -237,12 +544,21 @@ class PSDProcessor:
             if not cloud:
                 continue
             safe_name = ''.join(c for c in str(getattr(layer, 'name', 'layer')).strip() if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            filename = f"leaf_{idx}_{safe_name}.png"
+            filename = f"leaf_{idx}_{safe_name}.{options.extension}"
             rel_path = os.path.join(assets_rel_dir, filename)
-            abs_path = os.path.join(assets_root, rel_path)
-            if self._export_layer_image(layer, abs_path):
-                cloud['image_url'] = rel_path
-                # Insert in order; leaf order follows traversal order similar to script
+            jobs.append((layer, os.path.join(assets_root, rel_path)))
+            targets.append((cloud, rel_path))
+
+        # Export and build clouds; leaf order follows traversal order similar to script
+        emit = self._canvas_events(targets, background, on_event, top_first=False, assets_root=assets_root)
+        results = self._export_batch(jobs, psd, source, timings, progress, renders, emit, options, owner=assets_rel_dir)
+        for result, (cloud, _) in zip(results, targets):
+            if not result.ok:
+                continue
+            if cloud is None:
+                background.update(self._asset_urls(result, assets_root))
+            else:
+                cloud.update(place_cloud(cloud, result.crop), **self._asset_urls(result, assets_root))
                 clouds.append(cloud)
 
         return {
@@ -252,45 +568,125 @@ class PSDProcessor:
             'clouds': clouds,
         }
 
-    def process_psd(self, *, input_path: str, output_path: str, skip_ocr: bool = False, return_canvas: bool = False, assets_root: Optional[str] = None, canvas_mode: str = 'leaf') -> Dict[str, Any]:
-        """Process PSD file - remove text layers, optional OCR removal, export flattened image and optionally return canvas data with per-layer images."""
+    def process_psd(self, *, input_path: str, output_path: str, skip_ocr: bool = False, return_canvas: bool = False, assets_root: Optional[str] = None, canvas_mode: str = 'leaf',
+                    progress: Optional[Callable[[str, float], None]] = None, on_event: Optional[CanvasEventCallback] = None,
+                    output_format: Optional[str] = None, ocr_executor: Optional[OCRExecutor] = None) -> Dict[str, Any]:
+        """
+        Process PSD file - remove text layers, optional OCR removal, export flattened image and optionally return canvas data with per-layer images.
+        progress(stage, fraction) is called as the work advances; fraction runs from 0 to 1 over the whole request.
+        on_event(event) receives each background/cloud item as soon as its image is written (return_canvas only).
+        output_format 'webp' / 'webp_lossy' writes layer assets (and a .webp output) as lossless / lossy WebP.
+        ocr_executor replaces the processor's tesseract pool for this call (batch workers each bring their own).
+        result["stage_metrics"] has wall/CPU time, peak memory, layers and bytes per stage; the same
+        records are logged and exported on /metrics.
+        """
+        options = asset_options_for(output_format or Path(output_path).suffix.lstrip('.'), self.asset_options)
+        def report(stage: str, fraction: float):
+            if progress:
+                try:
+                    progress(stage, min(max(fraction, 0.0), 1.0))
+                except Exception as e:
+                    print(f"progress callback error: {e}")
+
+        file_size = os.path.getsize(input_path) if os.path.exists(input_path) else 0
+        lazy = 0 <= self.lazy_load_min_bytes <= file_size
+        stages = StageRecorder(request=Path(output_path).stem)
+        with PeakRSSMonitor() as memory:
+            result = self._process_psd(input_path, output_path, skip_ocr, return_canvas, assets_root, canvas_mode, lazy, report, on_event, options,
+                                       stages, ocr_executor)
+        if result.get("status") == "success":
+            result["memory_stats"] = {"lazy": lazy, **memory.report(file_size)}
+        result["stage_metrics"] = stages.finish(result.get("status", "error"))
+        return result
+
+    def _process_psd(self, input_path: str, output_path: str, skip_ocr: bool, return_canvas: bool, assets_root: Optional[str],
+                     canvas_mode: str, lazy: bool, report: Callable[[str, float], None],
+                     on_event: Optional[CanvasEventCallback] = None, options: Optional[AssetOptions] = None,
+                     stages: Optional[StageRecorder] = None, ocr_executor: Optional[OCRExecutor] = None) -> Dict[str, Any]:
+        options = options or self.asset_options
+        stages = stages or StageRecorder()
         try:
             # Load PSD file
-            psd = PSDImage.open(input_path)
+            report('parse', 0.0)
+            with stages.stage('parse') as stage:
+                psd = open_psd(input_path, lazy)
+                # Layer positions in the untouched document, so export workers can find them after removals
+                source = ExportSource(path=input_path, ordinals=layer_ordinals(psd), lazy=lazy)
+                stage.layers = len(source.ordinals)
 
             # Process layers: remove all text-type layers recursively
-            for layer in reversed(psd):
-                self.remove_text_layers_recursive(layer)
+            report('remove_text', 0.05)
+            with stages.stage('remove_text') as stage:
+                for layer in reversed(psd):
+                    self.remove_text_layers_recursive(layer)
+                stage.layers = len(source.ordinals) - sum(1 for _ in iter_layers(psd))
+
+            # Each layer bitmap is rendered once and shared by the OCR and export passes
+            renders = RenderCache(self.render_cache_bytes, render=lambda layer: self._render_layer(layer, psd))
+            ocr_candidates = self._ocr_candidates(psd) if not skip_ocr else []
+            for layer in ocr_candidates:
+                renders.plan(layer)
+            if return_canvas and assets_root:
+                for layer in self._planned_exports(psd, canvas_mode):
+                    renders.plan(layer)
+            for layer in compositable_leaves(psd)[0] or []:
+                renders.plan(layer)
 
             # OCR pass for all image layers recursively (if not skipped)
+            detector = StagedTextDetector(self.ocr_config, dpi=document_dpi(psd)) if self.ocr_staged else None
             if not skip_ocr:
-                for layer in list(psd):
-                    self._remove_text_images_recursive(layer, skip_ocr=False)
+                report('ocr', 0.1)
+                with stages.stage('ocr') as stage:
+                    self._remove_text_images(psd, detector, progress=lambda f: report('ocr', 0.1 + 0.3 * f), renders=renders,
+                                             executor=ocr_executor)
+                    stage.layers = len(ocr_candidates)
 
-            # Save the flattened result
             output_dir = os.path.dirname(output_path)
             os.makedirs(output_dir, exist_ok=True)
 
-            if hasattr(psd, 'compose'):
-                psd.compose().save(output_path)
-            else:
-                psd.save(output_path)
-
             result: Dict[str, Any] = {
                 "status": "success",
                 "output_path": output_path,
                 "message": "PSD processed successfully",
             }
 
+            if detector is not None and not skip_ocr:
+                result["ocr_stats"] = detector.stats
+
             if return_canvas and assets_root:
                 # Group dir based on output filename stem
                 group_dir = Path(output_path).stem + "_layers"
-                if canvas_mode == 'group':
-                    canvas = self._build_canvas_data_grouped(psd, assets_root=assets_root, group_dir=group_dir)
-                else:
-                    canvas = self._build_canvas_data_leaf(psd, assets_root=assets_root, group_dir=group_dir)
+                timings: List[Dict[str, Any]] = []
+                report('export', 0.4)
+                on_layer = lambda done, total: report('export', 0.4 + 0.5 * done / total)
+                with stages.stage('export') as stage:
+                    if canvas_mode == 'group':
+                        canvas = self._build_canvas_data_grouped(psd, assets_root=assets_root, group_dir=group_dir, source=source, timings=timings, progress=on_layer, renders=renders, on_event=on_event, options=options)
+                    else:
+                        canvas = self._build_canvas_data_leaf(psd, assets_root=assets_root, group_dir=group_dir, source=source, timings=timings, progress=on_layer, renders=renders, on_event=on_event, options=options)
+                    if timings:
+                        result["export_stats"] = timings[0]
+                        result["asset_stats"] = timings[0].pop("assets")
+                        stage.layers = result["asset_stats"]["layers"]
+                        stage.bytes_written = result["asset_stats"]["bytes_written"] + result["asset_stats"].get("preview_bytes", 0)
                 result["canvas"] = canvas
+                result["assets_dir"] = os.path.join('canvas', group_dir)
+
+            # Save the flattened result, reusing the bitmaps the export pass rendered
+            report('compose', 0.9)
+            with stages.stage('compose') as stage:
+                if self._use_tiled_compose(psd, output_path):
+                    result["output_previews"], result["compose_stats"] = self._compose_tiled(psd, output_path, options, renders)
+                else:
+                    flattened, result["compose_stats"] = self._compose_flattened(psd, renders)
+                    result["output_previews"] = self._save_flattened(flattened, output_path, options)
+                    del flattened
+                stage.layers = result["compose_stats"].get("layers") or sum(1 for _ in iter_layers(psd))
+                stage.bytes_written = sum(os.path.getsize(p) for p in {output_path, *result["output_previews"].values()})
+            result["render_stats"] = renders.stats()
+            renders.clear()
 
+            report('done', 1.0)
             return result
 
         except Exception as e:
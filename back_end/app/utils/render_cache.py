@@ -0,0 +1,126 @@
+"""
+Per-request cache of rendered layer bitmaps
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Callable
+
+from .layer_export import render_layer
+
+
+def image_nbytes(image) -> int:
+    """Approximate decoded size of a PIL image."""
+    return image.width * image.height * len(image.getbands())
+
+
+class RenderCache:
+    """
+    Renders each layer at most once per request and hands the bitmap to every stage that asks.
+
+    Callers declare up front how many times a layer will be requested (plan). Each get()
+    consumes one use; once a layer has no uses left its bitmap is dropped. Bitmaps waiting
+    for a later stage are kept least-recently-used within max_bytes; an evicted layer is
+    simply rendered again when it is next needed. Layers are keyed by id() and the cache
+    holds a reference to each planned layer so ids cannot be reused while it is alive.
+    """
+
+    def __init__(self, max_bytes: int, render: Callable[[Any], Any] = render_layer):
+        self.max_bytes = max_bytes
+        self.render = render
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self.peak_bytes = 0
+        self._lock = threading.Lock()
+        self._uses: Dict[int, int] = {}
+        self._layers: Dict[int, Any] = {}
+        self._images: "OrderedDict[int, Any]" = OrderedDict()
+
+    def plan(self, layer, uses: int = 1) -> None:
+        """Expect `uses` more get() calls for layer."""
+        with self._lock:
+            key = id(layer)
+            self._layers[key] = layer
+            self._uses[key] = self._uses.get(key, 0) + uses
+
+    def get(self, layer):
+        """Return the layer's bitmap, rendering it on a miss. Consumes one planned use."""
+        key = id(layer)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self.hits += 1
+                self._images.move_to_end(key)
+            else:
+                self.misses += 1
+        if image is None:
+            # Render outside the lock so export threads can decode concurrently
+            image = self.render(layer)
+        with self._lock:
+            remaining = self._uses.get(key, 0) - 1
+            if remaining > 0:
+                self._uses[key] = remaining
+                if image is not None and key not in self._images:
+                    self._store(key, image)
+            else:
+                self._forget(key)
+        return image
+
+    def peek(self, layer):
+        """Cached bitmap or None; does not render and does not consume a use."""
+        with self._lock:
+            return self._images.get(id(layer))
+
+    def release(self, layer) -> None:
+        """A planned use will not go through get() (e.g. rendered elsewhere)."""
+        key = id(layer)
+        with self._lock:
+            remaining = self._uses.get(key, 0) - 1
+            if remaining > 0:
+                self._uses[key] = remaining
+            else:
+                self._forget(key)
+
+    def discard(self, layer) -> None:
+        """Drop a layer and all its remaining uses (e.g. it was removed from the document)."""
+        with self._lock:
+            self._forget(id(layer))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._uses.clear()
+            self._layers.clear()
+            self._images.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "cached": len(self._images),
+                "bytes": self.bytes,
+                "peak_bytes": self.peak_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _store(self, key: int, image) -> None:
+        size = image_nbytes(image)
+        if size > self.max_bytes:
+            return
+        while self._images and self.bytes + size > self.max_bytes:
+            _, old = self._images.popitem(last=False)
+            self.bytes -= image_nbytes(old)
+            self.evictions += 1
+        self._images[key] = image
+        self.bytes += size
+        self.peak_bytes = max(self.peak_bytes, self.bytes)
+
+    def _forget(self, key: int) -> None:
+        self._uses.pop(key, None)
+        self._layers.pop(key, None)
+        image = self._images.pop(key, None)
+        if image is not None:
+            self.bytes -= image_nbytes(image)
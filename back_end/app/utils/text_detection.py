@@ -0,0 +1,350 @@
+"""
+Staged text detection for PSD pixel layers
+
+Cheap vectorized checks reject layers that cannot contain readable text before
+any tesseract call; only cropped candidate regions are OCR'd. Transparent areas
+are never analysed: layers are first reduced to their connected opaque regions.
+"""
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Tuple, Callable
+
+import cv2
+import numpy as np
+import pytesseract
+from psd_tools.constants import Resource
+
+Box = Tuple[int, int, int, int]  # x, y, w, h
+
+# Counter names, in pipeline order
+STAGE_COUNTERS = (
+    "layers",            # layers handed to the detector
+    "rejected_size",     # smaller than min_side
+    "rejected_alpha",    # almost fully transparent, or no opaque region large enough
+    "rejected_edges",    # flat colour / smooth gradient
+    "rejected_regions",  # no text-like MSER regions
+    "ocr_layers",        # layers that reached tesseract
+    "ocr_regions",       # cropped regions sent to tesseract
+    "text_layers",       # layers where tesseract found text
+    "errors",
+    "layer_pixels",      # pixels of the layers handed to the detector
+    "analysed_pixels",   # pixels left after cropping to the opaque regions
+)
+
+
+@dataclass
+class TextDetectorConfig:
+    min_side: int = 10
+    # fraction of pixels with alpha > 0
+    min_alpha_coverage: float = 0.002
+    # Canny edge pixels per pixel in the densest edge_tile x edge_tile tile;
+    # shape outlines stay around 0.03-0.05, glyph clusters are well above
+    min_edge_density: float = 0.08
+    edge_tile: int = 32
+    # proposals are computed on a copy no larger than this
+    analysis_max_side: int = 1024
+    # MSER regions that look like glyphs, per candidate text line
+    min_glyphs: int = 2
+    max_regions: int = 8
+    region_padding: int = 6
+    # crops are downscaled to this resolution before OCR (never upscaled)
+    target_dpi: int = 150
+    max_ocr_side: int = 2000
+    # Opaque regions (alpha > roi_alpha_threshold) closer than roi_merge_distance px are
+    # joined; regions with a side below roi_min_side or an area below roi_min_area are
+    # not OCR'd. Above roi_max_regions the union of the regions is used instead.
+    roi_alpha_threshold: int = 0
+    roi_merge_distance: int = 16
+    roi_min_side: int = 8
+    roi_min_area: int = 256
+    roi_max_regions: int = 16
+
+
+def document_dpi(psd, default: float = 72.0) -> float:
+    """Horizontal resolution of a PSD in pixels per inch."""
+    try:
+        info = psd.image_resources.get_data(Resource.RESOLUTION_INFO)
+        if info and info.horizontal:
+            dpi = info.horizontal / 65536.0  # 16.16 fixed point
+            # unit 2 = pixels per centimetre
+            return dpi * 2.54 if info.horizontal_unit == 2 else dpi
+    except Exception as e:
+        print(f"resolution info error: {e}")
+    return default
+
+
+def to_gray_and_alpha(image) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    PIL image -> (uint8 grayscale, alpha or None).
+    Transparent pixels are flattened onto a backdrop that contrasts with the opaque ones,
+    so dark text on a transparent layer does not vanish into black.
+    """
+    arr = np.asarray(image)
+    if arr.ndim == 2:
+        return arr.astype(np.uint8, copy=False), None
+    if arr.shape[2] != 4:
+        return cv2.cvtColor(arr[:, :, :3], cv2.COLOR_RGB2GRAY), None
+    gray = cv2.cvtColor(arr, cv2.COLOR_RGBA2GRAY)
+    alpha = arr[:, :, 3]
+    opaque = alpha > 0
+    if opaque.any() and not opaque.all():
+        backdrop = 255.0 if gray[opaque].mean() < 128 else 0.0
+        a = alpha.astype(np.float32) / 255.0
+        gray = (gray * a + backdrop * (1.0 - a)).astype(np.uint8)
+    return gray, alpha
+
+
+def opaque_regions(alpha: np.ndarray, config: TextDetectorConfig) -> List[Box]:
+    """
+    Full-resolution boxes of the connected opaque areas of an alpha channel, largest first,
+    without the ones below the size threshold. The mask is max-pooled to at most
+    analysis_max_side, so the labelling cost does not grow with the layer size; boxes are
+    measured on the undilated mask, so merging nearby areas does not inflate them.
+    """
+    cfg = config
+    mask = alpha > cfg.roi_alpha_threshold
+    h, w = mask.shape
+    step = max(1, -(-max(h, w) // cfg.analysis_max_side))
+    if step > 1:
+        th, tw = -(-h // step), -(-w // step)
+        padded = np.zeros((th * step, tw * step), bool)
+        padded[:h, :w] = mask
+        mask = padded.reshape(th, step, tw, step).any(axis=(1, 3))
+    small = mask.astype(np.uint8)
+    gap = cfg.roi_merge_distance // step
+    joined = cv2.dilate(small, np.ones((gap + 1, gap + 1), np.uint8)) if gap > 0 else small
+    n, labels = cv2.connectedComponents(joined, connectivity=8)
+    if n <= 1:
+        return []
+
+    ys, xs = np.nonzero(small)
+    owner = labels[ys, xs]
+    x0 = np.full(n, w, np.int64)
+    y0 = np.full(n, h, np.int64)
+    x1 = np.zeros(n, np.int64)
+    y1 = np.zeros(n, np.int64)
+    np.minimum.at(x0, owner, xs)
+    np.minimum.at(y0, owner, ys)
+    np.maximum.at(x1, owner, xs + 1)
+    np.maximum.at(y1, owner, ys + 1)
+    x0, y0 = x0[1:] * step, y0[1:] * step
+    x1, y1 = np.minimum(x1[1:] * step, w), np.minimum(y1[1:] * step, h)
+    bw, bh = x1 - x0, y1 - y0
+    keep = (bw > 0) & (np.minimum(bw, bh) >= cfg.roi_min_side) & (bw * bh >= cfg.roi_min_area)
+    boxes = sorted(((int(x), int(y), int(bw_), int(bh_)) for x, y, bw_, bh_ in
+                    zip(x0[keep], y0[keep], bw[keep], bh[keep])), key=lambda b: b[2] * b[3], reverse=True)
+    if len(boxes) > cfg.roi_max_regions:
+        return [union_box(boxes)]
+    return boxes
+
+
+def union_box(boxes: List[Box]) -> Box:
+    x0, y0 = min(b[0] for b in boxes), min(b[1] for b in boxes)
+    x1, y1 = max(b[0] + b[2] for b in boxes), max(b[1] + b[3] for b in boxes)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def pad_box(box: Box, padding: int, width: int, height: int) -> Tuple[int, int, int, int]:
+    """(left, top, right, bottom) of box grown by padding and clipped to the image."""
+    x, y, w, h = box
+    return max(0, x - padding), max(0, y - padding), min(width, x + w + padding), min(height, y + h + padding)
+
+
+def roi_boxes(image, config: TextDetectorConfig) -> List[Tuple[int, int, int, int]]:
+    """
+    Padded (left, top, right, bottom) crop boxes of the opaque regions of a PIL image worth
+    OCR'ing; the whole image if it has no alpha channel, [] if nothing passes the threshold.
+    """
+    if 'A' not in image.getbands():
+        return [(0, 0, image.width, image.height)]
+    regions = opaque_regions(np.asarray(image.getchannel('A')), config)
+    return [pad_box(r, config.region_padding, image.width, image.height) for r in regions]
+
+
+def roi_crops(image, config: TextDetectorConfig) -> List[np.ndarray]:
+    """Grayscale crops of the opaque regions of a layer image, for OCR without the staged pre-filters."""
+    return [to_gray_and_alpha(image.crop(box))[0] for box in roi_boxes(image, config)]
+
+
+def max_tile_density(mask: np.ndarray, tile: int) -> float:
+    """Highest fraction of non-zero pixels in any tile x tile block of mask."""
+    h, w = mask.shape
+    th, tw = -(-h // tile), -(-w // tile)
+    padded = np.zeros((th * tile, tw * tile), np.float32)
+    padded[:h, :w] = mask > 0
+    sums = padded.reshape(th, tile, tw, tile).sum(axis=(1, 3))
+    # Edge tiles are only partly covered by the image
+    areas = np.full((th, tw), float(tile * tile), np.float32)
+    areas[-1, :] = (h - (th - 1) * tile) * tile
+    areas[:, -1] = areas[:, -1] / tile * (w - (tw - 1) * tile)
+    return float((sums / areas).max())
+
+
+class StagedTextDetector:
+    """
+    detect() runs: size -> alpha coverage -> edge density -> MSER text-line proposals -> OCR
+    on the cropped proposals. Each rejection is counted in stats.
+
+    One instance per request; stats are not thread-safe.
+    """
+
+    def __init__(self, config: Optional[TextDetectorConfig] = None, dpi: float = 72.0,
+                 ocr: Optional[Callable[[np.ndarray], str]] = None):
+        self.config = config or TextDetectorConfig()
+        self.dpi = dpi
+        self.ocr = ocr or pytesseract.image_to_string
+        self.stats: Dict[str, int] = {name: 0 for name in STAGE_COUNTERS}
+
+    def propose(self, image, layer_name: str = '') -> Optional[List[np.ndarray]]:
+        """
+        Run the cheap stages on one layer image. Returns the crops to OCR, or None if the
+        layer was rejected. Callers OCR the crops (possibly batched) and report via record().
+        """
+        self.stats["layers"] += 1
+        try:
+            if image.width < self.config.min_side or image.height < self.config.min_side:
+                self.stats["rejected_size"] += 1
+                return None
+            self.stats["layer_pixels"] += image.width * image.height
+            # Each opaque region is analysed on its own; transparent areas are skipped
+            boxes = roi_boxes(image, self.config)
+            if not boxes:
+                self.stats["rejected_alpha"] += 1
+                return None
+            crops: List[np.ndarray] = []
+            rejections: List[str] = []
+            tile = self.config.edge_tile
+            for left, top, right, bottom in boxes:
+                # Snap to the layer's edge_tile grid so partial tiles at the crop border do not
+                # inflate the edge density
+                box = (left - left % tile, top - top % tile,
+                       min(image.width, -(-right // tile) * tile), min(image.height, -(-bottom // tile) * tile))
+                region = image if box == (0, 0, image.width, image.height) else image.crop(box)
+                self.stats["analysed_pixels"] += region.width * region.height
+                gray, alpha = to_gray_and_alpha(region)
+                rejected, lines = self._regions(gray, alpha, (image.height, image.width))
+                if rejected:
+                    rejections.append(rejected)
+                else:
+                    crops.extend(self.crops(gray, lines))
+            if not crops:
+                # Counted once per layer, under the stage that rejected its largest region
+                self.stats[rejections[0]] += 1
+                return None
+            crops = crops[:self.config.max_regions]
+            self.stats["ocr_layers"] += 1
+            self.stats["ocr_regions"] += len(crops)
+            return crops
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Error in text detection for layer {layer_name}: {str(e)}")
+            return None
+
+    def record(self, found_text: bool):
+        if found_text:
+            self.stats["text_layers"] += 1
+
+    def detect(self, image, layer_name: str = '') -> bool:
+        """propose() + OCR of the crops one by one, stopping at the first hit."""
+        crops = self.propose(image, layer_name)
+        if not crops:
+            return False
+        try:
+            found = any(len(self.ocr(crop).strip()) > 0 for crop in crops)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Error in text detection for layer {layer_name}: {str(e)}")
+            return False
+        self.record(found)
+        return found
+
+    def candidate_regions(self, gray: np.ndarray, alpha: Optional[np.ndarray]) -> Optional[List[Box]]:
+        """Run the cheap stages; returns None if the layer was rejected, else full-resolution boxes."""
+        rejected, boxes = self._regions(gray, alpha)
+        if rejected:
+            self.stats[rejected] += 1
+            return None
+        return boxes
+
+    def _regions(self, gray: np.ndarray, alpha: Optional[np.ndarray],
+                 frame: Optional[Tuple[int, int]] = None) -> Tuple[Optional[str], List[Box]]:
+        """
+        (rejecting stage counter or None, full-resolution text-line boxes). frame is the
+        (height, width) of the whole layer when gray is a crop of it; glyph size limits stay
+        relative to the layer, so cropping does not change which shapes count as glyphs.
+        """
+        cfg = self.config
+        opaque = int(np.count_nonzero(alpha)) if alpha is not None else gray.size
+        if opaque < cfg.min_alpha_coverage * gray.size:
+            return "rejected_alpha", []
+
+        # Work on a reduced copy for the remaining pre-checks
+        scale = min(1.0, cfg.analysis_max_side / max(gray.shape))
+        small = gray if scale >= 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        edges = cv2.Canny(small, 50, 150)
+        if max_tile_density(edges, cfg.edge_tile) < cfg.min_edge_density:
+            return "rejected_edges", []
+
+        frame = frame or gray.shape
+        boxes = self._text_line_boxes(small, edges, (frame[0] * scale, frame[1] * scale))
+        if not boxes:
+            return "rejected_regions", []
+        return None, [(int(x / scale), int(y / scale), int(np.ceil(w / scale)), int(np.ceil(h / scale))) for x, y, w, h in boxes]
+
+    def _text_line_boxes(self, gray: np.ndarray, edges: np.ndarray, frame: Tuple[float, float]) -> List[Box]:
+        """
+        Group glyph-like regions into text lines; keep lines with enough glyphs.
+        Glyph candidates are MSER regions plus connected components of the edge map;
+        MSER alone misses crisp, near-binary rendered text.
+        """
+        cfg = self.config
+        h, w = gray.shape
+        fh, fw = frame
+        mser = cv2.MSER_create(5, 20, max(60, int(fh * fw * 0.05)))
+        _, bboxes = mser.detectRegions(gray)
+        _, _, edge_stats, _ = cv2.connectedComponentsWithStats(edges, connectivity=8)
+        candidates = [edge_stats[1:, :4]]
+        if bboxes is not None and len(bboxes):
+            candidates.append(np.asarray(bboxes).reshape(-1, 4))
+        b = np.concatenate(candidates).astype(np.int64)
+        if len(b) == 0:
+            return []
+        bw, bh = b[:, 2], b[:, 3]
+        aspect = bw / np.maximum(bh, 1)
+        glyphs = b[(bh >= 6) & (bh <= 0.8 * fh) & (aspect > 0.1) & (aspect < 10)]
+        if len(glyphs) < cfg.min_glyphs:
+            return []
+
+        # Paint glyph boxes and smear them horizontally so neighbouring glyphs merge into lines
+        mask = np.zeros((h, w), np.uint8)
+        for x, y, gw, gh in glyphs:
+            mask[y:y + gh, x:x + gw] = 255
+        kx = max(3, int(np.median(glyphs[:, 3])))
+        mask = cv2.dilate(mask, np.ones((3, kx), np.uint8))
+        n, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        if n <= 1:
+            return []
+
+        # Count glyph centres per component
+        cx = np.clip(glyphs[:, 0] + glyphs[:, 2] // 2, 0, w - 1)
+        cy = np.clip(glyphs[:, 1] + glyphs[:, 3] // 2, 0, h - 1)
+        counts = np.bincount(labels[cy, cx], minlength=n)
+        keep = [i for i in range(1, n) if counts[i] >= cfg.min_glyphs]
+        keep.sort(key=lambda i: stats[i, cv2.CC_STAT_AREA], reverse=True)
+        return [tuple(int(v) for v in stats[i, :4]) for i in keep[:cfg.max_regions]]
+
+    def crops(self, gray: np.ndarray, regions: List[Box]) -> List[np.ndarray]:
+        """Padded crops of the candidate regions, downscaled to target_dpi."""
+        cfg = self.config
+        h, w = gray.shape
+        factor = min(1.0, cfg.target_dpi / self.dpi) if self.dpi else 1.0
+        out = []
+        for x, y, bw, bh in regions:
+            x0, y0 = max(0, x - cfg.region_padding), max(0, y - cfg.region_padding)
+            x1, y1 = min(w, x + bw + cfg.region_padding), min(h, y + bh + cfg.region_padding)
+            crop = gray[y0:y1, x0:x1]
+            f = min(factor, cfg.max_ocr_side / max(crop.shape))
+            if f < 1.0:
+                crop = cv2.resize(crop, None, fx=f, fy=f, interpolation=cv2.INTER_AREA)
+            out.append(crop)
+        return out
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Background removal on large images: full-resolution path vs reduced path
+
+The full path is rembg.remove on the original upload, which resizes the whole image to
+the model's 320x320 input and the 320x320 mask back up with Lanczos. The reduced path
+(app/services/cutout_mask.remove_reduced) decodes a --side copy in JPEG draft mode,
+segments that, and upsamples the mask with the guided filter (refined) or bilinearly
+(bilinear) before applying it to the original pixels once.
+
+Quality is reported as agreement with the full path's alpha, since that is the output
+users get today: mean and max absolute difference, IoU of the alpha > 127 region, and
+the mean difference on the edge band (pixels within a few pixels of the full path's
+mask boundary), which is where the variants actually differ. With --truth (a reference
+matte per --image, alpha or grayscale) every path, including the full one, is also
+scored against it.
+
+    python benchmarks/bench_cutout_reduced.py --model u2net --size 6000x4000
+    python benchmarks/bench_cutout_reduced.py --model u2net --image a.jpg --image b.jpg --side 1024
+    python benchmarks/bench_cutout_reduced.py --model u2net --image a.jpg --truth a_matte.png
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.cutout_mask import remove_reduced  # noqa: E402
+from app.services.rembg_pool import RembgSessionPool  # noqa: E402
+from bench_rembg import make_image  # noqa: E402
+
+
+def alpha_of(png):
+    with Image.open(io.BytesIO(png)) as img:
+        return np.asarray(img.getchannel('A'))
+
+
+def load_truth(path):
+    with Image.open(path) as img:
+        return np.asarray(img.getchannel('A') if 'A' in img.getbands() else img.convert('L'))
+
+
+def compare(reference, alpha, edge_width):
+    diff = np.abs(reference.astype(np.int16) - alpha.astype(np.int16))
+    ref_fg, fg = reference > 127, alpha > 127
+    union = np.count_nonzero(ref_fg | fg)
+    kernel = np.ones((2 * edge_width + 1, 2 * edge_width + 1), np.uint8)
+    ref_u8 = ref_fg.astype(np.uint8)
+    edge = (cv2.dilate(ref_u8, kernel) != cv2.erode(ref_u8, kernel)) | ((reference > 0) & (reference < 255))
+    return {
+        "alpha_mae": round(float(diff.mean()), 3),
+        "alpha_max_diff": int(diff.max()),
+        "iou": round(np.count_nonzero(ref_fg & fg) / union, 5) if union else 1.0,
+        "edge_mae": round(float(diff[edge].mean()), 3) if edge.any() else 0.0,
+        "edge_pixels": int(np.count_nonzero(edge)),
+    }
+
+
+def timed(fn, repeat):
+    samples, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, round(statistics.median(samples), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='大图抠图: 原图推理与缩小推理+掩码上采样的质量/耗时对比')
+    parser.add_argument('--model', default='u2net', help='rembg模型名称')
+    parser.add_argument('--model-path', help='*_custom 模型的ONNX文件')
+    parser.add_argument('--image', action='append', help='测试图片, 可多次指定(默认: 生成的商品图)')
+    parser.add_argument('--size', default='6000x4000', help='生成测试图片的尺寸')
+    parser.add_argument('--truth', action='append', help='参考蒙版(与 --image 一一对应), 用于评估各方式的绝对质量')
+    parser.add_argument('--side', type=int, default=1024, help='缩小推理的长边像素数')
+    parser.add_argument('--repeat', type=int, default=3, help='每种方式运行次数(取中位数)')
+    parser.add_argument('--edge-width', type=int, default=4, help='边缘带宽度(像素)')
+    parser.add_argument('--output', default='bench_cutout_reduced.json', help='结果JSON文件')
+    args = parser.parse_args()
+
+    truths = args.truth or []
+    if truths and len(truths) != len(args.image or []):
+        parser.error('--truth 必须与 --image 数量一致')
+    if args.image:
+        inputs = []
+        for path in args.image:
+            with open(path, 'rb') as f:
+                inputs.append((os.path.basename(path), f.read()))
+    else:
+        width, height = (int(v) for v in args.size.lower().split('x'))
+        inputs = [(f"generated_{args.size}.jpg", make_image(width, height))]
+
+    pool = RembgSessionPool(args.model, 1, model_path=args.model_path)
+    pool.warmup()
+    results = []
+    for index, (name, data) in enumerate(inputs):
+        with Image.open(io.BytesIO(data)) as img:
+            size = img.size
+        truth = load_truth(truths[index]) if truths else None
+        full, full_ms = timed(lambda: pool.remove(data), args.repeat)
+        reference = alpha_of(full)
+        entry = {"image": name, "size": list(size), "bytes": len(data), "full": {"ms": full_ms}}
+        if truth is not None:
+            entry["full"]["vs_truth"] = compare(truth, reference, args.edge_width)
+        for variant, refine in (("refined", True), ("bilinear", False)):
+            png, ms = timed(lambda: remove_reduced(data, pool, args.side, refine), args.repeat)
+            if png is None:
+                entry[variant] = {"skipped": f"long side <= {args.side}"}
+                continue
+            alpha = alpha_of(png)
+            entry[variant] = {"ms": ms, "speedup": round(full_ms / max(ms, 1e-6), 2),
+                              **compare(reference, alpha, args.edge_width)}
+            if truth is not None:
+                entry[variant]["vs_truth"] = compare(truth, alpha, args.edge_width)
+        results.append(entry)
+        del full, reference
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {k: v for k, v in vars(args).items() if k != 'output'},
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    def truth_columns(r):
+        t = r.get("vs_truth")
+        return f"{t['alpha_mae']:>10.2f}{t['edge_mae']:>10.2f}{t['iou']:>9.4f}" if t else ''
+
+    print(f"{'image':<28}{'variant':<10}{'ms':>9}{'speedup':>9}{'MAE':>8}{'edge MAE':>10}{'IoU':>9}"
+          + (f"{'truth MAE':>10}{'edge MAE':>10}{'IoU':>9}" if truths else ''))
+    for entry in results:
+        print(f"{entry['image'][:27]:<28}{'full':<10}{entry['full']['ms']:>9.1f}{'':>9}{'':>8}{'':>10}{'':>9}"
+              + truth_columns(entry['full']))
+        for variant in ("refined", "bilinear"):
+            r = entry[variant]
+            if "skipped" in r:
+                print(f"{'':<28}{variant:<10}  {r['skipped']}")
+                continue
+            print(f"{'':<28}{variant:<10}{r['ms']:>9.1f}{r['speedup']:>9.2f}{r['alpha_mae']:>8.2f}"
+                  f"{r['edge_mae']:>10.2f}{r['iou']:>9.4f}" + truth_columns(r))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Layer removal scaling benchmark
+
+Builds synthetic layer trees in memory and compares the per-layer tree scan that
+process_psd_layers used before with the single-pass parent index (remove_layers).
+
+    python benchmarks/bench_layer_removal.py --sizes 250 1000 4000 --shape wide deep
+"""
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+from PIL import Image
+from psd_tools import PSDImage
+from psd_tools.api.layers import Group, PixelLayer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from process_psd_layers import build_parent_index, collect_all_layers, remove_layers  # noqa: E402
+
+
+def build_tree(n_layers, shape, fanout=8):
+    """
+    Synthetic PSD with n_layers 1x1 pixel layers.
+    wide: fanout top-level groups holding all leaves. deep: a chain of about 400 nested
+    groups with the leaves spread along it.
+
+    Nodes are shallow copies of one template group / layer appended straight to _layers;
+    Group.append checks for duplicates and walks the parent chain, so building through
+    it would be quadratic (and recursion-bound for deep trees) itself.
+    """
+    psd = PSDImage.new('RGBA', (64, 64))
+    group_template = Group.new(psd, name='group')
+    leaf_template = PixelLayer.frompil(Image.new('RGBA', (1, 1), (255, 0, 0, 255)), group_template, name='layer')
+    psd._layers.remove(group_template)
+
+    def add(parent, template):
+        node = copy.copy(template)
+        node._parent = parent
+        if node.is_group():
+            node._layers = []
+        parent._layers.append(node)
+        return node
+
+    if shape == 'wide':
+        groups = [add(psd, group_template) for _ in range(fanout)]
+        for i in range(n_layers):
+            add(groups[i % fanout], leaf_template)
+    else:
+        parent = psd
+        for i in range(n_layers):
+            if i % max(1, n_layers // 400) == 0:
+                parent = add(parent, group_template)
+            add(parent, leaf_template)
+    return psd
+
+
+def legacy_remove(psd, layers_to_remove):
+    """Previous behaviour: one root-to-leaf scan per removed layer."""
+    def remove_from_parent(parent, target):
+        for i, child in enumerate(parent._layers):
+            if child is target:
+                del parent._layers[i]
+                return True
+            if child.is_group() and remove_from_parent(child, target):
+                return True
+        return False
+
+    return [layer for layer in layers_to_remove if remove_from_parent(psd, layer)]
+
+
+def run(n_layers, shape, fraction, seed):
+    results = {}
+    for name in ('legacy', 'indexed'):
+        psd = build_tree(n_layers, shape)
+        leaves = [layer for top in psd for layer in collect_all_layers(top)]
+        targets = random.Random(seed).sample(leaves, int(len(leaves) * fraction))
+        start = time.perf_counter()
+        if name == 'legacy':
+            removed = legacy_remove(psd, targets)
+        else:
+            removed = remove_layers(psd, targets, build_parent_index(psd))
+        elapsed = time.perf_counter() - start
+        remaining = sum(len(collect_all_layers(top)) for top in psd)
+        results[name] = (elapsed, len(removed), remaining)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='图层删除耗时随图层数的变化')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[250, 1000, 4000])
+    parser.add_argument('--shape', nargs='+', choices=['wide', 'deep'], default=['wide', 'deep'])
+    parser.add_argument('--fraction', type=float, default=0.5, help='被删除的图层比例')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'shape':<6} {'layers':>7} {'removed':>8} {'legacy ms':>10} {'indexed ms':>11} {'speedup':>8}")
+    for shape in args.shape:
+        for n in args.sizes:
+            r = run(n, shape, args.fraction, args.seed)
+            (legacy_s, legacy_n, legacy_left), (indexed_s, indexed_n, indexed_left) = r['legacy'], r['indexed']
+            assert (legacy_n, legacy_left) == (indexed_n, indexed_left), r
+            print(f"{shape:<6} {n:>7} {indexed_n:>8} {legacy_s * 1000:>10.1f} {indexed_s * 1000:>11.2f} "
+                  f"{legacy_s / max(indexed_s, 1e-9):>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
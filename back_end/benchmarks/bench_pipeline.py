@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+PSD pipeline benchmark
+
+Generates synthetic PSDs (layer count, group nesting depth, canvas size, share of layers
+with rasterized text) and times each stage of PSDProcessor separately: parse, text-layer
+removal, OCR, export, compose; plus the whole of PSDProcessor.process_psd and the
+process_psd_layers CLI. Results are written as JSON and can be compared with a stored
+baseline.
+
+    python benchmarks/bench_pipeline.py --cases small medium --repeat 3 --output results.json
+    python benchmarks/bench_pipeline.py --save-baseline baseline.json
+    python benchmarks/bench_pipeline.py --baseline baseline.json --threshold 0.25
+
+Without a tesseract binary (or with --stub-tesseract) OCR runs against a stub that finds
+no text, so the OCR stage measures the pipeline around tesseract only. psd-tools cannot
+author type layers, so "text" layers are pixel layers with drawn text: they exercise OCR,
+while text-layer removal only walks the tree.
+
+Exits 1 if a stage is slower than the baseline by more than the threshold.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from PIL import Image, ImageDraw
+from psd_tools import PSDImage
+from psd_tools.api.layers import Group, PixelLayer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.psd_utils import PSDProcessor  # noqa: E402
+from app.utils.layer_export import ExportSource, iter_layers, layer_ordinals  # noqa: E402
+from app.utils.psd_loader import open_psd  # noqa: E402
+from app.utils.render_cache import RenderCache  # noqa: E402
+from app.utils.compositor import compositable_leaves  # noqa: E402
+from app.utils.text_detection import StagedTextDetector, document_dpi  # noqa: E402
+from app.utils.ocr_executor import OCRExecutor  # noqa: E402
+import process_psd_layers  # noqa: E402
+
+# name: (layers, nesting depth, canvas size, share of layers with text)
+CASES = {
+    'small': (20, 1, (800, 600), 0.3),
+    'medium': (100, 3, (1920, 1080), 0.3),
+    'deep': (200, 8, (1200, 900), 0.2),
+    'large-canvas': (40, 2, (4000, 3000), 0.3),
+}
+
+STAGES = ('parse', 'remove_text', 'ocr', 'export', 'compose', 'process_psd', 'cli')
+
+STUB_TESSERACT = '''#!/usr/bin/env python3
+# Benchmark stub: accepts tesseract's command line and reports no text on every page
+import sys
+from PIL import Image, ImageSequence
+args = sys.argv[1:]
+if args and args[0] == '--version':
+    print('tesseract 5.0.0 (benchmark stub)')
+    sys.exit(0)
+pages = sum(1 for _ in ImageSequence.Iterator(Image.open(args[0])))
+data = '\\n\\f' * pages
+if args[1] == 'stdout':
+    sys.stdout.write(data)
+else:
+    open(args[1] + '.txt', 'w').write(data)
+'''
+
+
+def make_psd(path, n_layers, depth, size, text_share, seed=0):
+    """Pixel layers spread over a chain of depth nested groups; text_share of them carry text."""
+    rng = random.Random(seed)
+    psd = PSDImage.new('RGBA', size)
+    background = Image.new('RGBA', size, (245, 245, 240, 255))
+    PixelLayer.frompil(background, psd, name='background')
+    parents = [psd]
+    for d in range(depth - 1):
+        parents.append(Group.new(parents[-1], name=f'group {d}'))
+    width, height = size
+    for i in range(n_layers):
+        w = rng.randint(max(16, width // 40), max(32, width // 4))
+        h = rng.randint(max(16, height // 40), max(32, height // 4))
+        im = Image.new('RGBA', (w, h), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(im)
+        fill = tuple(rng.randint(0, 255) for _ in range(3)) + (255,)
+        if rng.random() < text_share:
+            draw.rectangle((0, 0, w - 1, h - 1), fill=(255, 255, 255, 255))
+            for line in range(0, h - 12, 14):
+                draw.text((4, line + 2), 'SALE 50% OFF today only', fill=(0, 0, 0, 255))
+        else:
+            draw.ellipse((w // 8, h // 8, w - 1 - w // 8, h - 1 - h // 8), fill=fill)
+        PixelLayer.frompil(im, rng.choice(parents), name=f'layer {i}',
+                           top=rng.randint(0, height - h), left=rng.randint(0, width - w))
+    psd.save(path)
+
+
+def _cpu_seconds():
+    t = os.times()
+    # Children cover tesseract and export worker processes once they have exited
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), _cpu_seconds()
+        yield
+        self.samples.setdefault(name, []).append({
+            "wall_ms": (time.perf_counter() - wall) * 1000,
+            "cpu_ms": (_cpu_seconds() - cpu) * 1000,
+        })
+
+
+def run_stages(path, workdir, processor, timer, lazy):
+    """The steps of PSDProcessor._process_psd, each timed on its own."""
+    with timer.stage('parse'):
+        psd = open_psd(path, lazy)
+        source = ExportSource(path=path, ordinals=layer_ordinals(psd), lazy=lazy)
+    with timer.stage('remove_text'):
+        for layer in reversed(psd):
+            processor.remove_text_layers_recursive(layer)
+
+    renders = RenderCache(processor.render_cache_bytes, render=lambda layer: processor._render_layer(layer, psd))
+    for layer in processor._ocr_candidates(psd):
+        renders.plan(layer)
+    for layer in processor._planned_exports(psd, 'leaf'):
+        renders.plan(layer)
+    for layer in compositable_leaves(psd)[0] or []:
+        renders.plan(layer)
+
+    with timer.stage('ocr'):
+        detector = StagedTextDetector(processor.ocr_config, dpi=document_dpi(psd)) if processor.ocr_staged else None
+        removed = processor._remove_text_images(psd, detector, renders=renders)
+    with timer.stage('export'):
+        canvas = processor._build_canvas_data_leaf(psd, assets_root=workdir, group_dir='stages', source=source, renders=renders)
+    with timer.stage('compose'):
+        image, _ = processor._compose_flattened(psd, renders)
+        processor._save_flattened(image, os.path.join(workdir, 'stages.png'))
+    renders.clear()
+    return {"layers": sum(1 for _ in iter_layers(psd)), "ocr_removed": removed, "clouds": len(canvas['clouds'])}
+
+
+def run_case(name, path, args, tesseract_cmd):
+    timer = StageTimer()
+    info = {}
+    for r in range(args.repeat):
+        workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+        try:
+            processor = PSDProcessor(tesseract_cmd=tesseract_cmd, export_workers=args.export_workers,
+                                     export_executor=args.export_executor, ocr_workers=args.ocr_workers)
+            info = run_stages(path, workdir, processor, timer, args.lazy)
+            with timer.stage('process_psd'):
+                result = processor.process_psd(input_path=path, output_path=os.path.join(workdir, 'out.png'),
+                                               return_canvas=True, assets_root=workdir)
+            if result.get("status") != "success":
+                raise RuntimeError(result.get("message"))
+            processor.ocr_executor.shutdown()
+            if not args.skip_cli:
+                executor = OCRExecutor(workers=args.ocr_workers)
+                with timer.stage('cli'), contextlib.redirect_stdout(io.StringIO()):
+                    process_psd_layers.process_psd(path, os.path.join(workdir, 'cli.png'), executor=executor, lazy=args.lazy)
+                executor.shutdown()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    stages = {}
+    for stage, samples in timer.samples.items():
+        walls = [s["wall_ms"] for s in samples]
+        stages[stage] = {
+            "wall_ms": round(statistics.median(walls), 2),
+            "wall_ms_min": round(min(walls), 2),
+            "cpu_ms": round(statistics.median(s["cpu_ms"] for s in samples), 2),
+            "runs": len(samples),
+        }
+    return {"file_bytes": os.path.getsize(path), **info, "stages": stages}
+
+
+def compare(results, baseline, threshold, min_ms):
+    """Stages whose median wall time grew by more than threshold (and min_ms) over the baseline."""
+    regressions = []
+    for case, data in results.items():
+        base_case = baseline.get(case)
+        if not base_case:
+            continue
+        for stage, now in data["stages"].items():
+            before = base_case["stages"].get(stage)
+            if not before:
+                continue
+            delta = now["wall_ms"] - before["wall_ms"]
+            if delta > min_ms and now["wall_ms"] > before["wall_ms"] * (1 + threshold):
+                regressions.append({"case": case, "stage": stage, "baseline_ms": before["wall_ms"],
+                                    "wall_ms": now["wall_ms"], "ratio": round(now["wall_ms"] / max(before["wall_ms"], 1e-6), 3)})
+    return regressions
+
+
+def print_table(results, baseline):
+    print(f"{'case':<14}{'stage':<13}{'wall ms':>10}{'cpu ms':>10}{'baseline':>10}")
+    for case, data in results.items():
+        for stage in STAGES:
+            s = data["stages"].get(stage)
+            if not s:
+                continue
+            before = (baseline.get(case) or {}).get("stages", {}).get(stage)
+            base = f"{before['wall_ms']:.1f}" if before else '-'
+            print(f"{case:<14}{stage:<13}{s['wall_ms']:>10.1f}{s['cpu_ms']:>10.1f}{base:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PSD处理流程各阶段基准测试')
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=sorted(CASES), help='要运行的示例文件')
+    parser.add_argument('--repeat', type=int, default=3, help='每个示例重复次数(取中位数)')
+    parser.add_argument('--output', default='bench_pipeline.json', help='结果JSON文件')
+    parser.add_argument('--baseline', help='与此基线JSON比较, 退化时退出码为1')
+    parser.add_argument('--save-baseline', help='将本次结果另存为基线')
+    parser.add_argument('--threshold', type=float, default=0.25, help='中位耗时超过基线的比例视为退化')
+    parser.add_argument('--min-ms', type=float, default=5.0, help='忽略小于此值(毫秒)的变化')
+    parser.add_argument('--stub-tesseract', action='store_true', help='即使安装了tesseract也使用桩程序')
+    parser.add_argument('--export-workers', type=int, default=1, help='图层导出并行数')
+    parser.add_argument('--export-executor', choices=('thread', 'process'), default='thread',
+                        help='图层导出方式(process: 每个工作进程重新解析PSD)')
+    parser.add_argument('--ocr-workers', type=int, default=0, help='tesseract并发进程数(默认: CPU核数)')
+    parser.add_argument('--lazy', action='store_true', help='以内存映射方式打开PSD')
+    parser.add_argument('--skip-cli', action='store_true', help='不测试process_psd_layers命令行流程')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory(prefix='bench_pipeline_psd_')
+    tesseract_cmd = shutil.which('tesseract')
+    if args.stub_tesseract or not tesseract_cmd:
+        tesseract_cmd = os.path.join(tmp.name, 'tesseract')
+        with open(tesseract_cmd, 'w') as f:
+            f.write(STUB_TESSERACT)
+        os.chmod(tesseract_cmd, 0o755)
+        # process_psd_layers calls pytesseract directly
+        process_psd_layers.pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+    results = {}
+    for name in args.cases:
+        n_layers, depth, size, text_share = CASES[name]
+        path = os.path.join(tmp.name, f'{name}.psd')
+        make_psd(path, n_layers, depth, size, text_share, seed=n_layers)
+        print(f"{name}: {n_layers} layers, depth {depth}, {size[0]}x{size[1]}, text {text_share:.0%}", file=sys.stderr)
+        results[name] = run_case(name, path, args, tesseract_cmd)
+    tmp.cleanup()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get("results", {})
+    regressions = compare(results, baseline, args.threshold, args.min_ms)
+
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "tesseract": "stub" if tesseract_cmd.startswith(tmp.name) else tesseract_cmd,
+            "repeat": args.repeat,
+            "export_workers": args.export_workers,
+            "lazy": args.lazy,
+        },
+        "results": results,
+        "regressions": regressions,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    print_table(results, baseline)
+    for r in regressions:
+        print(f"REGRESSION {r['case']}/{r['stage']}: {r['wall_ms']:.1f} ms vs baseline {r['baseline_ms']:.1f} ms (x{r['ratio']})")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Background removal benchmark: cold vs warm rembg sessions
+
+Cold is what /api/cutout/remove-bg used to pay on every request: a new rembg session
+(model load + onnxruntime session setup) followed by one inference. Warm is the shared
+RembgSessionPool after warmup(): the session already exists and has run once. Both run
+the same image the same number of times; warm calls can also be issued from several
+threads to measure pool throughput.
+
+    python benchmarks/bench_rembg.py --model u2net --repeat 5
+    python benchmarks/bench_rembg.py --model u2netp --sessions 2 --intra-op-threads 2 --concurrency 4
+    python benchmarks/bench_rembg.py --model u2net_custom --model-path my_model.onnx --image photo.jpg
+
+Models are downloaded by rembg on first use (~/.u2net); run once beforehand so download
+time is not counted as cold start.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+from PIL import Image, ImageDraw
+from rembg import remove
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.rembg_pool import RembgSessionPool  # noqa: E402
+
+
+def make_image(width, height):
+    """Product-shot-like test image: a shaded object on a light, slightly noisy background."""
+    rng = np.random.default_rng(0)
+    arr = np.full((height, width, 3), 235, np.uint8)
+    arr = np.clip(arr.astype(np.int16) + rng.integers(-6, 6, arr.shape), 0, 255).astype(np.uint8)
+    img = Image.fromarray(arr, 'RGB')
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((width * 0.25, height * 0.2, width * 0.75, height * 0.85), fill=(180, 60, 40))
+    draw.rectangle((width * 0.42, height * 0.1, width * 0.58, height * 0.3), fill=(60, 60, 70))
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=90)
+    return buf.getvalue()
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "runs": len(samples),
+        "median_ms": round(statistics.median(samples), 2),
+        "mean_ms": round(statistics.fmean(samples), 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))], 2),
+        "min_ms": round(ordered[0], 2),
+        "max_ms": round(ordered[-1], 2),
+    }
+
+
+def run_cold(data, args, pool):
+    samples = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        session = pool._create()
+        remove(data, session=session)
+        samples.append((time.perf_counter() - start) * 1000)
+        del session
+    return summarize(samples)
+
+
+def run_warm(data, args, pool):
+    warmup = pool.warmup()
+
+    def one(_):
+        start = time.perf_counter()
+        pool.remove(data)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if args.concurrency > 1:
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            samples = list(executor.map(one, range(args.repeat)))
+    else:
+        samples = [one(i) for i in range(args.repeat)]
+    elapsed = time.perf_counter() - start
+    return {
+        **summarize(samples),
+        "throughput_per_s": round(args.repeat / elapsed, 2),
+        "warmup_ms": warmup["warmup_ms"],
+        "session_load_ms": warmup["load_ms"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rembg 冷启动与常驻会话池耗时对比')
+    parser.add_argument('--model', default='u2net', help='rembg模型名称')
+    parser.add_argument('--model-path', help='*_custom 模型的ONNX文件')
+    parser.add_argument('--image', help='测试图片(默认: 生成的商品图)')
+    parser.add_argument('--size', default='1024x1024', help='生成测试图片的尺寸, 如 1024x1024')
+    parser.add_argument('--repeat', type=int, default=5, help='冷启动与常驻各运行次数')
+    parser.add_argument('--sessions', type=int, default=1, help='会话池大小')
+    parser.add_argument('--intra-op-threads', type=int, default=0, help='onnxruntime算子内线程数(0: 默认)')
+    parser.add_argument('--inter-op-threads', type=int, default=0, help='onnxruntime算子间线程数(0: 默认)')
+    parser.add_argument('--concurrency', type=int, default=1, help='常驻阶段并发请求数')
+    parser.add_argument('--skip-cold', action='store_true', help='只测试常驻会话')
+    parser.add_argument('--output', default='bench_rembg.json', help='结果JSON文件')
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            data = f.read()
+    else:
+        width, height = (int(v) for v in args.size.lower().split('x'))
+        data = make_image(width, height)
+
+    pool = RembgSessionPool(args.model, args.sessions, args.intra_op_threads, args.inter_op_threads, args.model_path)
+    results = {}
+    if not args.skip_cold:
+        results["cold"] = run_cold(data, args, pool)
+    results["warm"] = run_warm(data, args, pool)
+    if "cold" in results:
+        results["speedup_median"] = round(results["cold"]["median_ms"] / max(results["warm"]["median_ms"], 1e-6), 2)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {k: v for k, v in vars(args).items() if k != 'output'},
+        "image_bytes": len(data),
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'':<6}{'median ms':>12}{'p95 ms':>10}{'mean ms':>10}")
+    for name in ('cold', 'warm'):
+        if name in results:
+            r = results[name]
+            print(f"{name:<6}{r['median_ms']:>12.1f}{r['p95_ms']:>10.1f}{r['mean_ms']:>10.1f}")
+    warm = results["warm"]
+    print(f"warmup {warm['warmup_ms']:.1f} ms (session load {warm['session_load_ms']} ms), "
+          f"throughput {warm['throughput_per_s']}/s")
+    if "speedup_median" in results:
+        print(f"warm is {results['speedup_median']}x faster than cold (median)")
+
+
+if __name__ == '__main__':
+    main()
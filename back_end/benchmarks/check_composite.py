@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Flattened composite correctness check
+
+Flattens PSD files the way the processor does (PSDProcessor._compose_flattened, which
+uses the layer-bitmap compositor in app/utils/compositor.py when it can) and with
+psd-tools (psd.composite(force=True)) and reports the per-channel difference. Without
+arguments a few synthetic documents (nested groups, partial opacity, hidden layers,
+semi-transparent pixels, layers at opacity 0, 1 and 128) are generated and checked.
+
+    python benchmarks/check_composite.py [file.psd ...] [--tolerance 2]
+
+Exits non-zero if any file the compositor accepts differs by more than the tolerance.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+from psd_tools import PSDImage
+from psd_tools.api.layers import Group, PixelLayer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.compositor import compositable_leaves  # noqa: E402
+from app.utils.psd_utils import PSDProcessor  # noqa: E402
+
+
+def make_synthetic(path, n_layers, size=(1200, 900), seed=0):
+    rng = random.Random(seed)
+    psd = PSDImage.new('RGBA', size)
+    groups = [Group.new(psd, name=f'group {g}') for g in range(3)]
+    groups.append(Group.new(groups[0], name='nested'))
+    for i in range(n_layers):
+        w, h = rng.randint(20, 500), rng.randint(20, 500)
+        fill = tuple(rng.randint(0, 255) for _ in range(3)) + (rng.choice([255, 200, 90]),)
+        im = Image.new('RGBA', (w, h), (0, 0, 0, 0))
+        ImageDraw.Draw(im).ellipse((0, 0, w - 1, h - 1), fill=fill)
+        parent = psd if i % 3 == 0 else rng.choice(groups)
+        layer = PixelLayer.frompil(im, parent, name=f'layer {i}',
+                                   top=rng.randint(-50, size[1] - 20), left=rng.randint(-50, size[0] - 20))
+        layer.opacity = rng.choice([255, 255, 180, 64])
+        if i % 11 == 5:
+            layer.visible = False
+    psd.save(path)
+
+
+def make_opacity_edges(path, size=(600, 400)):
+    """Overlapping opaque squares at opacity 0 (invisible), 1 (nearly) and 128 (half) over a base."""
+    psd = PSDImage.new('RGBA', size)
+    base = Image.new('RGBA', size, (40, 120, 200, 255))
+    PixelLayer.frompil(base, psd, name='base', top=0, left=0)
+    for i, opacity in enumerate((0, 1, 128)):
+        im = Image.new('RGBA', (240, 240), (230, 60 + 60 * i, 20, 255))
+        layer = PixelLayer.frompil(im, psd, name=f'opacity {opacity}', top=60 + 20 * i, left=40 + 160 * i)
+        layer.opacity = opacity
+    psd.save(path)
+
+
+def check(processor, path, tolerance):
+    psd = PSDImage.open(path)
+    t0 = time.perf_counter()
+    reference = np.asarray(psd.composite(force=True).convert('RGBA')).astype(np.int16)
+    ref_ms = (time.perf_counter() - t0) * 1000
+
+    leaves, reason = compositable_leaves(psd)
+    if leaves is None:
+        print(f"{os.path.basename(path)}: falls back to psd-tools ({reason})")
+        return True
+
+    t0 = time.perf_counter()
+    image, stats = processor._compose_flattened(psd)
+    ours = np.asarray(image.convert('RGBA')).astype(np.int16)
+    ours_ms = (time.perf_counter() - t0) * 1000
+
+    diff = np.abs(ours - reference)
+    # Colour under fully transparent pixels is arbitrary (psd-tools leaves it white)
+    visible = reference[:, :, 3] > 0
+    rgb_max = int(diff[:, :, :3][visible].max()) if visible.any() else 0
+    alpha_max = int(diff[:, :, 3].max())
+    ok = max(rgb_max, alpha_max) <= tolerance
+    print(f"{os.path.basename(path)}: {stats['layers']} layers, max diff rgb {rgb_max} alpha {alpha_max}, "
+          f"mean {float(diff[visible].mean()) if visible.any() else 0.0:.4f} | "
+          f"psd-tools {ref_ms:.0f} ms, compositor {ours_ms:.0f} ms {'OK' if ok else 'FAIL'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较图层合成结果与psd-tools的差异')
+    parser.add_argument('files', nargs='*', help='PSD文件; 省略时使用生成的示例文件')
+    parser.add_argument('--tolerance', type=int, default=2, help='允许的最大通道差值(0-255)')
+    args = parser.parse_args()
+
+    files = list(args.files)
+    tmp = None
+    if not files:
+        tmp = tempfile.TemporaryDirectory(prefix='composite_check_')
+        for n in (10, 60, 200):
+            path = os.path.join(tmp.name, f'synthetic_{n}.psd')
+            make_synthetic(path, n, seed=n)
+            files.append(path)
+        path = os.path.join(tmp.name, 'opacity_edges.psd')
+        make_opacity_edges(path)
+        files.append(path)
+
+    processor = PSDProcessor()
+    ok = all([check(processor, path, args.tolerance) for path in files])
+    if tmp:
+        tmp.cleanup()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
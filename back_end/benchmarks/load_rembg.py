@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Background removal load generator: images/sec and latency per concurrency level
+
+Each level keeps --concurrency clients busy for --duration seconds; every client sends
+one image, waits for the cutout and sends the next. In-process mode drives a
+RembgSessionPool directly, once unbatched and once per --batch-sizes value, so the effect
+of micro-batching (REMBG_BATCH_SIZE / REMBG_BATCH_MAX_WAIT_MS) is measured on the same
+machine and image. With --url the same load is sent to a running server instead, and
+the server's own settings apply; 429/504 answers are counted separately.
+
+    python benchmarks/load_rembg.py --model u2net --levels 1,2,4,8 --batch-sizes 4,8
+    python benchmarks/load_rembg.py --model u2net_custom --model-path ~/.rembg/model.onnx --max-wait-ms 5
+    python benchmarks/load_rembg.py --url http://127.0.0.1:8000/api/cutout/remove-bg --levels 1,4,16
+
+Batching only helps models exported with a dynamic batch axis; a model fixed to batch
+size 1 shows the coalescing overhead without the gain.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.rembg_pool import RembgSessionPool  # noqa: E402
+from bench_rembg import make_image, summarize  # noqa: E402
+
+
+def run_level(send, concurrency, duration):
+    """Closed-loop load: concurrency clients sending back to back for duration seconds."""
+    samples, errors = [], {}
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            outcome = send()
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                if outcome == 'ok':
+                    samples.append(elapsed)
+                else:
+                    errors[outcome] = errors.get(outcome, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+    elapsed = time.perf_counter() - start
+    result = summarize(samples) if samples else {"runs": 0}
+    if samples:
+        ordered = sorted(samples)
+        result["p99_ms"] = round(ordered[min(len(ordered) - 1, int(round(0.99 * (len(ordered) - 1))))], 2)
+    result["images_per_s"] = round(len(samples) / elapsed, 2)
+    result["errors"] = errors
+    return result
+
+
+def pool_sender(pool, data):
+    def send():
+        try:
+            pool.remove(data)
+            return 'ok'
+        except Exception as e:
+            return type(e).__name__
+    return send
+
+
+def http_sender(url, data):
+    local = threading.local()
+
+    def send():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        try:
+            resp = local.session.post(url, files={'file': ('load.jpg', data, 'image/jpeg')}, timeout=300)
+        except requests.RequestException as e:
+            return type(e).__name__
+        return 'ok' if resp.status_code == 200 else str(resp.status_code)
+    return send
+
+
+def main():
+    parser = argparse.ArgumentParser(description='抠图负载测试: 不同并发下的吞吐与延迟')
+    parser.add_argument('--url', help='服务地址(如 http://127.0.0.1:8000/api/cutout/remove-bg); 不指定则进程内测试')
+    parser.add_argument('--model', default='u2net', help='rembg模型名称(进程内模式)')
+    parser.add_argument('--model-path', help='*_custom 模型的ONNX文件')
+    parser.add_argument('--image', help='测试图片(默认: 生成的商品图)')
+    parser.add_argument('--size', default='1024x1024', help='生成测试图片的尺寸, 如 1024x1024')
+    parser.add_argument('--levels', default='1,2,4,8', help='并发级别, 逗号分隔')
+    parser.add_argument('--duration', type=float, default=10, help='每个并发级别持续秒数')
+    parser.add_argument('--sessions', type=int, default=1, help='会话池大小(进程内模式)')
+    parser.add_argument('--intra-op-threads', type=int, default=0, help='onnxruntime算子内线程数(0: 默认)')
+    parser.add_argument('--batch-sizes', default='4', help='对比的批大小, 逗号分隔(1 = 不合批, 总会测试)')
+    parser.add_argument('--max-wait-ms', type=float, default=10, help='合批最长等待毫秒数')
+    parser.add_argument('--output', default='load_rembg.json', help='结果JSON文件')
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            data = f.read()
+    else:
+        width, height = (int(v) for v in args.size.lower().split('x'))
+        data = make_image(width, height)
+    levels = [int(v) for v in args.levels.split(',') if v.strip()]
+
+    runs = {}
+    if args.url:
+        send = http_sender(args.url, data)
+        runs["server"] = {str(c): run_level(send, c, args.duration) for c in levels}
+    else:
+        batch_sizes = sorted({1} | {int(v) for v in args.batch_sizes.split(',') if v.strip()})
+        for batch_size in batch_sizes:
+            pool = RembgSessionPool(args.model, args.sessions, args.intra_op_threads, 0, args.model_path,
+                                    batch_size=batch_size, batch_max_wait_ms=args.max_wait_ms)
+            pool.warmup()
+            if batch_size > 1 and pool.batcher is None:
+                print(f"{args.model} 不支持合批, 跳过 batch={batch_size}")
+                continue
+            send = pool_sender(pool, data)
+            name = f"batch={batch_size}"
+            runs[name] = {}
+            for concurrency in levels:
+                before = pool.batcher.stats() if pool.batcher else None
+                result = run_level(send, concurrency, args.duration)
+                if pool.batcher:
+                    after = pool.batcher.stats()
+                    batches = after["batches"] - before["batches"]
+                    result["mean_batch_size"] = round((after["images"] - before["images"]) / batches, 2) if batches else None
+                runs[name][str(concurrency)] = result
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {k: v for k, v in vars(args).items() if k != 'output'},
+        "image_bytes": len(data),
+        "runs": runs,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'run':<10}{'clients':>8}{'img/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'batch':>7}  errors")
+    for name, levels_result in runs.items():
+        for concurrency, r in levels_result.items():
+            if not r["runs"]:
+                print(f"{name:<10}{concurrency:>8}{0:>9}{'-':>10}{'-':>10}{'-':>10}{'-':>7}  {r['errors']}")
+                continue
+            batch = r.get("mean_batch_size")
+            print(f"{name:<10}{concurrency:>8}{r['images_per_s']:>9.2f}{r['median_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+                  f"{r['p99_ms']:>10.1f}{batch if batch is not None else '-':>7}  {r['errors'] or ''}")
+
+
+if __name__ == '__main__':
+    main()
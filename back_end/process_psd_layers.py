@@ -6,16 +6,24 @@ PSD文件处理脚本 - 改进版
 1. 递归删除所有文本图层（包括组内的）
 2. 检测包含文字的图片图层并删除
 3. 导出剩余图层为单独的图像文件
+4. 输入为目录时批量并行处理, 并生成 manifest.json
 """
 
 import os
 import sys
 import argparse
+import contextlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import cv2
 import numpy as np
 from PIL import Image
 import pytesseract
-from psd_tools import PSDImage
+
+from app.utils.ocr_executor import OCRExecutor
+from app.utils.render_cache import RenderCache
+from app.utils.psd_loader import PeakRSSMonitor, open_psd, release_pages
 
 
 def remove_text_layers_recursive(layer, parent=None, parent_layers=None, index=None):
@@ -73,143 +81,381 @@ def collect_all_layers(layer, layers_list=None):
     return layers_list
 
 
-def detect_text_in_image(image_data, layer_name):
+# 四种预处理方式: (名称, tesseract 配置)
+OCR_LANG = 'chi_sim+eng'
+MIN_MEANINGFUL_CHARS = 2
+OCR_STRATEGIES = ('exhaustive', 'early-exit', 'adaptive')
+# 默认保存在用户缓存目录, 不写入源码树; 需要共享时用 --ocr-stats-file 显式指定
+DEFAULT_VARIANT_STATS = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                     'psd_layers', 'ocr_variant_stats.json')
+OCR_VARIANTS = [
+    ('标准OCR检测', '--oem 3 --psm 11'),
+    ('二值化OCR检测', '--oem 3 --psm 6'),  # PSM 6 = 假设有统一的文本块
+    ('反色OCR检测', '--oem 3 --psm 11'),  # 针对白底黑字或黑底白字
+    ('边缘增强OCR检测', '--oem 3 --psm 11'),
+]
+
+
+def build_ocr_variants(image_data, layer_name):
+    """
+    生成送入OCR的四种预处理图像
+    
+    Args:
+        image_data: PIL Image对象
+        layer_name: 图层名称(用于日志)
+        
+    Returns:
+        list: 与 OCR_VARIANTS 对应的图像列表; 跳过检测时返回None
+    """
+    # 检查图像尺寸,太小的图像跳过
+    if image_data.width < 10 or image_data.height < 10:
+        print(f"    图像太小,跳过检测")
+        return None
+    
+    # 将PIL Image转换为numpy数组
+    img_array = np.array(image_data)
+    
+    # 处理不同的图像格式
+    if len(img_array.shape) == 2:
+        # 灰度图
+        gray = img_array
+    elif len(img_array.shape) == 3:
+        if img_array.shape[2] == 4:
+            # RGBA: 检查alpha通道,如果完全透明则跳过
+            alpha = img_array[:, :, 3]
+            if np.all(alpha == 0):
+                print(f"    图层完全透明,跳过")
+                return None
+            # 转换为RGB
+            img_array = cv2.cvtColor(img_array, cv2.COLOR_RGBA2RGB)
+        # 转为灰度
+        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    else:
+        print(f"    不支持的图像格式")
+        return None
+    
+    # 方法2: 二值化
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # 方法3: 反色
+    inverted = cv2.bitwise_not(gray)
+    # 方法4: 边缘增强
+    edges = cv2.Canny(gray, 50, 150)
+    dilated = cv2.dilate(edges, np.ones((3,3), np.uint8), iterations=1)
+    
+    return [gray, thresh, inverted, dilated]
+
+
+def meaningful_char_count(texts):
+    """
+    统计OCR结果中有意义的字符数量(去掉空白和特殊符号)
+    
+    Args:
+        texts: 各方法识别出的文本列表
+        
+    Returns:
+        int: 有意义的字符数量
+    """
+    all_text = ' '.join(texts)
+    return sum(1 for c in all_text if c.isalnum())
+
+
+def text_found(texts):
+    """
+    根据四种方法的OCR结果判断是否包含文字
+    
+    Args:
+        texts: 各方法识别出的文本列表
+        
+    Returns:
+        bool: 如果图片包含文字返回True
+    """
+    # 合并所有检测结果
+    all_text = ' '.join(texts)
+    
+    # 过滤掉单个字符或特殊符号(容易误判)
+    cleaned_text = ''.join(c for c in all_text if c.isalnum() or c.isspace())
+    
+    if cleaned_text.strip():
+        # 统计有意义的字符数量
+        meaningful_chars = ''.join(c for c in cleaned_text if not c.isspace())
+        if len(meaningful_chars) >= MIN_MEANINGFUL_CHARS:  # 至少2个字符才认为是文字
+            preview = cleaned_text.strip()[:100]
+            print(f"    ✓ 检测到文字({len(meaningful_chars)}字符): {preview}{'...' if len(cleaned_text.strip()) > 100 else ''}")
+            return True
+    
+    print(f"    ✗ 未检测到文字")
+    return False
+
+
+class VariantStats:
+    """
+    各预处理方法的历史命中率, 保存在JSON文件中, 用于决定提前退出时的尝试顺序
+    命中 = 该方法单独识别出有意义的字符
+    """
+    
+    def __init__(self, path=None):
+        self.path = path
+        self.runs = [0] * len(OCR_VARIANTS)
+        self.hits = [0] * len(OCR_VARIANTS)
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if len(data.get('runs', [])) == len(OCR_VARIANTS):
+                    self.runs = [int(v) for v in data['runs']]
+                    self.hits = [int(v) for v in data['hits']]
+            except (OSError, ValueError) as e:
+                print(f"读取OCR命中率统计失败: {e}")
+    
+    def rate(self, i):
+        # 拉普拉斯平滑, 没有历史时保持默认顺序
+        return (self.hits[i] + 1) / (self.runs[i] + 2)
+    
+    def order(self):
+        return sorted(range(len(OCR_VARIANTS)), key=lambda i: (-self.rate(i), i))
+    
+    def update(self, i, text):
+        self.runs[i] += 1
+        if meaningful_char_count([text]) > 0:
+            self.hits[i] += 1
+    
+    def merge(self, runs, hits):
+        """累加其他进程中产生的统计增量"""
+        self.runs = [a + b for a, b in zip(self.runs, runs)]
+        self.hits = [a + b for a, b in zip(self.hits, hits)]
+    
+    def save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump({'runs': self.runs, 'hits': self.hits}, f)
+        except OSError as e:
+            print(f"保存OCR命中率统计失败: {e}")
+
+
+def detect_text_in_image(image_data, layer_name, executor=None):
     """
     使用多种方法检测图片中是否包含文字
     
     Args:
         image_data: PIL Image对象
         layer_name: 图层名称(用于日志)
+        executor: OCRExecutor, 四种方法并发执行; 为None时逐个调用tesseract
         
     Returns:
         bool: 如果图片包含文字返回True
     """
     try:
-        # 检查图像尺寸,太小的图像跳过
-        if image_data.width < 10 or image_data.height < 10:
-            print(f"    图像太小,跳过检测")
+        variants = build_ocr_variants(image_data, layer_name)
+        if variants is None:
             return False
         
-        # 将PIL Image转换为numpy数组
-        img_array = np.array(image_data)
-        
-        # 处理不同的图像格式
-        if len(img_array.shape) == 2:
-            # 灰度图
-            gray = img_array
-        elif len(img_array.shape) == 3:
-            if img_array.shape[2] == 4:
-                # RGBA: 检查alpha通道,如果完全透明则跳过
-                alpha = img_array[:, :, 3]
-                if np.all(alpha == 0):
-                    print(f"    图层完全透明,跳过")
-                    return False
-                # 转换为RGB
-                img_array = cv2.cvtColor(img_array, cv2.COLOR_RGBA2RGB)
-            # 转为灰度
-            gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+        for name, _ in OCR_VARIANTS:
+            print(f"    {name}...")
+        requests = [(img, OCR_LANG, config) for img, (_, config) in zip(variants, OCR_VARIANTS)]
+        if executor is not None:
+            texts = executor.map_requests(requests)
         else:
-            print(f"    不支持的图像格式")
-            return False
-        
-        # 方法1: 基础OCR检测
-        print(f"    方法1: 标准OCR检测...")
-        config1 = '--oem 3 --psm 11'
-        text1 = pytesseract.image_to_string(gray, lang='chi_sim+eng', config=config1)
-        
-        # 方法2: 二值化后OCR检测
-        print(f"    方法2: 二值化OCR检测...")
-        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        config2 = '--oem 3 --psm 6'  # PSM 6 = 假设有统一的文本块
-        text2 = pytesseract.image_to_string(thresh, lang='chi_sim+eng', config=config2)
-        
-        # 方法3: 反色后检测(针对白底黑字或黑底白字)
-        print(f"    方法3: 反色OCR检测...")
-        inverted = cv2.bitwise_not(gray)
-        text3 = pytesseract.image_to_string(inverted, lang='chi_sim+eng', config=config1)
-        
-        # 方法4: 边缘增强后检测
-        print(f"    方法4: 边缘增强OCR检测...")
-        edges = cv2.Canny(gray, 50, 150)
-        dilated = cv2.dilate(edges, np.ones((3,3), np.uint8), iterations=1)
-        text4 = pytesseract.image_to_string(dilated, lang='chi_sim+eng', config=config1)
-        
-        # 合并所有检测结果
-        all_text = f"{text1} {text2} {text3} {text4}"
-        
-        # 过滤掉单个字符或特殊符号(容易误判)
-        cleaned_text = ''.join(c for c in all_text if c.isalnum() or c.isspace())
+            texts = [pytesseract.image_to_string(img, lang=lang, config=config) for img, lang, config in requests]
         
-        if cleaned_text.strip():
-            # 统计有意义的字符数量
-            meaningful_chars = ''.join(c for c in cleaned_text if not c.isspace())
-            if len(meaningful_chars) >= 2:  # 至少2个字符才认为是文字
-                preview = cleaned_text.strip()[:100]
-                print(f"    ✓ 检测到文字({len(meaningful_chars)}字符): {preview}{'...' if len(cleaned_text.strip()) > 100 else ''}")
-                return True
-        
-        print(f"    ✗ 未检测到文字")
-        return False
+        return text_found(texts)
         
     except Exception as e:
         print(f"    OCR检测出错: {str(e)}")
         return False
 
 
-def find_and_mark_parent_groups(layer, target_layer, marked_groups):
+def detect_text_layers(layers, executor, strategy='exhaustive', variant_stats=None, summary=None, renders=None):
     """
-    查找并标记包含目标图层的所有父组
+    批量检测图片图层中的文字
+    所有图层的预处理图像按窗口交给OCR执行器, 同一配置的图像合并为一次tesseract调用
+    
+    策略:
+        exhaustive: 每个图层都跑完四种方法
+        early-exit: 按历史命中率排序, 累计有意义字符达到阈值即停止; 判定结果与exhaustive一致
+        adaptive:   同early-exit, 但每个窗口结束后按本次运行的命中率重新排序
     
     Args:
-        layer: 当前检查的图层
-        target_layer: 要删除的目标图层
-        marked_groups: 已标记的组集合
+        layers: 待检测的图片图层列表
+        executor: OCRExecutor
+        strategy: 检测策略
+        variant_stats: VariantStats, 为None时不使用历史命中率
+        summary: dict, 累计识别次数和触发方法统计
+        renders: RenderCache, 图层图像渲染一次后供导出步骤复用
         
     Returns:
-        bool: 如果找到目标图层返回True
+        list: 包含文字的图层
     """
-    if layer == target_layer:
-        return True
+    if variant_stats is None:
+        variant_stats = VariantStats()
+    if summary is None:
+        summary = {}
+    summary.setdefault('layers', 0)
+    summary.setdefault('ocr_images', 0)
+    summary.setdefault('ocr_images_exhaustive', 0)
+    summary.setdefault('fired', {name: 0 for name, _ in OCR_VARIANTS})
     
-    if hasattr(layer, 'is_group') and layer.is_group():
-        for sub_layer in layer:
-            if find_and_mark_parent_groups(sub_layer, target_layer, marked_groups):
-                marked_groups.add(id(layer))
-                return True
+    layers_to_remove = []
+    # 每个窗口的图层数: 让所有worker都有批次可跑, 同时限制内存中的预处理图像数量
+    window = max(1, executor.workers * executor.batch_size // len(OCR_VARIANTS))
+    order = variant_stats.order()
     
-    return False
+    for start in range(0, len(layers), window):
+        chunk = layers[start:start + window]
+        pending = []  # (序号, 图层, 预处理图像列表或None, 错误信息)
+        for offset, layer in enumerate(chunk):
+            idx = start + offset + 1
+            print(f"[{idx}/{len(layers)}] 预处理图片图层: {layer.name}")
+            try:
+                layer_image = renders.get(layer) if renders is not None else layer.composite()
+                if layer_image is None:
+                    pending.append((idx, layer, None, "无法提取图像,跳过"))
+                    continue
+                pending.append((idx, layer, build_ocr_variants(layer_image, layer.name), None))
+            except Exception as e:
+                pending.append((idx, layer, None, f"处理出错: {str(e)}"))
+        
+        # texts[idx][variant] = 识别结果; 未运行的方法不在字典中
+        texts = {idx: {} for idx, _, variants, _ in pending if variants is not None}
+        fired = {}
+        ocr_error = None
+        rounds = [order] if strategy == 'exhaustive' else [[i] for i in order]
+        for variant_ids in rounds:
+            requests, keys = [], []
+            for idx, layer, variants, _ in pending:
+                if variants is None or idx in fired:
+                    continue
+                for i in variant_ids:
+                    requests.append((variants[i], OCR_LANG, OCR_VARIANTS[i][1]))
+                    keys.append((idx, i))
+            if not requests:
+                break
+            try:
+                results = executor.map_requests(requests)
+            except Exception as e:
+                ocr_error = str(e)
+                break
+            summary['ocr_images'] += len(requests)
+            for (idx, i), text in zip(keys, results):
+                texts[idx][i] = text
+                variant_stats.update(i, text)
+            # 按尝试顺序找出让累计字符数达到阈值的方法
+            for idx, ran in texts.items():
+                if idx in fired:
+                    continue
+                tried = [i for i in order if i in ran]
+                for k in range(len(tried)):
+                    if meaningful_char_count([ran[i] for i in tried[:k + 1]]) >= MIN_MEANINGFUL_CHARS:
+                        fired[idx] = tried[k]
+                        break
+        
+        for idx, layer, variants, error in pending:
+            print(f"[{idx}/{len(layers)}] 检查图片图层: {layer.name}")
+            if error:
+                print(f"    {error}\n")
+                continue
+            if variants is None:
+                print(f"    >>> 保留\n")
+                continue
+            summary['layers'] += 1
+            summary['ocr_images_exhaustive'] += len(OCR_VARIANTS)
+            if ocr_error:
+                print(f"    OCR检测出错: {ocr_error}")
+                print(f"    >>> 保留\n")
+                continue
+            ran = texts[idx]
+            for i in order:
+                if i in ran:
+                    print(f"    {OCR_VARIANTS[i][0]}")
+            if text_found([ran[i] for i in order if i in ran]):
+                name = OCR_VARIANTS[fired[idx]][0]
+                summary['fired'][name] += 1
+                print(f"    触发方法: {name} (运行 {len(ran)}/{len(OCR_VARIANTS)} 种方法)")
+                layers_to_remove.append(layer)
+                print(f"    >>> 标记为删除\n")
+            else:
+                print(f"    >>> 保留\n")
+        
+        if strategy == 'adaptive':
+            order = variant_stats.order()
+    
+    return layers_to_remove
 
 
-def remove_layer_from_tree(psd, layer_to_remove):
+def build_parent_index(psd):
     """
-    从PSD图层树中删除指定图层
+    一次遍历建立图层索引: id(图层) -> (父容器, 在父容器中的位置)
     
     Args:
         psd: PSD对象
-        layer_to_remove: 要删除的图层
         
     Returns:
-        bool: 删除成功返回True
+        dict: 图层id到(父容器, 索引)的映射
     """
-    def remove_from_parent(parent):
-        if not hasattr(parent, '_layers'):
-            return False
-        
+    index = {}
+    stack = [psd]
+    while stack:
+        parent = stack.pop()
         for i, child in enumerate(parent._layers):
-            if child == layer_to_remove:
-                del parent._layers[i]
-                return True
-            
+            index[id(child)] = (parent, i)
             if hasattr(child, 'is_group') and child.is_group():
-                if remove_from_parent(child):
-                    return True
+                stack.append(child)
+    return index
+
+
+def remove_layers(psd, layers_to_remove, parent_index=None):
+    """
+    一次性从PSD图层树中删除多个图层
+    按父容器分组后从后往前删除, 已删除图层不会影响其余图层的索引
+    
+    Args:
+        psd: PSD对象
+        layers_to_remove: 要删除的图层列表
+        parent_index: build_parent_index 的结果, 为None时现场建立
         
-        return False
+    Returns:
+        list: 成功删除的图层
+    """
+    if parent_index is None:
+        parent_index = build_parent_index(psd)
+    
+    by_parent = {}
+    for layer in layers_to_remove:
+        entry = parent_index.get(id(layer))
+        if entry is None:
+            continue
+        parent, i = entry
+        by_parent.setdefault(id(parent), (parent, {}))[1][i] = layer
     
-    return remove_from_parent(psd)
+    removed = []
+    for parent, targets in by_parent.values():
+        for i in sorted(targets, reverse=True):
+            # 索引建立后树被改动过时跳过, 不误删其他图层
+            if i < len(parent._layers) and parent._layers[i] is targets[i]:
+                del parent._layers[i]
+                removed.append(targets[i])
+    return removed
+
+
+def print_ocr_summary(strategy, summary, tesseract_calls):
+    """
+    输出本文件的OCR统计: 识别次数、相比exhaustive节省的次数、各方法触发次数
+    """
+    full = summary.get('ocr_images_exhaustive', 0)
+    ran = summary.get('ocr_images', 0)
+    saved = max(full - ran, 0)
+    print(f"OCR策略: {strategy}, 检测 {summary.get('layers', 0)} 个图层")
+    print(f"  识别图像 {ran}/{full} 次, 节省 {saved} 次 ({(saved / full if full else 0):.0%}), tesseract进程 {tesseract_calls} 次")
+    fired = summary.get('fired', {})
+    if fired:
+        print("  触发方法: " + ", ".join(f"{name} {count}" for name, count in fired.items()))
+    print()
 
 
-def process_psd(input_path, output_path, skip_ocr=False):
+def process_psd(input_path, output_path, skip_ocr=False, executor=None, ocr_strategy='exhaustive', variant_stats=None,
+                render_cache_bytes=512 * 1024 * 1024, lazy=False):
     """
     主处理函数
     
@@ -217,12 +463,20 @@ def process_psd(input_path, output_path, skip_ocr=False):
         input_path: 输入PSD文件路径
         output_path: 输出图像路径
         skip_ocr: 是否跳过OCR检测(仅删除文本图层)
+        executor: OCRExecutor, 为None时使用默认配置创建
+        ocr_strategy: OCR策略, 见 detect_text_layers
+        variant_stats: VariantStats, 各预处理方法的历史命中率
+        render_cache_bytes: OCR与导出之间缓存图层图像的内存上限
+        lazy: 以内存映射方式打开文件, 通道数据在渲染图层时才读取
+    
+    Returns:
+        画布描述: 尺寸, 删除的图层数, 以及每个导出图层的文件和位置
     """
     print(f"正在处理PSD文件: {input_path}")
     print(f"图像将保存至: {output_path}\n")
     
     # 读取PSD文件
-    psd = PSDImage.open(input_path)
+    psd = open_psd(input_path, lazy)
     print(f"PSD尺寸: {psd.width} x {psd.height}")
     print(f"顶层图层数: {len(psd)}\n")
     
@@ -245,11 +499,24 @@ def process_psd(input_path, output_path, skip_ocr=False):
     
     print(f"\n文本图层删除完成,共删除 {text_layer_count} 个顶层文本图层\n")
     
+    # 每个图层只渲染一次: 图片图层用于OCR和导出各一次, 其余图层只用于导出
+    def render(layer):
+        image = layer.composite()
+        release_pages(psd)
+        return image
+    
+    renders = RenderCache(render_cache_bytes, render=render)
+    for layer in psd:
+        for leaf in collect_all_layers(layer):
+            renders.plan(leaf, 2 if not skip_ocr and getattr(leaf, 'kind', None) == 'pixel' else 1)
+    
     # 步骤2: 删除包含文字的图片图层
     if not skip_ocr:
         print("=" * 60)
         print("步骤2: 检测并删除包含文字的图片图层")
         print("=" * 60)
+        if executor is None:
+            executor = OCRExecutor()
         
         # 收集所有底层图层
         all_layers = []
@@ -259,40 +526,30 @@ def process_psd(input_path, output_path, skip_ocr=False):
         print(f"共找到 {len(all_layers)} 个底层图层\n")
         
         # 检测包含文字的图片图层
-        layers_to_remove = []
-        for idx, layer in enumerate(all_layers, 1):
-            if hasattr(layer, 'kind') and layer.kind == 'pixel':
-                print(f"[{idx}/{len(all_layers)}] 检查图片图层: {layer.name}")
-                
-                try:
-                    layer_image = layer.composite()
-                    
-                    if layer_image is not None:
-                        if detect_text_in_image(layer_image, layer.name):
-                            layers_to_remove.append(layer)
-                            print(f"    >>> 标记为删除\n")
-                        else:
-                            print(f"    >>> 保留\n")
-                    else:
-                        print(f"    无法提取图像,跳过\n")
-                        
-                except Exception as e:
-                    print(f"    处理出错: {str(e)}\n")
+        pixel_layers = [layer for layer in all_layers if hasattr(layer, 'kind') and layer.kind == 'pixel']
+        calls_before = executor.calls
+        summary = {}
+        layers_to_remove = detect_text_layers(pixel_layers, executor, ocr_strategy, variant_stats, summary, renders)
+        ocr_layer_count = 0
+        print_ocr_summary(ocr_strategy, summary, executor.calls - calls_before)
         
         # 删除标记的图层
         if layers_to_remove:
             print(f"正在删除 {len(layers_to_remove)} 个包含文字的图片图层...")
-            removed_count = 0
+            removed = {id(layer) for layer in remove_layers(psd, layers_to_remove)}
             for layer in layers_to_remove:
-                if remove_layer_from_tree(psd, layer):
+                renders.discard(layer)
+            for layer in layers_to_remove:
+                if id(layer) in removed:
                     print(f"  ✓ 已删除: {layer.name}")
-                    removed_count += 1
                 else:
                     print(f"  ✗ 删除失败: {layer.name}")
-            print(f"成功删除 {removed_count} 个图层\n")
+            print(f"成功删除 {len(removed)} 个图层\n")
+            ocr_layer_count = len(removed)
         else:
             print("未发现包含文字的图片图层\n")
     else:
+        ocr_layer_count = 0
         print("\n跳过OCR检测(使用 --skip-ocr 参数)\n")
     
     # 步骤3: 导出各个图层
@@ -314,12 +571,13 @@ def process_psd(input_path, output_path, skip_ocr=False):
     
     # 逐个导出图层
     exported_count = 0
+    exported = []
     for idx, layer in enumerate(remaining_layers, 1):
         print(f"[{idx}/{len(remaining_layers)}] 导出图层: {layer.name}")
         
         try:
             # 使用图层的composite方法生成图像
-            layer_image = layer.composite()
+            layer_image = renders.get(layer)
             
             if layer_image is not None:
                 # 生成输出文件路径
@@ -333,6 +591,15 @@ def process_psd(input_path, output_path, skip_ocr=False):
                 file_size = os.path.getsize(layer_output_path) / 1024
                 print(f"  ✓ 图层图像已保存: {layer_output_path} ({file_size:.2f} KB)")
                 exported_count += 1
+                exported.append({
+                    'name': layer.name,
+                    'file': layer_output_path,
+                    'left': layer.left,
+                    'top': layer.top,
+                    'width': layer_image.width,
+                    'height': layer_image.height,
+                    'opacity': layer.opacity,
+                })
             else:
                 print(f"  ✗ 无法生成图层图像")
                 
@@ -340,10 +607,140 @@ def process_psd(input_path, output_path, skip_ocr=False):
             print(f"  ✗ 导出图层出错: {str(e)}")
     
     print(f"\n成功导出 {exported_count} 个图层图像")
+    stats = renders.stats()
+    print(f"图层渲染缓存: 命中 {stats['hits']} 次, 渲染 {stats['misses']} 次, 淘汰 {stats['evictions']} 次, "
+          f"峰值 {stats['peak_bytes'] / 1024 / 1024:.1f} MB")
+    renders.clear()
     
     print("\n" + "=" * 60)
     print("处理完成!")
     print("=" * 60)
+    
+    return {
+        'input': input_path,
+        'width': psd.width,
+        'height': psd.height,
+        'text_layers_removed': text_layer_count,
+        'ocr_layers_removed': ocr_layer_count,
+        'layers': exported,
+    }
+
+
+# 批量模式下每个工作进程各自持有一个OCR执行器和命中率统计, 由 _init_batch_worker 创建
+_batch_executor = None
+_batch_stats = None
+
+
+def find_psd_files(root, recursive=False):
+    """目录中的PSD/PSB文件(按路径排序)"""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(('.psd', '.psb')) and not name.startswith('.'):
+                found.append(os.path.join(dirpath, name))
+        if not recursive:
+            break
+    return found
+
+
+def _init_batch_worker(ocr_workers, ocr_batch_size, stats_path):
+    global _batch_executor, _batch_stats
+    _batch_executor = OCRExecutor(workers=ocr_workers, batch_size=ocr_batch_size)
+    _batch_stats = VariantStats(stats_path)
+
+
+def _process_batch_file(input_path, output_dir, skip_ocr, ocr_strategy, render_cache_bytes, lazy):
+    """
+    在工作进程中处理一个文件, 详细输出写入该文件输出目录下的 process.log
+    返回处理结果和本次产生的OCR命中率统计增量
+    """
+    runs, hits = list(_batch_stats.runs), list(_batch_stats.hits)
+    os.makedirs(output_dir, exist_ok=True)
+    input_name = os.path.splitext(os.path.basename(input_path))[0]
+    output_file = os.path.join(output_dir, f"{input_name}_layer.png")
+    start = time.perf_counter()
+    canvas, error = None, None
+    with open(os.path.join(output_dir, 'process.log'), 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        with PeakRSSMonitor() as memory:
+            try:
+                canvas = process_psd(input_path, output_file, skip_ocr, _batch_executor, ocr_strategy, _batch_stats,
+                                     render_cache_bytes, lazy)
+            except Exception as e:
+                error = str(e)
+                print(f"处理出错: {error}")
+    return {
+        'input': input_path,
+        'status': 'error' if error else 'success',
+        'error': error,
+        'elapsed_seconds': round(time.perf_counter() - start, 3),
+        'peak_rss_bytes': memory.peak_rss,
+        'canvas': canvas,
+        'variant_runs': [a - b for a, b in zip(_batch_stats.runs, runs)],
+        'variant_hits': [a - b for a, b in zip(_batch_stats.hits, hits)],
+    }
+
+
+def process_directory(input_dir, output_root, args):
+    """
+    并行处理目录中的所有PSD文件, 每个进程处理一个文件
+    每个文件输出到 output_root 下与输入相对路径同名的子目录, 最后写入 manifest.json
+    """
+    files = find_psd_files(input_dir, args.recursive)
+    if not files:
+        print(f"错误: 目录 {input_dir} 中没有PSD文件")
+        return 1
+    jobs = max(1, min(args.jobs or os.cpu_count() or 1, len(files)))
+    # tesseract进程总数保持与 --ocr-workers 一致, 平均分给各工作进程
+    ocr_workers = max(1, (args.ocr_workers or os.cpu_count() or 1) // jobs)
+    print(f"批量处理 {len(files)} 个PSD文件, {jobs} 个进程, 每个进程 {ocr_workers} 个tesseract进程\n")
+    
+    variant_stats = VariantStats(args.ocr_stats_file)
+    entries = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                             initargs=(ocr_workers, args.ocr_batch_size, args.ocr_stats_file)) as pool:
+        futures = {}
+        for path in files:
+            output_dir = os.path.join(output_root, os.path.splitext(os.path.relpath(path, input_dir))[0])
+            futures[pool.submit(_process_batch_file, path, output_dir, args.skip_ocr, args.ocr_strategy,
+                                args.render_cache_mb * 1024 * 1024, args.lazy)] = (path, output_dir)
+        for done, future in enumerate(as_completed(futures), 1):
+            path, output_dir = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                # 工作进程异常退出
+                entry = {'input': path, 'status': 'error', 'error': str(e), 'canvas': None}
+            entry['output_dir'] = os.path.relpath(output_dir, output_root)
+            variant_stats.merge(entry.pop('variant_runs', [0] * len(OCR_VARIANTS)), entry.pop('variant_hits', [0] * len(OCR_VARIANTS)))
+            canvas = entry.get('canvas')
+            if canvas:
+                for layer in canvas['layers']:
+                    layer['file'] = os.path.relpath(layer['file'], output_root)
+                print(f"[{done}/{len(files)}] ✓ {path}: {len(canvas['layers'])} 个图层, "
+                      f"删除 {canvas['text_layers_removed'] + canvas['ocr_layers_removed']} 个, {entry['elapsed_seconds']:.1f}s")
+            else:
+                print(f"[{done}/{len(files)}] ✗ {path}: {entry['error']}")
+            entries[path] = entry
+    variant_stats.save()
+    
+    ordered = [entries[path] for path in files]
+    failed = sum(1 for e in ordered if e['status'] != 'success')
+    manifest = {
+        'input_dir': input_dir,
+        'jobs': jobs,
+        'total': len(files),
+        'succeeded': len(files) - failed,
+        'failed': failed,
+        'elapsed_seconds': round(time.perf_counter() - start, 3),
+        'files': ordered,
+    }
+    manifest_path = os.path.join(output_root, 'manifest.json')
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"\n完成 {len(files) - failed}/{len(files)} 个文件, 耗时 {manifest['elapsed_seconds']:.1f}s, 清单已保存: {manifest_path}")
+    return 1 if failed else 0
 
 
 def main():
@@ -357,12 +754,32 @@ def main():
   
   # 仅删除文本图层,跳过OCR检测
   python3 process_psd.py input.psd output_dir/ --skip-ocr
+  
+  # 批量处理目录中的所有PSD, 4个进程并行, 结果清单写入 output_dir/manifest.json
+  python3 process_psd.py psd_dir/ output_dir/ --jobs 4
         """
     )
-    parser.add_argument('input', help='输入PSD文件路径')
+    parser.add_argument('input', help='输入PSD文件路径, 或包含PSD文件的目录(批量模式)')
     parser.add_argument('output', help='输出目录路径')
     parser.add_argument('--skip-ocr', action='store_true', 
                        help='跳过OCR检测,仅删除文本图层')
+    parser.add_argument('--ocr-workers', type=int, default=0,
+                       help='并发tesseract进程数(默认: CPU核数)')
+    parser.add_argument('--ocr-batch-size', type=int, default=8,
+                       help='每次tesseract调用处理的图像数(多页TIFF), 1表示逐张调用')
+    parser.add_argument('--ocr-strategy', choices=OCR_STRATEGIES, default='exhaustive',
+                       help='exhaustive: 跑完四种方法; early-exit: 按历史命中率排序, 达到阈值即停止; '
+                            'adaptive: 同early-exit, 运行中按命中率重新排序')
+    parser.add_argument('--ocr-stats-file', default=DEFAULT_VARIANT_STATS,
+                       help='各预处理方法历史命中率的保存位置(默认: %(default)s)')
+    parser.add_argument('--render-cache-mb', type=int, default=512,
+                       help='OCR与导出之间缓存图层图像的内存上限(MB), 0表示不缓存')
+    parser.add_argument('--lazy', action='store_true',
+                       help='以内存映射方式打开PSD/PSB, 图层数据在渲染时才读取(适合大文件)')
+    parser.add_argument('--jobs', type=int, default=0,
+                       help='批量模式下并行处理的文件数(进程数, 默认: CPU核数)')
+    parser.add_argument('--recursive', action='store_true',
+                       help='批量模式下同时处理子目录中的PSD文件')
     
     args = parser.parse_args()
     
@@ -377,11 +794,22 @@ def main():
         print(f"错误: 输出路径 {args.output} 必须是目录")
         sys.exit(1)
     
+    if os.path.isdir(args.input):
+        sys.exit(process_directory(args.input, args.output, args))
+    
     # 生成输出文件的基本名称
     input_name = os.path.splitext(os.path.basename(args.input))[0]
     output_file = os.path.join(args.output, f"{input_name}_layer.png")
     
-    process_psd(args.input, output_file, args.skip_ocr)
+    executor = OCRExecutor(workers=args.ocr_workers, batch_size=args.ocr_batch_size)
+    variant_stats = VariantStats(args.ocr_stats_file)
+    with PeakRSSMonitor() as memory:
+        process_psd(args.input, output_file, args.skip_ocr, executor, args.ocr_strategy, variant_stats,
+                    args.render_cache_mb * 1024 * 1024, args.lazy)
+    report = memory.report(os.path.getsize(args.input))
+    print(f"文件大小 {report['file_bytes'] / 1024 / 1024:.1f} MB, 峰值内存(RSS) {report['peak_rss_bytes'] / 1024 / 1024:.1f} MB "
+          f"(处理期间增加 {report['peak_rss_delta_bytes'] / 1024 / 1024:.1f} MB)")
+    variant_stats.save()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
-from rembg import remove
 from PIL import Image
 
+from app.services.rembg_pool import get_rembg_pool
+
 # 打开输入图片
 input_path = "/Users/xiaojiazi1/Downloads/产品 2.webp"
 output_path = "output.png"
@@ -8,7 +9,7 @@ output_path = "output.png"
 with open(input_path, "rb") as i:
     with open(output_path, "wb") as o:
         input_image = i.read()
-        output_image = remove(input_image)  # 自动去除背景
+        output_image = get_rembg_pool().remove(input_image)  # 自动去除背景(模型与线程数见 REMBG_* 配置)
         o.write(output_image)
 
 print("抠图完成！")
\ No newline at end of file